@@ -13,6 +13,8 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from game.middleware import invalidate_cached_user
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register_view(request):
@@ -56,6 +58,8 @@ def login_view(request):
     refresh = RefreshToken.for_user(user)
     if not refresh:
         return JsonResponse({'error': 'Token generation failed'}, status=400)
+    # Lets the websocket middleware build the user from the token alone
+    refresh['username'] = user.username
     return Response({
         'message': 'User created successfully',
         'user_id': user.id,   
@@ -76,6 +80,7 @@ class LogoutView(APIView):
 
             token = RefreshToken(refresh_token)
             token.blacklist()
+            invalidate_cached_user(request.user.id)
             
             return Response({'message': 'User logged out successfully'}, status=status.HTTP_200_OK)
             
@@ -84,6 +84,27 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
 }
 
+# Websocket authentication (game.middleware.JwtAuthMiddleware)
+# Resolved users are cached per user and token in this cache. Point it at a
+# shared cache (e.g. Redis) so logout invalidates it on every worker.
+WEBSOCKET_AUTH_CACHE = 'websocket_auth'
+# Build websocket users from the token claims without any database lookup
+WEBSOCKET_AUTH_TRUST_CLAIMS = False
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'websocket_auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'websocket-auth',
+        'TIMEOUT': 300,  # seconds a resolved user is trusted
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 ROOT_URLCONF = 'backend.urls'
 
 CORS_ALLOW_CREDENTIALS = True
@@ -125,9 +146,40 @@ DATABASES = {
         'PASSWORD': '12345',
         'HOST': 'localhost',  # or your database server
         'PORT': '5432',  # default PostgreSQL port
+        # Channels closes "old" connections around every database_sync_to_async
+        # call; keep them open between calls instead of reconnecting each time,
+        # and check them before reuse so a server restart isn't an error
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# With psycopg 3 installed, connections come from a pool instead (Django
+# requires CONN_MAX_AGE = 0 then). Threads that may hold a connection at the
+# same time: the shared sync thread, the GAME_EXECUTORS threads and one per
+# concurrent REST request, so size max_size for the expected request
+# concurrency plus those.
+DATABASE_POOL = {
+    'min_size': 2,
+    'max_size': 20,
+    'timeout': 10,  # seconds to wait for a free connection before failing
+    'max_idle': 300,
+}
+
+try:
+    import psycopg  # noqa: F401  pooling needs psycopg 3, psycopg2 can't do it
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    pass
+else:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            # check runs before a connection is handed out, like CONN_HEALTH_CHECKS
+            'pool': dict(DATABASE_POOL, check=ConnectionPool.check_connection),
+        },
+    })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -186,4 +238,90 @@ CHANNEL_LAYERS = {
 }
 
 WEBSOCKET_ACCEPT_TIMEOUT = 10  
-WEBSOCKET_DISCONNECT_TIMEOUT = 10
\ No newline at end of file
+WEBSOCKET_DISCONNECT_TIMEOUT = 10
+
+# Gameplay state is kept in memory per room and written back in batches
+# (seconds between a mutation and the write-behind flush)
+GAME_STATE_FLUSH_INTERVAL = 0.5
+
+# Failed flushes of a room are retried with exponential backoff; after this
+# many failures in a row its unsaved changes are logged and dropped
+GAME_STATE_FLUSH_ATTEMPTS = 8
+
+# Where live room state is kept. Use game.store.RedisGameStateStore to share
+# rooms between several ASGI workers, e.g.
+# GAME_STATE_STORE = {
+#     "BACKEND": "game.store.RedisGameStateStore",
+#     "OPTIONS": {"url": "redis://localhost:6379/1", "ttl": 86400},
+# }
+GAME_STATE_STORE = {
+    "BACKEND": "game.store.InMemoryGameStateStore",
+}
+
+# Seconds a worker may hold a room's lease while applying a gameplay action
+# with the Redis store, so workers apply actions on a room one at a time
+GAME_ROOM_LEASE_TTL = 5
+
+# Thread pools for sync work (see game/executors.py). Each admits threads +
+# max_queue calls at a time; past that it defers callers or rejects them
+# ("reject" refuses websocket handshakes when auth lookups back up).
+GAME_EXECUTORS = {
+    "auth": {"threads": 2, "max_queue": 200, "overflow": "reject"},
+    "gameplay": {"threads": 2, "max_queue": 1000, "overflow": "defer"},
+    "analytics": {"threads": 1, "max_queue": 2, "overflow": "defer"},
+}
+
+# Events kept per room for clients resuming after a reconnect; clients that
+# missed more get a snapshot of the room instead
+GAME_EVENT_LOG_SIZE = 128
+
+# Minimum seconds between reloads of a lobby's player directory when a
+# looked up player id is unknown
+GAME_DIRECTORY_RELOAD_INTERVAL = 5
+
+# Gameplay clients are expected to ping every GAME_HEARTBEAT_INTERVAL seconds;
+# sockets silent for GAME_HEARTBEAT_TIMEOUT seconds are closed by the server
+GAME_HEARTBEAT_INTERVAL = 30
+GAME_HEARTBEAT_TIMEOUT = 90
+
+# Create each round's row when the round is started instead of all of them
+# when the game starts
+GAME_LAZY_ROUNDS = False
+
+# Rooms untouched for GAME_ROOM_GC_INACTIVE seconds are deleted, with their
+# finished games archived, GAME_ROOM_GC_BATCH_SIZE rooms per transaction.
+# Run `manage.py gcrooms`, or set GAME_ROOM_GC_INTERVAL (seconds) to have the
+# ASGI workers collect periodically.
+GAME_ROOM_GC_INACTIVE = 86400
+GAME_ROOM_GC_BATCH_SIZE = 500
+GAME_ROOM_GC_INTERVAL = None
+
+# How the pack's ranking is scored against the wolf's: "positional",
+# "kendall", "footrule", "partial" or the dotted path of a rule (see game/scoring.py)
+GAME_SCORING_RULE = "positional"
+
+# Leaderboard pages are cached in this cache for up to
+# GAME_LEADERBOARD_CACHE_SECONDS, and dropped whenever a game ends
+GAME_LEADERBOARD_CACHE = 'default'
+GAME_LEADERBOARD_CACHE_SECONDS = 30
+
+# Seconds each gameplay phase may last before the server advances it
+GAME_PHASE_SECONDS = {
+    "wolf_selection": 120,
+    "pack_selection": 120,
+    "waiting_to_start": 30,
+}
+
+# Room codes: sequence numbers reserved per database round trip, and how long
+# a closed room's code is held back before it is handed out again (seconds)
+ROOM_CODE_BLOCK_SIZE = 100
+ROOM_CODE_REUSE_DELAY = 86400
+
+# Per-message and per-query metrics, served at /api/game/metrics/ to staff
+# users and to Prometheus scrapers sending "Authorization: Bearer
+# <GAME_METRICS_TOKEN>" (left as None, only staff can read them). Admins can
+# sample stacks through /api/game/profiler/ every GAME_PROFILER_INTERVAL
+# seconds, or the interval (at least 1ms) they start the profiler with.
+GAME_INSTRUMENTATION = True
+GAME_METRICS_TOKEN = None
+GAME_PROFILER_INTERVAL = 0.005
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class GameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'game'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if getattr(settings, 'GAME_INSTRUMENTATION', True):
+            from django.db.backends.signals import connection_created
+            from .instrumentation import install_query_counter
+            connection_created.connect(install_query_counter)
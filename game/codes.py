@@ -0,0 +1,99 @@
+# codes.py
+"""
+Room code allocation.
+
+Codes are 6 characters from A-Z0-9, i.e. indices into a space of 36^6. A
+keyed Feistel network permutes that space, so feeding it consecutive
+sequence numbers yields codes that look random but can never collide, and
+allocating one never needs an existence check.
+
+Sequence numbers are reserved from the database in blocks (one UPDATE per
+ROOM_CODE_BLOCK_SIZE rooms per process). Codes of closed rooms are recycled
+by the process that closed them, once ROOM_CODE_REUSE_DELAY seconds have
+passed so that no live state for the old room can still be around.
+"""
+import hashlib
+import string
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import RoomCodeSequence
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+HALF = len(ALPHABET) ** (CODE_LENGTH // 2)
+SPACE = HALF * HALF
+FEISTEL_ROUNDS = 4
+
+
+def _round_function(value, round_index, key):
+    digest = hashlib.blake2b(f'{round_index}:{value}'.encode(), key=key, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % HALF
+
+
+def permute(index, key):
+    """Bijection of range(SPACE) onto itself"""
+    left, right = divmod(index % SPACE, HALF)
+    for round_index in range(FEISTEL_ROUNDS):
+        left, right = right, (left + _round_function(right, round_index, key)) % HALF
+    return left * HALF + right
+
+
+def encode(value):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def reserve_block(size):
+    """Reserve size sequence numbers and return the first one"""
+    with transaction.atomic():
+        sequence, _ = RoomCodeSequence.objects.select_for_update().get_or_create(pk=1)
+        start = sequence.next_value
+        sequence.next_value = start + size
+        sequence.save(update_fields=['next_value'])
+    return start
+
+
+class RoomCodeAllocator:
+
+    def __init__(self, block_size=None, key=None):
+        self.block_size = block_size
+        self.key = key
+        self._next = 0
+        self._end = 0
+        self._released = deque()
+        self._lock = threading.Lock()
+
+    def _get_key(self):
+        if self.key is None:
+            self.key = hashlib.sha256(('room-codes:' + settings.SECRET_KEY).encode()).digest()
+        return self.key
+
+    def allocate(self):
+        """Return an unused room code"""
+        with self._lock:
+            delay = getattr(settings, 'ROOM_CODE_REUSE_DELAY', 86400)
+            if self._released and self._released[0][0] + delay <= time.time():
+                return self._released.popleft()[1]
+            if self._next >= self._end:
+                size = self.block_size or getattr(settings, 'ROOM_CODE_BLOCK_SIZE', 100)
+                self._next = reserve_block(size)
+                self._end = self._next + size
+            index = self._next
+            self._next += 1
+        return encode(permute(index, self._get_key()))
+
+    def release(self, code):
+        """Hand the code of a deleted room back for reuse"""
+        with self._lock:
+            self._released.append((time.time(), code))
+
+
+room_codes = RoomCodeAllocator()
@@ -1,588 +1,278 @@
 # consumers.py
-import json
 import time
-from asgiref.sync import async_to_sync, sync_to_async
-from channels.generic.websocket import WebsocketConsumer
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.db import database_sync_to_async
-from .models import Room, Player, Round, Game
-from django.contrib.auth.models import User
-import random
-import asyncio
+from .models import Room, Round, Game
+from . import directory, engine
+from .dispatch import apply_action, arm_phase_timer, catch_up, release_room
+from .heartbeat import heartbeats
+from .lifecycle import room_collector
+from .store import room_states
+import logging
 
-class GameLobbyConsumer(AsyncJsonWebsocketConsumer):
+from .instrumentation import measure
+from .groups import GAME, LOBBY, RoomGroupsMixin, broadcast
+from .protocol import JsonCodec, ProtocolError, Roster, choose_codec, event_message
+
+logger = logging.getLogger(__name__)
+
+# Message types measured under their own name, anything else counts as "unknown"
+MEASURED_MESSAGES = {'ping', 'resume', 'start_round', 'change_status', 'wolf_order', 'pack_order'}
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+
+
+class NegotiatedProtocolMixin:
+    """
+    Speaks the wire format negotiated through the websocket subprotocol (see
+    protocol.py) in send_json and receive_json, so handlers stay format agnostic.
+    """
+    codec = JsonCodec()
+    roster = None
+
+    async def accept_negotiated(self):
+        self.codec = choose_codec(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.codec.subprotocol)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        data = bytes_data if self.codec.binary else text_data
+        if data is None:
+            return
+        try:
+            content = self.codec.decode(data, self.roster)
+        except ProtocolError as e:
+            await self.send_json({
+                'type': 'error',
+                'message': str(e)
+            })
+            return
+        await self.receive_json(content, **kwargs)
+
+    async def send_json(self, content, close=False):
+        data = self.codec.encode(content, self.roster)
+        if self.codec.binary:
+            await self.send(bytes_data=data, close=close)
+        else:
+            await self.send(text_data=data, close=close)
+
+    async def send_event(self, event):
+        """Forward a channel layer event, reusing the frame encoded at group_send time if it fits"""
+        frames = event.get('frames')
+        roster = self.roster.ids if self.roster is not None else None
+        if frames is None or (self.codec.binary and frames['roster'] != roster):
+            await self.send_json(event_message(event))
+        elif self.codec.binary:
+            await self.send(bytes_data=frames['bytes'])
+        else:
+            await self.send(text_data=frames['text'])
+
+
+class GameLobbyConsumer(RoomGroupsMixin, NegotiatedProtocolMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
-        print(f"User connecting: {self.user}")
-
         if self.user.is_anonymous:
-            print("User is anonymous, closing connection.")
+            logger.debug("Rejected anonymous websocket connection")
             await self.close()
             return
 
-        print("Connection accepted!")
-        await self.accept()
+        await self.accept_negotiated()
+        room_collector.ensure_started()
 
         self.room_code = self.scope['url_route']['kwargs']['room_code']
-        self.room_group_name = f'lobby_{self.room_code}'
-        
-        # Join room group (Await directly)
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        directory.players.acquire(self.room_code)
+
+        # Join the room's lobby group
+        await self.join_room_group(LOBBY, self.room_code)
         
         # Send notification that the user has joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'player_joined',
-                'player': self.user.username
-            }
-        )
+        await broadcast(self.room_code, {
+            'type': 'player_joined',
+            'player': self.user.username
+        }, [LOBBY])
         
         # After join notification, send updated player count to everyone
-        players = await self.get_players_in_room()
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'player_count',
-                'count': len(players)
-            }
-        )
+        count = await self.get_player_count()
+        await broadcast(self.room_code, {
+            'type': 'player_count',
+            'count': count
+        }, [LOBBY])
     
-    @database_sync_to_async
-    def get_players_in_room(self):
-        """Get list of players in the current room"""
-        try:
-            room = Room.objects.get(code=self.room_code)
-            return list(room.players.all())
-        except Room.DoesNotExist:
-            return []
+    async def get_player_count(self):
+        """Get the number of players in the current room"""
+        with measure('async', 'GameLobbyConsumer.get_player_count'):
+            count = await Room.objects.filter(code=self.room_code).values_list('player_count', flat=True).afirst()
+        return count or 0
     
     async def disconnect(self, close_code):
         if not hasattr(self, 'user') or self.user.is_anonymous:
             return
         
-        # Leave room group (Await directly)
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        directory.players.release(self.room_code)
+        await self.leave_room_groups()
         
         # Notify others that player has left
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'player_left',
-                'player': self.user.username
-            }
-        )
+        await broadcast(self.room_code, {
+            'type': 'player_left',
+            'player': self.user.username
+        }, [LOBBY])
 
     async def receive_json(self, content):
         message_type = content.get('type')
-        print(f"Received message: {content}")
         
         if message_type == 'game_start':
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'game_start_message',
-                    'message': 'Game is starting!'
-                }
-            )
+            await broadcast(self.room_code, {
+                'type': 'game_start_message',
+                'message': 'Game is starting!'
+            }, [LOBBY])
         
         # Use receive_json instead of receive for better JSON handling
         elif message_type == 'player_joined':
             player_id = content.get('player')
             player = await self.get_player(player_id)
             if player:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'player_joined',
-                        'player': player
-                    }
-                )
-
-    @database_sync_to_async
-    def get_player(self, player_id):
-        try:
-            player = Player.objects.get(id=player_id)
-            return player.user.username
-        except Player.DoesNotExist:
-            return None
+                await broadcast(self.room_code, {
+                    'type': 'player_joined',
+                    'player': player
+                }, [LOBBY])
+
+    async def get_player(self, player_id):
+        return await directory.players.username(self.room_code, player_id)
 
     # Handler for player_joined messages
     async def player_joined(self, event):
         # Send message to WebSocket
-        await self.send_json({
-            'type': 'player_joined',
-            'player': event['player']
-        })
+        await self.send_event(event)
     
     async def player_left(self, event):
         # Send message to WebSocket when a player leaves
-        await self.send_json({
-            'type': 'player_left',
-            'player': event['player']
-        })
+        await self.send_event(event)
     
     async def player_count(self, event):
         # Send player count to WebSocket
-        await self.send_json({
-            'type': 'player_count',
-            'count': event['count']
-        })
+        await self.send_event(event)
     
     # Receive message from room group
     async def game_start_message(self, event):
         # Send message to WebSocket
-        await self.send_json({
-            'type': 'game_start',
-            'message': event['message']
-        })
+        await self.send_event(event)
 
 
-class GameplayConsumer(AsyncJsonWebsocketConsumer):
-    
+class GameplayConsumer(RoomGroupsMixin, NegotiatedProtocolMixin, AsyncJsonWebsocketConsumer):
+    replayed_seq = None
+
     async def connect(self):
         self.user = self.scope["user"]
-        print(f"User connecting: {self.user}")
-
         if self.user.is_anonymous:
-            print("User is anonymous, closing connection.")
+            logger.debug("Rejected anonymous websocket connection")
             await self.close()
             return
 
         self.last_ping = time.time()
         self.is_connected = True
         
-        print("Connection accepted!")
-        await self.accept()
+        await self.accept_negotiated()
+        heartbeats.register(self)
+        room_collector.ensure_started()
 
         self.room_code = self.scope['url_route']['kwargs']['room_code']
-        self.room_group_name = f'lobby_{self.room_code}'
-        
-        # Join room group (Await directly)
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+
+        # Join the room's gameplay group
+        await self.join_room_group(GAME, self.room_code)
+
+        # Load the room state once for every socket in this room, and pick up
+        # its phase deadline in case the worker that owned it went away
+        self.has_state = True
+        try:
+            state = await room_states.acquire(self.room_code)
+        except Room.DoesNotExist:
+            pass
+        else:
+            arm_phase_timer(self.room_code, state.phase_deadline)
+            if self.codec.binary:
+                # Binary clients refer to players by their index in this roster
+                self.roster = Roster(state.players.values())
+                await self.send_json({
+                    'type': 'roster',
+                    'players': self.roster.players
+                })
     
     async def disconnect(self, close_code):
         # Mark as disconnected to stop background tasks
         self.is_connected = False
+        heartbeats.unregister(self)
+
+        if getattr(self, 'has_state', False):
+            await release_room(self.room_code)
         
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        was_in_room = bool(self.room_groups)
+        await self.leave_room_groups()
         
         # Notify other users
-        user = self.scope.get('user')
-        if user and not user.is_anonymous:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'player_left',
-                    'username': user.username,
-                }
-            )
+        if was_in_room:
+            await broadcast(self.room_code, {
+                'type': 'player_left',
+                'player': self.user.username
+            }, [GAME])
     
     
     async def receive_json(self, content):
+        # Any frame from the client shows it is still there, not just pings
+        self.last_ping = time.time()
         message_type = content.get('type')
-        print("Received message: ", content)
-        
+        name = message_type if message_type in MEASURED_MESSAGES else 'unknown'
+        with measure('message', name):
+            await self.handle_message(message_type, content)
+
+    async def handle_message(self, message_type, content):
         if message_type == 'ping':
-                self.last_ping = time.time()
-                await self.send(text_data=json.dumps({
+                await self.send_json({
                     'type': 'pong'
-                }))
+                })
                 return
         
+        # Clients may tag actions with an idempotency key so a retried message is applied once
+        key = self.action_key(content.get('idempotency_key'))
+
         if message_type == 'start_round':
             round_number = content.get('round_number')
-            await self.start_round(round_number)
+            await self.start_round(round_number, key)
         
         elif message_type == 'change_status':
             status = content.get('status')
             round_number = content.get('round_number')
-            await self.change_status(status, round_number)
+            await self.change_status(status, round_number, key)
         
         elif message_type == 'wolf_order':
             order = content.get('order')
             round_number = content.get('round_number')
-            await self.submit_wolf_order(order, round_number)
+            await self.submit_wolf_order(order, round_number, key)
         
         elif message_type == 'pack_order':
             order = content.get('order')
             round_number = content.get('round_number')
-            await self.submit_pack_order(order, round_number)
+            await self.submit_pack_order(order, round_number, key)
+
+        elif message_type == 'resume':
+            await self.resume(content.get('last_seq'))
 
         else:
-            print("Unknown message type:", message_type)
+            logger.debug("Unknown message type: %s", message_type)
             # Handle unknown message type if necessary
             pass
 
-    @database_sync_to_async
-    def get_room(self, room_code):
-        return Room.objects.get(code=room_code)
-    
-    @database_sync_to_async
-    def get_round(self, room, round_number):
-        return Round.objects.get(room=room, round_number=round_number)
-    
-    @database_sync_to_async
-    def get_rounds(self, room):
-        return list(Round.objects.filter(room=room))
-    
-    @database_sync_to_async
-    def get_game(self, room):
-        return Game.objects.get(room=room)
-    
-    @database_sync_to_async
-    def save_round(self, current_round):
-        current_round.save()
-    
-    @database_sync_to_async
-    def save_game(self, game):
-        game.save()
-    
-    @database_sync_to_async
-    def get_eligible_players(self, room, wolfed_users):
-        players = list(room.players.all())
-        return [player for player in players if player.user.id not in wolfed_users]
-    
-    @database_sync_to_async
-    def get_all_players(self, room):
-        return list(room.players.all())
-    
-    @database_sync_to_async
-    def get_all_players_count(self, room):
-        return room.players.count()
-    
-    @database_sync_to_async
-    def get_players_exclude_wolf(self, room, wolf_user):
-        return list(room.players.exclude(user=wolf_user).order_by('score'))
-    
-    @database_sync_to_async
-    def update_player_scores(self, room, wolf_user, pack_score):
-        for player in room.players.exclude(user=wolf_user.wolf):
-            player.score += pack_score
-            player.save()
-    
-    @database_sync_to_async
-    def is_user_host(self, room, user):
-        return room.host == user
-    
-    @database_sync_to_async
-    def check_valid_submitter(self, room, current_round, user):
-        # Check if the user is the host (or the lowest scoring player if host is wolf)
-        if room.host == user and current_round.wolf != user:
-            return True
-        elif room.host == current_round.wolf:
-            # Find the lowest scoring player who isn't the wolf
-            players = list(room.players.exclude(user=current_round.wolf).order_by('score'))
-            if players and players[0].user == user:
-                return True
-        return False
-    
-    @database_sync_to_async
-    def create_wolf_rankings(self, current_round, room, wolfed_users):
-        # Get players
-        players = list(room.players.all())
-        eligible_players = [player for player in players if player.user.id not in wolfed_users]
-        
-        # If all players have been wolf, reset the wolf list
-        if not eligible_players:
-            return [], players
-        
-        return eligible_players, None
-    
-    async def start_round(self, round_number):
-        try:
-            print("meow")
-            room = await self.get_room(self.room_code)
-            
-            # Check if the user is the host - use our async helper method
-            is_host = await self.is_user_host(room, self.user)
-            if not is_host:
-                print("User is not the host, cannot start round.")
-                await self.send_json({
-                    'type': 'error',
-                    'message': 'Only the host can start the round'
-                })
-                return
-            
-            print("hi")
-            game = await self.get_game(room)
-            
-            # Check if the game should end
-            players_count = await self.get_all_players_count(room)
-            all_rounds_complete = await self.check_all_rounds_complete(room, players_count)
-            
-            if round_number > players_count and all_rounds_complete:
-                # Game is ending, collect statistics
-                game_stats = await self.collect_game_statistics(room)
-                
-                # Update game status
-                game.round_status = "game_ended"
-                await self.save_game(game)
-                
-                # Send game end message to all clients
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'game_end_message',
-                        'statistics': game_stats
-                    }
-                )
-                print("Game has ended! Statistics sent to all players")
-                return
-            
-            current_round = await self.get_round(room, round_number)
-            print("done")
-            wolfed_users = game.wolfed_users
-            
-            eligible_players, all_players = await self.create_wolf_rankings(current_round, room, wolfed_users)
-            print("noo")
-            
-            # If all players have been wolf, reset the wolf list
-            if not eligible_players:
-                game.wolfed_users = []
-                await self.save_game(game)
-                eligible_players = await self.get_all_players(room)
-            elif all_players:
-                eligible_players = all_players
-            
-            chosen_player = random.choice(eligible_players)
-            current_round.wolf = chosen_player.user
-
-            print("Chosen player: ", chosen_player.user.username)
-            await self.save_round(current_round)
-            
-            # Update wolf list
-            wolfed_users.append(chosen_player.user.id)
-            game.wolfed_users = wolfed_users
-
-            game.round_status = "wolf_selection"
-            print("ornt : ", game)
-            await self.save_game(game)
-            
-            # Get a question for the round
-            questions = [
-                "Rank these foods from most to least delicious",
-                "Rank these movies from best to worst",
-                "Rank these vacation destinations from most to least desirable",
-                "Rank these sports from most to least exciting",
-                "Rank these animals from most to least dangerous"
-            ]
-            current_round.question = random.choice(questions)
-            await self.save_round(current_round)
-            
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'round_start_message',
-                    'round_number': round_number,
-                    'wolf_id': current_round.wolf.username,
-                    'question': current_round.question
-                }
-            )
-
-            print("Round started!", game, current_round, chosen_player.user.username)
-            
-            # Start wolf timer (2 minutes)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'wolf_timer_message',
-                    'round_number': round_number,
-                    'time': 120  # 2 minutes in seconds
-                }
-            )
-            
-        except Room.DoesNotExist:
-            await self.send_json({
-                'type': 'error',
-                'message': 'Room not found'
-            })
-        except Round.DoesNotExist:
-            await self.send_json({
-                'type': 'error',
-                'message': 'Round not found'
-            })
-
-    # Helper methods needed for game ending logic
-    async def get_player_count(self, room):
-        """Get the number of players in the room"""
-        return await Player.objects.filter(room=room).count()
-
-    async def check_all_rounds_complete(self, room, player_count):
-        """Check if all rounds have values and scores populated"""
-        rounds = await self.get_rounds(room)
-        
-        # Check if we have the expected number of rounds and they all have scores
-        if len(rounds) < player_count:
-            return False
-        
-        for round_obj in rounds:
-            # Check if this round has scores and values populated
-            if round_obj.wolf_ranking is None or round_obj.pack_ranking is None:
-                return False
-        
-        return True
-    
-    @database_sync_to_async
-    def collectactual_game_statistics(self, players, rounds):
-        statistics = {
-            'players': {},
-            'round_data': [],
-            'winners': [],
-            # 'total_rounds': roundlend
-        }
-        
-        # Collect individual player scores
-        for player in players:
-            player_stats = {
-                'username': player.user.username,
-                'total_score': player.score,
-                'round_scores': [],
-                'rounds_as_wolf': 0,
-            }
-            for round_obj in rounds:
-                        
-                # Track if player was wolf
-                if round_obj.wolf and round_obj.wolf.id == player.user.id:
-                    player_stats['rounds_as_wolf'] += 1
-                else:
-                    player_stats['round_scores'].append(round_obj.pack_score)
-            
-            statistics['players'][player.user.username] = player_stats
-               
-        
-        # Collect round data
-        for round_obj in rounds:
-            round_data = {
-                'round_number': round_obj.round_number,
-                'question': round_obj.question,
-                'wolf': round_obj.wolf.username if round_obj.wolf else None,
-                'scores': round_obj.pack_score
-            }
-            statistics['round_data'].append(round_data)
-        
-        max_score = max([player.score for player in players])
-        winners = [player.user.username for player in players if player.score == max_score]
-        statistics['winners'] = winners
-        # statistics['players'] = {player.user.username: player_stats for player, player_stats in zip(players, statistics['players'].values())}
-        
-        return statistics
-
-    async def collect_game_statistics(self, room):
-        """Collect statistics for the game"""
-        players = room.players.all()
-        rounds = Round.objects.filter(room=room).all()
-        # roundlend = await Round.objects.filter(room=room).count()
-        
-        statistics = await self.collectactual_game_statistics(players, rounds)
-        return statistics
-        
-
-    # You'll also need to add a handler for the game_end_message
-    async def game_end_message(self, event):
-        """Send game end message to WebSocket"""
-        await self.send_json({
-            'type': 'game_end',
-            'statistics': event['statistics']
-        })
-
-    async def change_status(self, status, round_number):
-        try:
-            room = await self.get_room(self.room_code)
-            game = await self.get_game(room)
-
-            game.round_status = status
-            await self.save_game(game)
-            
-            # Notify everyone about the status change
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'status_change_message',
-                    'round_number': round_number,
-                    'status': status
-                }
-            )
-            
-        except Room.DoesNotExist:
-            await self.send_json({
-                'type': 'error',
-                'message': 'Room not found'
-            })
-    
-    @database_sync_to_async
-    def get_wolf_from_round(self, current_round):
-        """Get the wolf user from a round object"""
-        # Force the related object to be loaded in the sync context
-        return current_round.wolf
-    
-    @database_sync_to_async
-    def get_first_user(self, players, wolf_user):
-        if players[0].user != wolf_user:
-            return players[0].user
-        else:
-            return players[1].user
+    def action_key(self, idempotency_key):
+        """The client's idempotency key scoped to its user, or None if it sent no usable key"""
+        if isinstance(idempotency_key, bool) or not isinstance(idempotency_key, (str, int)):
+            return None
+        idempotency_key = str(idempotency_key)
+        if not idempotency_key or len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return None
+        return f'{self.user.id}:{idempotency_key}'
 
-    async def submit_wolf_order(self, order, round_number):
+    async def run_action(self, action, *args, key=None):
+        """Apply a gameplay action to this room, reporting failures to the sender"""
         try:
-            room = await self.get_room(self.room_code)
-            current_round = await self.get_round(room, round_number)
-            game = await self.get_game(room)
-            
-            # Get the wolf user properly in async context
-            wolf_user = await self.get_wolf_from_round(current_round)
-            
-            # Now get players excluding the wolf
-            players = await self.get_players_exclude_wolf(room, wolf_user)
-            
-            submitter = await self.get_first_user(players, wolf_user)
-
-            if not submitter:
-                await self.send_json({
-                    'type': 'error',
-                    'message': 'No players available to submit the order'
-                })
-                return
-            
-            # Check if the user is the wolf
-            if wolf_user != self.user:
-                await self.send_json({
-                    'type': 'error',
-                    'message': 'Only the wolf can submit the order'
-                })
-                return
-            
-            # Save the wolf's ranking
-            current_round.wolf_ranking = order
-            await self.save_round(current_round)
-
-            game.round_status = "pack_selection"
-            await self.save_game(game)
-            
-            # Notify everyone that the wolf has submitted their order
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'wolf_order_message',
-                    'round_number': round_number,
-                    'submitter': submitter.username,
-                }
-            )
-            
+            await apply_action(self.room_code, action, *args, key=key)
         except Room.DoesNotExist:
             await self.send_json({
                 'type': 'error',
@@ -598,119 +288,85 @@ class GameplayConsumer(AsyncJsonWebsocketConsumer):
                 'type': 'error',
                 'message': 'Game not found'
             })
-    
-    async def submit_pack_order(self, order, round_number):
-        try:
-            room = await self.get_room(self.room_code)
-            current_round = await self.get_round(room, round_number)
-            game = await self.get_game(room)
-            
-            # Check if user is valid submitter using our async helper
-            # valid_submitter = await self.check_valid_submitter(room, current_round, self.user)
-            
-            # if not valid_submitter:
-            #     await self.send_json({
-            #         'type': 'error',
-            #         'message': 'You are not authorized to submit the pack order'
-            #     })
-            #     return
-            
-            # Save the pack's ranking
-            current_round.pack_ranking = order
-            
-            # Calculate score based on similarity between wolf and pack rankings
-            wolf_ranking = current_round.wolf_ranking
-            pack_score = 0
-            
-            # Simple scoring: +1 for each matching position
-            for item, position in order.items():
-                if wolf_ranking.get(item) == position:
-                    pack_score += 1
-            
-            current_round.pack_score = pack_score
-            await self.save_round(current_round)
-            
-            # Each pack member gets points equal to the pack score
-            if pack_score > 0:
-                await self.update_player_scores(room, current_round, pack_score)
-            
-            # Wolf never gets points
-
-            game.round_status = "round_completed"
-            game.current_round += 1
-            game.round_status = "waiting_to_start"
-            await self.save_game(game)
-            
-            wolf_order = await self.get_usernames(current_round.wolf_ranking)
-            pack_order = await self.get_usernames(current_round.pack_ranking)
-            # Notify everyone about the results
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'round_result_message',
-                    'round_number': round_number,
-                    'wolf_order': wolf_order,
-                    'pack_order': pack_order,
-                    'pack_score': pack_score
-                }
-            )
-            
-        except Room.DoesNotExist:
+        except engine.ActionRejected as e:
             await self.send_json({
                 'type': 'error',
-                'message': 'Room not found'
+                'message': str(e)
             })
-        except Round.DoesNotExist:
+
+    async def resume(self, last_seq):
+        """Send a reconnecting client the events it missed since last_seq, or a snapshot"""
+        try:
+            last_seq = int(last_seq) if last_seq is not None else None
+        except (TypeError, ValueError):
+            last_seq = None
+
+        try:
+            events, snapshot = await catch_up(self.room_code, last_seq)
+        except Room.DoesNotExist:
             await self.send_json({
                 'type': 'error',
-                'message': 'Round not found'
+                'message': 'Room not found'
             })
-    
-    @database_sync_to_async
-    def get_usernames(self, orders):
-        """Get usernames from orders"""
-        result = {}
-        for item, position in orders.items():
-            player = Player.objects.get(id=item)
-            result[item] = player.user.username
-        return result
+            return
+
+        self.replayed_seq = None
+        if snapshot is not None:
+            await self.send_json(snapshot)
+            self.replayed_seq = snapshot['seq']
+        else:
+            for event in events:
+                await super().send_event(event)
+            self.replayed_seq = events[-1]['seq'] if events else last_seq
+
+    async def send_event(self, event):
+        # Skip live events that a resume already sent
+        seq = event.get('seq')
+        if self.replayed_seq is not None and seq is not None:
+            if seq <= self.replayed_seq:
+                return
+            self.replayed_seq = None
+        await super().send_event(event)
+
+    async def start_round(self, round_number, key=None):
+        await self.run_action(engine.start_round, self.user.id, round_number, key=key)
 
+    async def change_status(self, status, round_number, key=None):
+        await self.run_action(engine.change_status, status, round_number, key=key)
+
+    async def submit_wolf_order(self, order, round_number, key=None):
+        await self.run_action(engine.submit_wolf_order, self.user.id, order, round_number, key=key)
+
+    async def submit_pack_order(self, order, round_number, key=None):
+        await self.run_action(engine.submit_pack_order, order, round_number, key=key)
+
+    async def player_left(self, event):
+        await self.send_event(event)
+
+    async def heartbeat_expired(self, event):
+        """Sent by the heartbeat reaper when the client has stopped pinging"""
+        await self.close(code=4408)
+        await self.websocket_disconnect({'type': 'websocket.disconnect', 'code': 4408})
+
+    async def game_end_message(self, event):
+        """Send game end message to WebSocket"""
+        await self.send_event(event)
 
     # Message handlers
     async def round_start_message(self, event):
-        await self.send_json({
-            'type': 'round_start',
-            'round_number': event['round_number'],
-            'wolf_id': event['wolf_id'],
-            'question': event['question']
-        })
+        await self.send_event(event)
     
     async def wolf_timer_message(self, event):
-        await self.send_json({
-            'type': 'wolf_timer',
-            'round_number': event['round_number'],
-            'time': event['time']
-        })
+        await self.send_event(event)
+    
+    async def pack_timer_message(self, event):
+        await self.send_event(event)
     
     async def wolf_order_message(self, event):
-        await self.send_json({
-            'type': 'wolf_order',
-            'round_number': event['round_number'],
-            'submitter': event['submitter']
-        })
+        await self.send_event(event)
     
     async def round_result_message(self, event):
-        await self.send_json({
-            'type': 'round_result',
-            'round_number': event['round_number'],
-            'wolf_order': event['wolf_order'],
-            'pack_order': event['pack_order'],
-            'pack_score': event['pack_score']
-        })
+        await self.send_event(event)
     
     async def status_change_message(self, event):
-        await self.send_json({
-            'type': 'status_change',
-            'round_number': event['round_number'],
-            'status': event['status']
-        })
\ No newline at end of file
+        await self.send_event(event)
\ No newline at end of file
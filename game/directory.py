@@ -0,0 +1,103 @@
+# directory.py
+"""
+Per-room player directory shared by every consumer in a worker.
+
+Maps each player id of a room to the player's user id and username. It is
+built with one query the first time a room is looked up. After that it is
+kept current from the m2m_changed signal of Room.players, so lookups are
+dict reads. Another worker may add a player without this one hearing about
+it, so a lookup that misses reloads the room, at most once every
+GAME_DIRECTORY_RELOAD_INTERVAL seconds so unknown ids can't flood the
+database. A room is dropped when its last lobby socket in this worker leaves.
+"""
+import time
+
+from django.conf import settings
+
+from .instrumentation import measure
+from .models import Player
+
+
+class PlayerEntry:
+    __slots__ = ('user_id', 'username')
+
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+
+
+async def load_room_players(room_code):
+    with measure('async', 'load_room_players'):
+        return {
+            player_id: PlayerEntry(user_id, username)
+            async for player_id, user_id, username in (
+                Player.objects
+                .filter(players__code=room_code)
+                .values_list('id', 'user_id', 'user__username')
+            )
+        }
+
+
+class PlayerDirectory:
+
+    def __init__(self, reload_interval=None):
+        if reload_interval is None:
+            reload_interval = getattr(settings, 'GAME_DIRECTORY_RELOAD_INTERVAL', 5)
+        self.reload_interval = reload_interval
+        self.rooms = {}  # room code -> {player id: PlayerEntry}
+        self.connections = {}  # room code -> lobby sockets in this worker
+        self.reloaded = {}  # room code -> time of the last reload after a miss
+
+    def acquire(self, room_code):
+        """Register a lobby socket for the room"""
+        self.connections[room_code] = self.connections.get(room_code, 0) + 1
+
+    def release(self, room_code):
+        """Drop a lobby socket, forgetting the room after this worker's last one"""
+        remaining = self.connections.get(room_code, 0) - 1
+        if remaining > 0:
+            self.connections[room_code] = remaining
+            return
+        self.connections.pop(room_code, None)
+        self.forget(room_code)
+
+    async def players(self, room_code, reload=False):
+        entries = self.rooms.get(room_code)
+        if entries is None or reload:
+            entries = self.rooms[room_code] = await load_room_players(room_code)
+        return entries
+
+    async def get(self, room_code, player_id):
+        """The PlayerEntry for a player of the room, or None"""
+        try:
+            player_id = int(player_id)
+        except (TypeError, ValueError):
+            return None
+        entry = (await self.players(room_code)).get(player_id)
+        if entry is None:
+            now = time.monotonic()
+            if now - self.reloaded.get(room_code, float('-inf')) >= self.reload_interval:
+                self.reloaded[room_code] = now
+                entry = (await self.players(room_code, reload=True)).get(player_id)
+        return entry
+
+    async def username(self, room_code, player_id):
+        entry = await self.get(room_code, player_id)
+        return entry.username if entry else None
+
+    def add(self, room_code, player_id, user_id, username):
+        entries = self.rooms.get(room_code)
+        if entries is not None:
+            entries[player_id] = PlayerEntry(user_id, username)
+
+    def remove(self, room_code, player_id):
+        entries = self.rooms.get(room_code)
+        if entries is not None:
+            entries.pop(player_id, None)
+
+    def forget(self, room_code):
+        self.rooms.pop(room_code, None)
+        self.reloaded.pop(room_code, None)
+
+
+players = PlayerDirectory()
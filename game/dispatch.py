@@ -0,0 +1,131 @@
+# dispatch.py
+"""
+Runs engine actions against a room on behalf of a websocket consumer or a
+server-side timer: apply the action atomically, queue the state for
+persistence, broadcast the resulting events and (re)arm the room's phase
+deadline.
+
+Actions on one room run one at a time (see locks.py). Clients may tag an
+action with an idempotency key. The keys of recent actions are kept in the
+room state, so a retried message is recognised inside the same store update
+that would apply it, without a database read.
+"""
+import logging
+
+from . import engine, leaderboard
+from .groups import GAME, broadcast
+from .instrumentation import database_sync_to_async, measure
+from .locks import serialized
+from .models import Room, Round, Game
+from .protocol import Roster
+from .store import room_states
+from .timers import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+# One timer wheel per worker owns the phase deadlines of every room it serves
+phase_timers = TimerWheel()
+
+
+def run_once(state, action, args, key):
+    """
+    Run action on the state unless an action with the same idempotency key
+    already ran. Returns (events, phase deadline, roster), roster being None
+    for a duplicate.
+    """
+    if key is not None and key in state.action_keys:
+        return [], state.phase_deadline, None
+    events = state.sequence(action(state, *args))
+    if key is not None:
+        state.remember_action(key)
+    return events, state.phase_deadline, Roster(state.players.values())
+
+
+async def apply_action(room_code, action, *args, key=None):
+    """
+    Apply an engine action to a room and broadcast its events. Returns the
+    events, or None if key is the idempotency key of an action already applied.
+    """
+    async with serialized(room_states, room_code):
+        return await _apply_action(room_code, action, args, key)
+
+
+async def _apply_action(room_code, action, args, key):
+    events, deadline, roster = await room_states.update(
+        room_code, lambda state: run_once(state, action, args, key))
+    if roster is None:
+        return None
+
+    # The end of the game is persisted right away, and so is an action on a
+    # room this worker has no sockets for (a deadline that fired after the
+    # last one closed), since the room is evicted again below. Everything
+    # else is batched.
+    served = room_code in room_states.connections
+    if not served or any(event['type'] == 'game_end_message' for event in events):
+        await room_states.save_now(room_code)
+    else:
+        room_states.save(room_code)
+
+    arm_phase_timer(room_code, deadline)
+
+    # Log before broadcasting, so any event a client has seen can be replayed
+    await room_states.events.append(room_code, [dict(event) for event in events])
+
+    for event in events:
+        await broadcast(room_code, event, [GAME], roster)
+
+    # game_end is only produced by the action that sets game_over, see engine.begin_round
+    for event in events:
+        if event['type'] == 'game_end_message':
+            await record_game_end(room_code, event['statistics'])
+
+    if not served:
+        await room_states.evict(room_code)
+    return events
+
+
+async def record_game_end(room_code, statistics):
+    """Add a finished game to the players' leaderboard stats"""
+    try:
+        await database_sync_to_async(leaderboard.record_game, executor='analytics')(statistics)
+    except Exception:
+        logger.exception("Failed to record the results of room %s", room_code)
+
+
+async def catch_up(room_code, last_seq):
+    """
+    What a client that last saw event last_seq has missed: the events since,
+    or a snapshot message if they are no longer all logged. Raises Room.DoesNotExist.
+    """
+    state = await room_states.load(room_code)
+    if last_seq is not None and 0 <= last_seq <= state.event_seq:
+        events = await room_states.events.since(room_code, last_seq, state.event_seq)
+        if events is not None:
+            return events, None
+    return [], engine.snapshot_message(state)
+
+
+async def release_room(room_code):
+    """Drop a gameplay connection, and the room's phase timer with this worker's last one"""
+    await room_states.release(room_code)
+    if room_code not in room_states.connections:
+        phase_timers.cancel(room_code)
+
+
+def arm_phase_timer(room_code, deadline):
+    """
+    Schedule the room's phase deadline in this worker, or cancel it if there
+    is none. Only workers with sockets for the room keep its deadline.
+    """
+    if deadline is None or room_code not in room_states.connections:
+        phase_timers.cancel(room_code)
+    elif phase_timers.deadline(room_code) != deadline:
+        phase_timers.schedule(room_code, deadline, lambda: expire_phase(room_code, deadline))
+
+
+async def expire_phase(room_code, deadline):
+    try:
+        with measure('timer', 'expire_phase'):
+            await apply_action(room_code, engine.expire_phase, deadline)
+    except (Room.DoesNotExist, Round.DoesNotExist, Game.DoesNotExist):
+        logger.info("Dropped phase deadline for room %s", room_code)
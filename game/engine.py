@@ -0,0 +1,276 @@
+# engine.py
+"""
+Gameplay rules as plain functions over a RoomState.
+
+Each action validates first and only then mutates, so a rejected action
+leaves the state untouched. Actions return the list of group events the
+caller should broadcast. They run inside GameStateStore.update, which makes
+them atomic with respect to other updates of the same room.
+"""
+import random
+import time
+
+from django.conf import settings
+
+from .models import Round, Game
+from .scoring import InvalidRanking, score, validate_ranking
+from .statistics import record_round
+
+
+class ActionRejected(Exception):
+    """The sender is not allowed to perform this action right now"""
+
+
+# Seconds each phase may last before the server advances it
+PHASE_SECONDS = {
+    "wolf_selection": 120,
+    "pack_selection": 120,
+    "waiting_to_start": 30,
+}
+
+
+def phase_seconds(phase):
+    return getattr(settings, 'GAME_PHASE_SECONDS', {}).get(phase, PHASE_SECONDS[phase])
+
+
+QUESTIONS = [
+    "Rank these foods from most to least delicious",
+    "Rank these movies from best to worst",
+    "Rank these vacation destinations from most to least desirable",
+    "Rank these sports from most to least exciting",
+    "Rank these animals from most to least dangerous"
+]
+
+
+def snapshot_message(state):
+    """Everything a client needs to pick up the game where it stands"""
+    current_round = state.rounds.get(state.current_round)
+    wolf = state.username_for_user(current_round.wolf_id) if current_round else None
+    time_left = None
+    if state.phase_deadline is not None:
+        time_left = max(0, round(state.phase_deadline - time.time()))
+    return {
+        'type': 'snapshot',
+        'seq': state.event_seq,
+        'round_number': state.current_round,
+        'round_status': state.round_status,
+        'wolf_id': wolf,
+        'question': current_round.question if current_round else None,
+        'time': time_left,
+        'players': [[player.id, player.username, player.score] for player in state.players.values()],
+        'statistics': state.statistics,
+    }
+
+
+def check_playing(state):
+    """Raise unless the room has a game that is still going"""
+    if state.game_id is None:
+        raise Game.DoesNotExist
+    if state.game_over:
+        raise ActionRejected('The game is over')
+
+
+def check_phase(state, round_number, phase):
+    """
+    Refuse an action meant for another round or phase. A message sent twice,
+    or sent late, then can't score a round twice or skip one.
+    """
+    if round_number != state.current_round or state.round_status != phase:
+        raise ActionRejected(f'Round {round_number} is not in {phase}')
+
+
+def get_round(state, round_number):
+    check_playing(state)
+    current_round = state.rounds.get(round_number)
+    if current_round is None:
+        raise Round.DoesNotExist
+    return current_round
+
+
+def start_round(state, user_id, round_number):
+    check_playing(state)
+
+    # Check if the user is the host
+    if state.host_id != user_id:
+        raise ActionRejected('Only the host can start the round')
+
+    check_phase(state, round_number, "waiting_to_start")
+    return begin_round(state, round_number)
+
+
+def begin_round(state, round_number):
+    # The game ends once every round has been played. game_over makes this
+    # happen once, so game_end (and the leaderboard update it triggers) is
+    # never sent twice.
+    if state.all_rounds_complete():
+        state.game_over = True
+        state.round_status = "game_ended"
+        state.phase_deadline = None
+        state.mark_game()
+        return [{
+            'type': 'game_end_message',
+            'statistics': state.statistics
+        }]
+
+    # With lazy rounds (see StartGame) a round only exists once it is started
+    if (state.game_id is not None and isinstance(round_number, int)
+            and round_number not in state.rounds and 1 <= round_number <= len(state.players)):
+        state.add_round(round_number)
+
+    current_round = get_round(state, round_number)
+
+    eligible_players = [
+        player for player in state.players.values()
+        if player.user_id not in state.wolfed_users
+    ]
+
+    # If all players have been wolf, reset the wolf list
+    if not eligible_players:
+        state.wolfed_users = []
+        eligible_players = list(state.players.values())
+
+    chosen_player = random.choice(eligible_players)
+    current_round.wolf_id = chosen_player.user_id
+    current_round.question = random.choice(QUESTIONS)
+    state.wolfed_users.append(chosen_player.user_id)
+    state.round_status = "wolf_selection"
+    wolf_seconds = phase_seconds("wolf_selection")
+    state.phase_deadline = time.time() + wolf_seconds
+    state.mark_round(round_number)
+    state.mark_game()
+
+    return [
+        {
+            'type': 'round_start_message',
+            'round_number': round_number,
+            'wolf_id': chosen_player.username,
+            'question': current_round.question
+        },
+        # Start wolf timer
+        {
+            'type': 'wolf_timer_message',
+            'round_number': round_number,
+            'time': wolf_seconds
+        },
+    ]
+
+
+def change_status(state, status, round_number):
+    check_playing(state)
+
+    state.round_status = status
+    state.mark_game()
+    return [{
+        'type': 'status_change_message',
+        'round_number': round_number,
+        'status': status
+    }]
+
+
+def submit_wolf_order(state, user_id, order, round_number):
+    current_round = get_round(state, round_number)
+    check_phase(state, round_number, "wolf_selection")
+    wolf_id = current_round.wolf_id
+
+    # The lowest scoring pack member submits for the pack
+    players = state.pack_players(wolf_id)
+    if not players:
+        raise ActionRejected('No players available to submit the order')
+    submitter = players[0]
+
+    # Check if the user is the wolf
+    if wolf_id != user_id:
+        raise ActionRejected('Only the wolf can submit the order')
+
+    try:
+        order = validate_ranking(order, state.players)
+    except InvalidRanking as e:
+        raise ActionRejected(str(e))
+
+    # Save the wolf's ranking
+    current_round.wolf_ranking = order
+    state.round_status = "pack_selection"
+    pack_seconds = phase_seconds("pack_selection")
+    state.phase_deadline = time.time() + pack_seconds
+    state.mark_round(round_number)
+    state.mark_game()
+
+    return [
+        {
+            'type': 'wolf_order_message',
+            'round_number': round_number,
+            'submitter': submitter.username,
+        },
+        {
+            'type': 'pack_timer_message',
+            'round_number': round_number,
+            'time': pack_seconds
+        },
+    ]
+
+
+def submit_pack_order(state, order, round_number):
+    current_round = get_round(state, round_number)
+    check_phase(state, round_number, "pack_selection")
+    try:
+        order = validate_ranking(order, state.players)
+    except InvalidRanking as e:
+        raise ActionRejected(str(e))
+    return complete_round(state, current_round, order)
+
+
+def ranked_usernames(state, ranking):
+    """{player_id: username} for a ranking, best position first, as clients read it in order"""
+    return {item: state.username_for_player(item) for item in sorted(ranking, key=ranking.get)}
+
+
+def complete_round(state, current_round, order):
+    round_number = current_round.round_number
+
+    # Calculate score based on similarity between wolf and pack rankings,
+    # before anything changes, so a failure leaves the round as it was
+    pack_score = score(current_round.wolf_ranking, order)
+
+    # Save the pack's ranking
+    current_round.pack_ranking = order
+    current_round.pack_score = pack_score
+    state.mark_round(round_number)
+
+    # Each pack member gets points equal to the pack score, the wolf never does
+    state.award_pack_score(current_round.wolf_id, pack_score)
+
+    state.current_round += 1
+    state.round_status = "waiting_to_start"
+    state.phase_deadline = time.time() + phase_seconds("waiting_to_start")
+    state.mark_game()
+
+    record_round(state.statistics, state.players.values(), current_round,
+                 state.username_for_user(current_round.wolf_id))
+
+    return [{
+        'type': 'round_result_message',
+        'round_number': round_number,
+        'wolf_order': ranked_usernames(state, current_round.wolf_ranking),
+        'pack_order': ranked_usernames(state, current_round.pack_ranking),
+        'pack_score': pack_score
+    }]
+
+
+def expire_phase(state, deadline):
+    """
+    Advance a room whose phase deadline has passed: an unfinished round is
+    scored with whatever was submitted, and a room left waiting starts its
+    next round (or ends the game). Does nothing if the room already moved
+    on, so several workers may fire the same deadline safely.
+    """
+    if state.game_id is None or state.game_over or state.phase_deadline != deadline:
+        return []
+    state.phase_deadline = None
+    state.mark_game()
+
+    if state.round_status in ("wolf_selection", "pack_selection"):
+        current_round = get_round(state, state.current_round)
+        return complete_round(state, current_round, current_round.pack_ranking or {})
+    if state.round_status == "waiting_to_start":
+        return begin_round(state, state.current_round)
+    return []
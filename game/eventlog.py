@@ -0,0 +1,81 @@
+# eventlog.py
+"""
+Recent gameplay events per room, for clients catching up after a reconnect.
+
+Every event broadcast by dispatch.apply_action carries a per-room sequence
+number (RoomState.event_seq), assigned inside the store update so it is
+monotonic across workers. The last few events are kept here. A client that
+resumes with the last sequence number it saw gets the events after it, or
+None when they are no longer all kept, in which case it is sent a snapshot
+of the room state instead.
+
+Each state store picks the log that matches it: a ring buffer for the
+in-memory store, a capped Redis stream for the Redis store.
+"""
+import json
+from collections import deque
+
+
+def _contiguous(events, after_seq, current_seq):
+    """events, sorted, if they are exactly the ones numbered after_seq + 1 .. current_seq"""
+    events = sorted(events, key=lambda event: event['seq'])
+    expected = list(range(after_seq + 1, current_seq + 1))
+    if [event['seq'] for event in events] != expected:
+        return None
+    return events
+
+
+class RingBufferEventLog:
+
+    def __init__(self, size):
+        self.size = size
+        self.rooms = {}  # room code -> deque of events
+
+    async def append(self, room_code, events):
+        log = self.rooms.get(room_code)
+        if log is None:
+            log = self.rooms[room_code] = deque(maxlen=self.size)
+        log.extend(events)
+
+    async def since(self, room_code, after_seq, current_seq):
+        """The events numbered after after_seq up to current_seq, or None if some are gone"""
+        events = [event for event in self.rooms.get(room_code, ()) if after_seq < event['seq'] <= current_seq]
+        return _contiguous(events, after_seq, current_seq)
+
+    async def clear(self, room_code):
+        self.rooms.pop(room_code, None)
+
+
+class RedisStreamEventLog:
+
+    def __init__(self, redis, prefix, size, ttl):
+        self.redis = redis
+        self.prefix = prefix
+        self.size = size
+        self.ttl = ttl
+
+    def key(self, room_code):
+        return f'{self.prefix}{room_code}:events'
+
+    async def append(self, room_code, events):
+        key = self.key(room_code)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.xadd(key, {'event': json.dumps(event)}, maxlen=self.size, approximate=True)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def since(self, room_code, after_seq, current_seq):
+        """The events numbered after after_seq up to current_seq, or None if some are gone"""
+        wanted = current_seq - after_seq
+        if wanted > self.size:
+            return None
+        # Workers may append concurrently, so read a little past the newest
+        # entries in case they were not appended in sequence order
+        entries = await self.redis.xrevrange(self.key(room_code), count=wanted + 8)
+        events = [json.loads(fields['event']) for _, fields in entries]
+        events = [event for event in events if after_seq < event['seq'] <= current_seq]
+        return _contiguous(events, after_seq, current_seq)
+
+    async def clear(self, room_code):
+        await self.redis.delete(self.key(room_code))
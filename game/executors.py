@@ -0,0 +1,125 @@
+# executors.py
+"""
+Named thread pools for sync work, so heavy helpers can't starve light ones.
+
+By default every database_sync_to_async call in a worker runs on the single
+thread asgiref keeps for thread-sensitive code. One slow flush or collection
+then delays every auth lookup queued behind it. Helpers can instead name an
+executor from GAME_EXECUTORS:
+
+    @database_sync_to_async(executor='auth')
+    def get_user(...): ...
+
+Each executor has its own threads and admits at most threads + max_queue
+calls at a time. Past that, it either defers callers, which then wait on the
+event loop without taking up a thread, or rejects them with ExecutorBusy, so
+that the caller can shed the work. Per-executor queue depth, running calls,
+deferrals and rejections are exported with the other metrics.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .instrumentation import registry
+
+DEFAULT_EXECUTORS = {
+    'auth': {'threads': 2, 'max_queue': 200, 'overflow': 'reject'},
+    'gameplay': {'threads': 2, 'max_queue': 1000, 'overflow': 'defer'},
+    'analytics': {'threads': 1, 'max_queue': 2, 'overflow': 'defer'},
+}
+
+
+class ExecutorBusy(Exception):
+    """An executor with overflow 'reject' has no room for more work"""
+
+
+class NamedExecutor:
+
+    def __init__(self, name, threads=1, max_queue=100, overflow='defer'):
+        if overflow not in ('defer', 'reject'):
+            raise ValueError(f"Executor {name}: overflow must be 'defer' or 'reject'")
+        self.name = name
+        self.threads = threads
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f'game-{name}')
+        self.queued = 0  # admitted, waiting for a thread
+        self.running = 0
+        self.waiting = 0  # deferred, not admitted yet
+        self.completed = 0
+        self.deferred = 0
+        self.rejected = 0
+        self._slots = None
+        # queued and running also change on the executor's threads
+        self._lock = threading.Lock()
+
+    async def admit(self):
+        """Wait for, or refuse, a place in the queue. Call release() when done."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.threads + self.max_queue)
+        if self._slots.locked():
+            if self.overflow == 'reject':
+                self.rejected += 1
+                raise ExecutorBusy(self.name)
+            self.deferred += 1
+            self.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        with self._lock:
+            self.queued += 1
+
+    def started(self):
+        """A call left the queue for one of the threads. Called on that thread."""
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+    def finished(self):
+        with self._lock:
+            self.running -= 1
+
+    def release(self):
+        self.completed += 1
+        self._slots.release()
+
+    def collect(self):
+        labels = f'{{executor="{self.name}"}}'
+        return [
+            (f'game_executor_threads{labels}', 'gauge', "Threads of the executor", self.threads),
+            (f'game_executor_queued{labels}', 'gauge', "Calls admitted and waiting for a thread", self.queued),
+            (f'game_executor_running{labels}', 'gauge', "Calls running on the executor", self.running),
+            (f'game_executor_waiting{labels}', 'gauge', "Deferred calls waiting to be admitted", self.waiting),
+            (f'game_executor_completed_total{labels}', 'counter', "Calls completed", self.completed),
+            (f'game_executor_deferred_total{labels}', 'counter', "Calls deferred by a full queue", self.deferred),
+            (f'game_executor_rejected_total{labels}', 'counter', "Calls rejected by a full queue", self.rejected),
+        ]
+
+
+class Executors:
+
+    def __init__(self):
+        self.executors = {}
+
+    def get(self, name):
+        executor = self.executors.get(name)
+        if executor is None:
+            config = getattr(settings, 'GAME_EXECUTORS', DEFAULT_EXECUTORS).get(name)
+            if config is None:
+                raise KeyError(f"No executor named {name} in GAME_EXECUTORS")
+            executor = self.executors.setdefault(name, NamedExecutor(name, **config))
+        return executor
+
+    def collect(self):
+        # Samples of one metric have to be adjacent, so interleave the executors
+        per_executor = [self.executors[name].collect() for name in sorted(self.executors)]
+        return [metric for metrics in zip(*per_executor) for metric in metrics]
+
+
+executors = Executors()
+registry.add_collector(executors.collect)
@@ -0,0 +1,61 @@
+# groups.py
+"""
+Channel layer groups of a room.
+
+Lobby and gameplay sockets of a room are in separate groups, one per
+namespace. Each namespace subscribes to the event types its consumer
+handles. broadcast() sends an event only to the namespaces subscribed to
+it, so no socket is handed an event it has no handler for.
+"""
+from channels.layers import get_channel_layer
+
+from .instrumentation import record_group_send
+from .protocol import encode_event
+
+LOBBY = 'lobby'
+GAME = 'game'
+
+SUBSCRIPTIONS = {
+    LOBBY: frozenset({
+        'player_joined', 'player_left', 'player_count', 'game_start_message',
+    }),
+    GAME: frozenset({
+        'player_left', 'round_start_message', 'wolf_timer_message', 'pack_timer_message',
+        'wolf_order_message', 'round_result_message', 'status_change_message', 'game_end_message',
+    }),
+}
+
+
+def group_name(namespace, room_code):
+    return f'{namespace}_{room_code}'
+
+
+async def broadcast(room_code, event, namespaces=None, roster=None):
+    """
+    Send an event to the room's groups in namespaces (all of them by default)
+    that subscribe to its type. Returns the number of groups sent to.
+    """
+    channel_layer = get_channel_layer()
+    encode_event(event, roster)
+    sent = 0
+    for namespace in namespaces or SUBSCRIPTIONS:
+        if event['type'] in SUBSCRIPTIONS[namespace]:
+            await channel_layer.group_send(group_name(namespace, room_code), event)
+            sent += 1
+    record_group_send(sent)
+    return sent
+
+
+class RoomGroupsMixin:
+    """Tracks the room groups a consumer joined, so disconnect leaves exactly those"""
+    room_groups = ()
+
+    async def join_room_group(self, namespace, room_code):
+        name = group_name(namespace, room_code)
+        await self.channel_layer.group_add(name, self.channel_name)
+        self.room_groups = (*self.room_groups, name)
+
+    async def leave_room_groups(self):
+        for name in self.room_groups:
+            await self.channel_layer.group_discard(name, self.channel_name)
+        self.room_groups = ()
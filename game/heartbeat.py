@@ -0,0 +1,81 @@
+# heartbeat.py
+"""
+Reaps gameplay sockets whose client has gone quiet.
+
+Clients ping every GAME_HEARTBEAT_INTERVAL seconds, and any frame they send
+counts as a sign of life. A half-open socket never sends anything again, but
+it stays in its room's group until the channel layer expires it. Meanwhile
+every broadcast still fans out to it. Each worker therefore checks its
+sockets on a TimerWheel. Checks are lazy: a socket's timer only fires at its
+last sign of life plus GAME_HEARTBEAT_TIMEOUT, and pings just update a
+timestamp. A socket found silent past the timeout is sent heartbeat_expired
+on its own channel, so it closes and runs its normal disconnect cleanup
+inside its own consumer task.
+"""
+import time
+
+from django.conf import settings
+
+from .instrumentation import registry
+from .timers import TimerWheel
+
+
+def heartbeat_interval():
+    return getattr(settings, 'GAME_HEARTBEAT_INTERVAL', 30)
+
+
+def heartbeat_timeout():
+    return getattr(settings, 'GAME_HEARTBEAT_TIMEOUT', 90)
+
+
+class HeartbeatMonitor:
+
+    def __init__(self):
+        self.consumers = {}  # channel name -> consumer
+        self.timers = TimerWheel()
+        self.reaped = 0
+
+    def register(self, consumer):
+        self.consumers[consumer.channel_name] = consumer
+        self._schedule(consumer)
+
+    def unregister(self, consumer):
+        if self.consumers.get(consumer.channel_name) is consumer:
+            del self.consumers[consumer.channel_name]
+            self.timers.cancel(consumer.channel_name)
+
+    def _schedule(self, consumer):
+        channel_name = consumer.channel_name
+        self.timers.schedule(channel_name, consumer.last_ping + heartbeat_timeout(),
+                             lambda: self._check(channel_name))
+
+    async def _check(self, channel_name):
+        consumer = self.consumers.get(channel_name)
+        if consumer is None:
+            return
+        if time.time() - consumer.last_ping < heartbeat_timeout():
+            # Pinged since the timer was set, check again later
+            self._schedule(consumer)
+            return
+
+        self.unregister(consumer)
+        self.reaped += 1
+        await consumer.channel_layer.send(channel_name, {'type': 'heartbeat_expired'})
+
+    def counts(self):
+        """(live, stale) sockets, stale ones having missed at least one ping"""
+        cutoff = time.time() - heartbeat_interval()
+        live = sum(1 for consumer in self.consumers.values() if consumer.last_ping >= cutoff)
+        return live, len(self.consumers) - live
+
+    def collect(self):
+        live, stale = self.counts()
+        return [
+            ('game_sockets_live', 'gauge', "Gameplay sockets that pinged within the heartbeat interval", live),
+            ('game_sockets_stale', 'gauge', "Gameplay sockets that missed a ping but are not reaped yet", stale),
+            ('game_sockets_reaped_total', 'counter', "Gameplay sockets closed for missing their heartbeat", self.reaped),
+        ]
+
+
+heartbeats = HeartbeatMonitor()
+registry.add_collector(heartbeats.collect)
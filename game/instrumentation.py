@@ -0,0 +1,340 @@
+# instrumentation.py
+"""
+Per-process metrics for the websocket hot path.
+
+Every gameplay message and every database_sync_to_async helper runs inside a
+span. A span records its wall time and, for sync helpers, how long the call
+waited for the sync thread before it started running. The span also counts
+the queries it ran, their duration and the group_sends it made. Queries and
+group_sends count towards the enclosing spans too, so a message's figures
+include the helpers it awaited. Helpers that use Django's async ORM instead
+are measured as "async" spans.
+
+Channels runs every database_sync_to_async call on one shared thread by
+default. A high queue wait on a helper therefore means that thread is
+saturated, whichever handler is to blame.
+
+registry.render() produces the Prometheus text format, served by the
+Metrics view. SamplingProfiler periodically samples the stacks of all
+threads, so one can see where the time goes while the server is under load.
+"""
+import contextvars
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from channels.db import database_sync_to_async as channels_database_sync_to_async
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Shortest sampling interval the profiler accepts; shorter ones would just spin
+MIN_PROFILER_INTERVAL = 0.001
+
+_current_span = contextvars.ContextVar('game_instrumentation_span', default=None)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class SpanStats:
+    """
+    Totals for every span of one kind and name. Sync spans of one helper can
+    end on several executor threads at once, so totals change under lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.duration = Histogram()
+        self.queue_wait = Histogram()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.group_sends = 0
+
+
+class Registry:
+
+    def __init__(self):
+        self.stats = {}  # (kind, name) -> SpanStats
+        self.sync_queued = 0
+        self.sync_running = 0
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def get(self, kind, name):
+        stats = self.stats.get((kind, name))
+        if stats is None:
+            with self._lock:
+                stats = self.stats.setdefault((kind, name), SpanStats())
+        return stats
+
+    def count_sync(self, queued=0, running=0):
+        """Adjust the sync call gauges, from the event loop or a sync thread"""
+        with self._lock:
+            self.sync_queued += queued
+            self.sync_running += running
+
+    def add_collector(self, collect):
+        """Add a callable returning (name, type, help, value) tuples to export with each render"""
+        self.collectors.append(collect)
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        families = {
+            'game_span_calls_total': ('counter', "Spans completed", lambda s: s.calls),
+            'game_span_errors_total': ('counter', "Spans that raised", lambda s: s.errors),
+            'game_span_db_queries_total': ('counter', "Database queries run inside spans", lambda s: s.queries),
+            'game_span_db_seconds_total': ('counter', "Time spent in database queries inside spans", lambda s: s.query_seconds),
+            'game_span_group_sends_total': ('counter', "Channel layer group_sends made inside spans", lambda s: s.group_sends),
+        }
+        with self._lock:
+            stats = sorted(self.stats.items())
+
+        lines = []
+        for name, (metric_type, help_text, value) in families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for (kind, span_name), span_stats in stats:
+                lines.append(f'{name}{{kind="{kind}",name="{span_name}"}} {value(span_stats)}')
+
+        for name, help_text, attribute in (
+            ('game_span_duration_seconds', "Wall time of spans", 'duration'),
+            ('game_span_queue_wait_seconds', "Time sync helpers waited for the sync thread", 'queue_wait'),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (kind, span_name), span_stats in stats:
+                histogram = getattr(span_stats, attribute)
+                if histogram.count:
+                    lines.extend(histogram.render(name, f'kind="{kind}",name="{span_name}"'))
+
+        lines.append('# HELP game_sync_calls_queued Sync helper calls waiting for the sync thread')
+        lines.append('# TYPE game_sync_calls_queued gauge')
+        lines.append(f'game_sync_calls_queued {self.sync_queued}')
+        lines.append('# HELP game_sync_calls_running Sync helper calls currently running')
+        lines.append('# TYPE game_sync_calls_running gauge')
+        lines.append(f'game_sync_calls_running {self.sync_running}')
+
+        described = set()
+        for collect in self.collectors:
+            for name, metric_type, help_text, value in collect():
+                # name may carry labels, the family is described once
+                family = name.split('{', 1)[0]
+                if family not in described:
+                    described.add(family)
+                    lines.append(f'# HELP {family} {help_text}')
+                    lines.append(f'# TYPE {family} {metric_type}')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Span:
+    __slots__ = ('stats', 'parent', 'queries', 'query_seconds', 'group_sends', '_token', '_started')
+
+    def __init__(self, kind, name):
+        self.stats = registry.get(kind, name)
+        self.parent = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.group_sends = 0
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        stats = self.stats
+        with stats.lock:
+            stats.calls += 1
+            if exc_type is not None:
+                stats.errors += 1
+            stats.duration.observe(elapsed)
+            stats.queries += self.queries
+            stats.query_seconds += self.query_seconds
+            stats.group_sends += self.group_sends
+        return False
+
+
+def measure(kind, name):
+    """Context manager measuring the enclosed block as a span"""
+    return Span(kind, name)
+
+
+def record_group_send(count=1):
+    span = _current_span.get()
+    while span is not None:
+        span.group_sends += count
+        span = span.parent
+
+
+def count_queries(execute, sql, params, many, context):
+    """Connection execute wrapper attributing queries to the current spans"""
+    span = _current_span.get()
+    if span is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        while span is not None:
+            span.queries += 1
+            span.query_seconds += elapsed
+            span = span.parent
+
+
+def install_query_counter(connection, **kwargs):
+    """connection_created receiver adding count_queries to each new connection"""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def database_sync_to_async(func=None, executor=None):
+    """
+    Drop-in replacement for channels' database_sync_to_async that measures
+    each call as a "sync" span, including its wait for the sync thread.
+    With executor, calls run on that named executor (see executors.py)
+    instead of the shared sync thread, and may raise ExecutorBusy.
+    """
+    if func is None:
+        return lambda func: database_sync_to_async(func, executor)
+    name = func.__qualname__
+
+    def run(submitted, pool, *args, **kwargs):
+        # Runs on a sync thread while the loop and other threads update the
+        # same gauges, hence the locked counters
+        registry.count_sync(queued=-1, running=1)
+        if pool is not None:
+            pool.started()
+        try:
+            with measure('sync', name) as span:
+                with span.stats.lock:
+                    span.stats.queue_wait.observe(time.perf_counter() - submitted)
+                return func(*args, **kwargs)
+        finally:
+            registry.count_sync(running=-1)
+            if pool is not None:
+                pool.finished()
+
+    if executor is None:
+        run_async = channels_database_sync_to_async(run)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            registry.count_sync(queued=1)
+            return await run_async(time.perf_counter(), None, *args, **kwargs)
+
+        return wrapper
+
+    run_on_pool = None
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        nonlocal run_on_pool
+        from .executors import executors
+
+        pool = executors.get(executor)
+        if run_on_pool is None:
+            run_on_pool = channels_database_sync_to_async(run, thread_sensitive=False, executor=pool.pool)
+        await pool.admit()
+        registry.count_sync(queued=1)
+        try:
+            return await run_on_pool(time.perf_counter(), pool, *args, **kwargs)
+        finally:
+            pool.release()
+
+    return wrapper
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread in the process every interval seconds
+    from a background thread. Stacks are kept in the collapsed format that
+    flamegraph tools read: "outer;inner;innermost count".
+    """
+
+    def __init__(self):
+        self.samples = Counter()
+        self.interval = None
+        self._stop = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.005):
+        if not MIN_PROFILER_INTERVAL <= interval < float('inf'):
+            raise ValueError(f"Profiler interval must be at least {MIN_PROFILER_INTERVAL}s, got {interval}")
+        if self.running:
+            return
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='game-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        self.samples = Counter()
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename}:{code.co_name}')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def render(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+profiler = SamplingProfiler()
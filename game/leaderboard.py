@@ -0,0 +1,163 @@
+# leaderboard.py
+"""
+Cross-game player statistics and leaderboards.
+
+Player.score only lives as long as a room, so totals across games are kept
+in PlayerStats. Each user has one row for all time and one per week and
+month. When a game ends, dispatch passes its statistics payload (see
+statistics.py) to record_game. record_game adds the game to every row of
+every player in four queries, whatever the number of players. Reads never
+look at rounds or games: a leaderboard is the first rows of one period in
+the order of the player_stats_leaderboard index.
+
+Leaderboard pages are cached in GAME_LEADERBOARD_CACHE for
+GAME_LEADERBOARD_CACHE_SECONDS. Cache keys include a version that every
+recorded game bumps, so a page is never staler than the last game end.
+"""
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PlayerStats
+
+ALL_TIME_START = date(1970, 1, 1)
+MAX_LEADERBOARD_SIZE = 100
+
+_VERSION_KEY = 'leaderboard:version'
+
+# PlayerStats fields a game adds to
+COUNTERS = ('games_played', 'wins', 'total_score', 'rounds_as_wolf', 'pack_rounds', 'pack_score_total')
+
+
+def get_leaderboard_cache():
+    return caches[getattr(settings, 'GAME_LEADERBOARD_CACHE', 'default')]
+
+
+def period_start(period, day):
+    if period == 'all':
+        return ALL_TIME_START
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown leaderboard period {period}")
+
+
+def player_totals(statistics):
+    """Per-username additions to PlayerStats for one game's statistics payload"""
+    winners = set(statistics.get('winners', ()))
+    totals = {}
+    for username, player_stats in statistics.get('players', {}).items():
+        round_scores = player_stats.get('round_scores', [])
+        totals[username] = {
+            'games_played': 1,
+            'wins': 1 if username in winners else 0,
+            'total_score': player_stats.get('total_score', 0),
+            'rounds_as_wolf': player_stats.get('rounds_as_wolf', 0),
+            'pack_rounds': len(round_scores),
+            'pack_score_total': sum(round_scores),
+        }
+    return totals
+
+
+def record_game(statistics, finished_at=None):
+    """Add a finished game to its players' stats. Returns the number of rows updated."""
+    totals = player_totals(statistics)
+    if not totals:
+        return 0
+    today = timezone.localdate(finished_at or timezone.now())
+    starts = {period: period_start(period, today) for period in PlayerStats.PERIODS}
+    user_ids = dict(User.objects.filter(username__in=totals).values_list('username', 'id'))
+    keys = [(user_id, period, start) for user_id in user_ids.values() for period, start in starts.items()]
+
+    with transaction.atomic():
+        # Make sure every row exists, then lock and add to them
+        PlayerStats.objects.bulk_create(
+            [PlayerStats(user_id=user_id, period=period, period_start=start) for user_id, period, start in keys],
+            ignore_conflicts=True,
+        )
+        rows = list(
+            PlayerStats.objects
+            .select_for_update()
+            .filter(user_id__in=user_ids.values(), period_start__in=starts.values())
+            .order_by('id')
+        )
+        usernames = {user_id: username for username, user_id in user_ids.items()}
+        updated = []
+        for row in rows:
+            if starts.get(row.period) != row.period_start:
+                continue
+            for field, value in totals[usernames[row.user_id]].items():
+                setattr(row, field, getattr(row, field) + value)
+            updated.append(row)
+        PlayerStats.objects.bulk_update(updated, COUNTERS)
+
+    _bump_version()
+    return len(updated)
+
+
+def _bump_version():
+    cache = get_leaderboard_cache()
+    if not cache.add(_VERSION_KEY, 1, timeout=None):
+        try:
+            cache.incr(_VERSION_KEY)
+        except ValueError:
+            cache.set(_VERSION_KEY, 1, timeout=None)
+
+
+def stats_entry(row):
+    return {
+        'username': row['user__username'],
+        'games_played': row['games_played'],
+        'wins': row['wins'],
+        'total_score': row['total_score'],
+        'rounds_as_wolf': row['rounds_as_wolf'],
+        'average_pack_score': round(row['pack_score_total'] / row['pack_rounds'], 2) if row['pack_rounds'] else 0.0,
+    }
+
+
+STATS_FIELDS = ('user__username', 'games_played', 'wins', 'total_score', 'rounds_as_wolf',
+                'pack_rounds', 'pack_score_total')
+
+
+def get_leaderboard(period='all', limit=10, day=None):
+    """The top limit players of the period containing day (today by default)"""
+    start = period_start(period, day or timezone.localdate())
+    limit = max(1, min(limit, MAX_LEADERBOARD_SIZE))
+
+    cache = get_leaderboard_cache()
+    version = cache.get(_VERSION_KEY, 0)
+    key = f'leaderboard:{version}:{period}:{start.isoformat()}:{limit}'
+    entries = cache.get(key)
+    if entries is None:
+        rows = (
+            PlayerStats.objects
+            .filter(period=period, period_start=start)
+            .order_by('-total_score', 'user')
+            .values(*STATS_FIELDS)[:limit]
+        )
+        entries = [dict(stats_entry(row), rank=rank) for rank, row in enumerate(rows, start=1)]
+        cache.set(key, entries, getattr(settings, 'GAME_LEADERBOARD_CACHE_SECONDS', 30))
+    return {'period': period, 'period_start': start, 'leaderboard': entries}
+
+
+def get_player_history(username, limit=12):
+    """A user's all-time stats and their last limit weeks and months, newest first"""
+    rows = (
+        PlayerStats.objects
+        .filter(user__username=username)
+        .order_by('period', '-period_start')
+        .values('period', 'period_start', *STATS_FIELDS)
+    )
+    history = {'all': None, 'week': [], 'month': []}
+    for row in rows:
+        entry = dict(stats_entry(row), period_start=row['period_start'])
+        if row['period'] == 'all':
+            history['all'] = entry
+        elif len(history[row['period']]) < limit:
+            history[row['period']].append(entry)
+    return history
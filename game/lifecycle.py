@@ -0,0 +1,192 @@
+# lifecycle.py
+"""
+Garbage collection of abandoned rooms.
+
+Rooms are only deleted when their last player leaves through LeaveGameRoom.
+Rooms whose players just close the tab keep their Room, Player, Game and
+Round rows forever. Room.last_activity is set with every version bump, that
+is on every join, leave, game start and write-behind flush. Rooms untouched
+for GAME_ROOM_GC_INACTIVE seconds are collected in batches of
+GAME_ROOM_GC_BATCH_SIZE.
+
+A batch costs a fixed number of queries, whatever the number of rows it
+removes. Rows are removed with QuerySet._raw_delete, child tables first,
+which skips the collector's per-object cascade and the delete signals.
+Finished games are first archived to GameSummary.
+
+The gcrooms management command runs a collection. Workers can also collect
+every GAME_ROOM_GC_INTERVAL seconds through room_collector.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .codes import room_codes
+from .directory import players as player_directory
+from .instrumentation import database_sync_to_async, registry
+from .models import Game, GameSummary, Player, Room, Round
+
+logger = logging.getLogger(__name__)
+
+
+def gc_inactive_seconds():
+    return getattr(settings, 'GAME_ROOM_GC_INACTIVE', 86400)
+
+
+def gc_batch_size():
+    return getattr(settings, 'GAME_ROOM_GC_BATCH_SIZE', 500)
+
+
+def summarize_games(room_ids):
+    """GameSummary rows, unsaved, for the finished games of some rooms"""
+    memberships = (
+        Room.players.through.objects
+        .filter(room_id__in=room_ids)
+        .values_list('room_id', 'player__user_id', 'player__user__username', 'player__score')
+    )
+    scores = {}
+    for room_id, user_id, username, score in memberships:
+        scores.setdefault(room_id, []).append((score, username, user_id))
+
+    summaries = []
+    games = (
+        Game.objects
+        .filter(Q(game_over=True) | Q(round_status='game_ended'), room_id__in=room_ids)
+        .values_list('room_id', 'room__code', 'room__name', 'room__host_id', 'room__created_at',
+                     'room__last_activity', 'current_round', 'winner_id')
+    )
+    for room_id, code, name, host_id, created_at, last_activity, current_round, winner_id in games:
+        ranked = sorted(scores.get(room_id, ()), key=lambda entry: entry[0], reverse=True)
+        if winner_id is None and ranked:
+            winner_id = ranked[0][2]
+        summaries.append(GameSummary(
+            room_code=code,
+            room_name=name,
+            host_id=host_id,
+            winner_id=winner_id,
+            rounds_played=current_round - 1,
+            leaderboard=[{'username': username, 'score': score} for score, username, _ in ranked],
+            created_at=created_at,
+            finished_at=last_activity,
+        ))
+    return summaries
+
+
+def collect_rooms(room_ids, using):
+    """Archive and delete rooms and everything hanging off them, returning rows deleted per model"""
+    reclaimed = Counter()
+    through = Room.players.through
+    player_ids = list(through.objects.filter(room_id__in=room_ids).values_list('player_id', flat=True))
+
+    summaries = summarize_games(room_ids)
+    if summaries:
+        GameSummary.objects.bulk_create(summaries)
+    reclaimed['archived'] = len(summaries)
+
+    reclaimed['round'] = Round.objects.filter(room_id__in=room_ids)._raw_delete(using)
+    reclaimed['game'] = Game.objects.filter(room_id__in=room_ids)._raw_delete(using)
+    reclaimed['room_players'] = through.objects.filter(room_id__in=room_ids)._raw_delete(using)
+    if player_ids:
+        # A player row belongs to one room, but don't trust that blindly
+        reclaimed['player'] = (
+            Player.objects.filter(id__in=player_ids).exclude(players__isnull=False)._raw_delete(using)
+        )
+    reclaimed['room'] = Room.objects.filter(id__in=room_ids)._raw_delete(using)
+    return reclaimed
+
+
+def collect_inactive_rooms(inactive_for=None, batch_size=None, max_batches=None, exclude=(), dry_run=False):
+    """
+    Collect rooms inactive for inactive_for seconds, batch by batch.
+    Returns (codes of the collected rooms, Counter of rows deleted per model
+    plus the number of games archived). A dry run only counts the rooms.
+    Each batch is one transaction. Its rooms are locked with SKIP LOCKED, so
+    workers collecting at the same time never pick the same rooms.
+    """
+    if inactive_for is None:
+        inactive_for = gc_inactive_seconds()
+    batch_size = batch_size or gc_batch_size()
+    cutoff = timezone.now() - timedelta(seconds=inactive_for)
+    using = router.db_for_write(Room)
+    inactive = Room.objects.filter(last_activity__lt=cutoff).exclude(code__in=exclude)
+    if dry_run:
+        return [], Counter(room=inactive.count())
+
+    collected = []
+    reclaimed = Counter()
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic(using=using):
+            rooms = list(
+                inactive
+                .select_for_update(skip_locked=True)
+                .order_by('last_activity')
+                .values_list('id', 'code')[:batch_size]
+            )
+            if not rooms:
+                break
+            room_ids = [room_id for room_id, _ in rooms]
+            reclaimed.update(collect_rooms(room_ids, using))
+        collected.extend(code for _, code in rooms)
+        batches += 1
+    return collected, reclaimed
+
+
+class RoomCollector:
+    """
+    Periodically collects inactive rooms from a worker's event loop. It is
+    started lazily by the first gameplay or lobby connection, since Channels
+    has no startup hook. It never collects rooms this worker still has
+    sockets for.
+    """
+
+    def __init__(self):
+        self.reclaimed = Counter()
+        self._task = None
+
+    def ensure_started(self):
+        interval = getattr(settings, 'GAME_ROOM_GC_INTERVAL', None)
+        if interval and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def _run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.collect()
+            except Exception:
+                logger.exception("Room garbage collection failed")
+
+    async def collect(self):
+        from .store import room_states
+
+        codes, reclaimed = await database_sync_to_async(collect_inactive_rooms, executor='analytics')(
+            exclude=list(room_states.connections))
+        self.reclaimed.update(reclaimed)
+        for code in codes:
+            # The delete signals were skipped, so drop what this worker knows of the rooms itself
+            player_directory.forget(code)
+            await room_states.evict(code)
+            room_codes.release(code)
+        if codes:
+            logger.info("Collected %d inactive rooms: %s", len(codes), dict(reclaimed))
+        return codes, reclaimed
+
+    def collect_metrics(self):
+        metrics = [
+            (f'game_gc_{model}_rows_total', 'counter', f"{model} rows deleted by the room collector", count)
+            for model, count in sorted(self.reclaimed.items()) if model != 'archived'
+        ]
+        metrics.append(('game_gc_games_archived_total', 'counter', "Finished games archived by the room collector",
+                        self.reclaimed['archived']))
+        return metrics
+
+
+room_collector = RoomCollector()
+registry.add_collector(room_collector.collect_metrics)
@@ -0,0 +1,45 @@
+# locks.py
+"""
+Serialization of gameplay actions per room.
+
+GameStateStore.update already makes each action atomic. An action is more
+than the update, though: its events are also logged and broadcast. Two
+actions on the same room running concurrently in one worker could broadcast
+their events out of sequence. A Redis store also makes them retry each
+other's WATCH. Actions therefore hold their room's lock from the update to
+the last broadcast.
+
+RoomLocks keeps one asyncio.Lock per room in a WeakValueDictionary. A lock
+lives only as long as some coroutine holds or waits for it, so locks of idle
+rooms need no cleanup. Across workers the store's lease (see
+RedisGameStateStore.lease) plays the same role.
+"""
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+
+class RoomLocks:
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+
+    def get(self, room_code):
+        lock = self._locks.get(room_code)
+        if lock is None:
+            lock = self._locks[room_code] = asyncio.Lock()
+        return lock
+
+    def __len__(self):
+        return len(self._locks)
+
+
+room_locks = RoomLocks()
+
+
+@asynccontextmanager
+async def serialized(store, room_code):
+    """Hold the room's lock in this worker, then its lease across workers"""
+    async with room_locks.get(room_code):
+        async with store.lease(room_code):
+            yield
@@ -0,0 +1,49 @@
+# gcrooms.py
+"""
+Collect rooms nobody has touched for a while, archiving their finished games.
+
+    python manage.py gcrooms --inactive 86400 --batch-size 500
+
+Run it from cron, or set GAME_ROOM_GC_INTERVAL to have the workers collect.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from game.lifecycle import collect_inactive_rooms, gc_batch_size, gc_inactive_seconds
+
+
+class Command(BaseCommand):
+    help = "Delete inactive rooms with their players, games and rounds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive', type=int, default=None,
+                            help="Seconds since a room's last activity (default GAME_ROOM_GC_INACTIVE)")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Rooms deleted per transaction (default GAME_ROOM_GC_BATCH_SIZE)")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after this many batches")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rooms that would be collected")
+
+    def handle(self, *args, **options):
+        inactive_for = options['inactive'] if options['inactive'] is not None else gc_inactive_seconds()
+        batch_size = options['batch_size'] or gc_batch_size()
+
+        started = time.perf_counter()
+        codes, reclaimed = collect_inactive_rooms(
+            inactive_for=inactive_for,
+            batch_size=batch_size,
+            max_batches=options['max_batches'],
+            dry_run=options['dry_run'],
+        )
+        elapsed = time.perf_counter() - started
+
+        if options['dry_run']:
+            self.stdout.write(f"{reclaimed['room']} rooms inactive for over {inactive_for}s")
+            return
+
+        self.stdout.write(f"Collected {len(codes)} rooms in {elapsed:.2f}s")
+        self.stdout.write(f"{'table':<16}{'rows':>8}")
+        for model in ('room', 'room_players', 'player', 'game', 'round'):
+            self.stdout.write(f"{model:<16}{reclaimed[model]:>8}")
+        self.stdout.write(f"{'total':<16}{sum(reclaimed[model] for model in reclaimed if model != 'archived'):>8}")
+        self.stdout.write(f"Archived {reclaimed['archived']} finished games")
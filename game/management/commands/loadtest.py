@@ -0,0 +1,367 @@
+# loadtest.py
+"""
+Load generator for the game backend.
+
+Drives simulated rooms end to end inside this process: clients register and
+log in, create, join and start rooms through the REST views, connect to
+/ws/lobby/ and /ws/game/ and play full games through the GameplayConsumer
+protocol. Websockets run against backend.asgi with the in-memory channel
+layer, and the database is whatever DATABASES points at.
+
+All rooms move through each step together, so the queries observed while a
+step runs can be attributed to that step's message type. Writes deferred by
+the write-behind flush land in whichever step is running when they happen.
+At the end, every round played is scored again locally in one score_many
+batch, as a check of the pack scores the server sent.
+
+    python manage.py loadtest --rooms 200 --players 6
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, override_settings
+
+from game.models import Room, Player
+from game.scoring import score_many
+
+RESPONSE_TIMEOUT = 30
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class QueryCounter:
+    """Counts queries on every database connection, whichever thread opened it"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._wrapped = []
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def attach(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+            self._wrapped.append(connection)
+
+    def start(self):
+        for connection in connections.all():
+            self.attach(connection)
+        connection_created.connect(self.attach)
+
+    def stop(self):
+        connection_created.disconnect(self.attach)
+        for connection in self._wrapped:
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class Metrics:
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.latencies = defaultdict(list)
+        self.messages = 0
+        self.steps = defaultdict(lambda: [0, 0])  # step -> [queries, messages]
+
+    def record(self, message_type, seconds):
+        self.latencies[message_type].append(seconds)
+        self.messages += 1
+
+    async def step(self, name, coroutines):
+        """Run one step for every room concurrently, counting the queries it caused"""
+        queries, messages = self.queries.count, self.messages
+        results = await asyncio.gather(*coroutines)
+        totals = self.steps[name]
+        totals[0] += self.queries.count - queries
+        totals[1] += self.messages - messages
+        return results
+
+
+class SimulatedClient:
+
+    def __init__(self, username, metrics):
+        self.username = username
+        self.metrics = metrics
+        self.http = AsyncClient()
+        self.token = None
+        self.lobby = None
+        self.game = None
+
+    async def request(self, message_type, method, path, data=None):
+        headers = {}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        started = time.perf_counter()
+        if method == 'get':
+            response = await self.http.get(path, data, headers=headers)
+        else:
+            response = await self.http.post(path, json.dumps(data), content_type='application/json', headers=headers)
+        self.metrics.record(message_type, time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{message_type} failed for {self.username}: {response.status_code} {response.content[:200]}')
+        return json.loads(response.content)
+
+    async def sign_up(self):
+        await self.request('register', 'post', '/api/auth/register/', {
+            'username': self.username,
+            'email': f'{self.username}@loadtest.invalid',
+            'password': 'loadtest-password',
+        })
+        data = await self.request('login', 'post', '/api/auth/login/', {
+            'username': self.username,
+            'password': 'loadtest-password',
+        })
+        self.token = data['access']
+
+    async def connect(self, message_type, path):
+        communicator = WebsocketCommunicator(self.application, f'{path}?token={self.token}')
+        started = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=RESPONSE_TIMEOUT)
+        self.metrics.record(message_type, time.perf_counter() - started)
+        if not connected:
+            raise RuntimeError(f'{message_type} rejected for {self.username}')
+        return communicator
+
+    async def expect(self, communicator, event_type):
+        """Read frames until one of event_type arrives"""
+        while True:
+            message = await communicator.receive_json_from(timeout=RESPONSE_TIMEOUT)
+            if message['type'] == event_type:
+                return message
+            if message['type'] == 'error':
+                raise RuntimeError(f'{self.username} got error: {message["message"]}')
+
+    async def send(self, message_type, content, reply_type):
+        """Send a gameplay frame and time it until the reply reaches this client"""
+        started = time.perf_counter()
+        await self.game.send_json_to(content)
+        reply = await self.expect(self.game, reply_type)
+        self.metrics.record(message_type, time.perf_counter() - started)
+        return reply
+
+    async def drain(self):
+        for communicator in (self.lobby, self.game):
+            if communicator is None:
+                continue
+            while not await communicator.receive_nothing(timeout=0):
+                await communicator.receive_output()
+
+    async def close(self):
+        for communicator in (self.lobby, self.game):
+            if communicator is None:
+                continue
+            try:
+                await communicator.disconnect()
+            except Exception:
+                # A consumer failing on a broadcast during teardown is not what we measure
+                pass
+
+
+class SimulatedRoom:
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.host = clients[0]
+        self.code = None
+        self.player_ids = []
+        self.rankings = []  # (wolf ranking, pack ranking) of each round played
+        self.pack_scores = []  # the server's pack score for each of them
+
+    async def create(self):
+        data = await self.host.request('create_room', 'post', '/api/game/create-room/', {
+            'name': f'loadtest {self.host.username}',
+            'max_players': len(self.clients),
+        })
+        self.code = data['room_code']
+
+    async def join(self):
+        for client in self.clients[1:]:
+            await client.request('join_room', 'post', '/api/game/join-room/', {'room_code': self.code})
+        details = await self.host.request('room_details', 'get', '/api/game/get-room-details/', {'room_code': self.code})
+        self.player_ids = [str(player['id']) for player in details['current_players']]
+
+    async def open_lobby(self):
+        for client in self.clients:
+            client.lobby = await client.connect('lobby_connect', f'/ws/lobby/{self.code}/')
+
+    async def start(self):
+        await self.host.request('start_game', 'post', '/api/game/start-game/', {'room_code': self.code})
+
+    async def open_game(self):
+        # Clients leave the lobby page once the game has started
+        for client in self.clients:
+            await client.close()
+            client.lobby = None
+        for client in self.clients:
+            client.game = await client.connect('game_connect', f'/ws/game/{self.code}/')
+        for client in self.clients:
+            started = time.perf_counter()
+            await client.game.send_json_to({'type': 'ping'})
+            await client.expect(client.game, 'pong')
+            client.metrics.record('ping', time.perf_counter() - started)
+
+    async def start_round(self, round_number):
+        reply = await self.host.send('start_round', {'type': 'start_round', 'round_number': round_number}, 'round_start')
+        self.wolf = next(client for client in self.clients if client.username == reply['wolf_id'])
+
+    async def wolf_order(self, round_number):
+        order = self.player_ids[:]
+        random.shuffle(order)
+        self.wolf_ranking = {player_id: position for position, player_id in enumerate(order)}
+        await self.wolf.send('wolf_order', {
+            'type': 'wolf_order', 'round_number': round_number, 'order': self.wolf_ranking,
+        }, 'wolf_order')
+
+    async def pack_order(self, round_number):
+        order = self.player_ids[:]
+        random.shuffle(order)
+        submitter = next(client for client in self.clients if client is not self.wolf)
+        pack_ranking = {player_id: position for position, player_id in enumerate(order)}
+        reply = await submitter.send('pack_order', {
+            'type': 'pack_order', 'round_number': round_number, 'order': pack_ranking,
+        }, 'round_result')
+        self.rankings.append((self.wolf_ranking, pack_ranking))
+        self.pack_scores.append(reply['pack_score'])
+
+    async def end(self):
+        await self.host.send('game_end', {'type': 'start_round', 'round_number': len(self.clients) + 1}, 'game_end')
+
+    async def drain(self):
+        for client in self.clients:
+            await client.drain()
+
+    async def close(self):
+        for client in self.clients:
+            await client.close()
+
+
+class Command(BaseCommand):
+    help = "Simulate concurrent rooms playing full games and report latency and query counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10, help="Number of rooms to simulate")
+        parser.add_argument('--players', type=int, default=4, help="Players per room")
+        parser.add_argument('--keep', action='store_true', help="Keep the users and rooms created by the run")
+        parser.add_argument('--scoring-rule', default=None,
+                            help="Score rounds with this rule instead of GAME_SCORING_RULE (see game/scoring.py)")
+
+    def handle(self, *args, **options):
+        if options['players'] < 2:
+            self.stderr.write("A room needs at least 2 players")
+            return
+
+        run_id = uuid.uuid4().hex[:8]
+        queries = QueryCounter()
+        metrics = Metrics(queries)
+
+        # Keep server-side phase timers out of the way, the clients drive every phase
+        overrides = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+            GAME_PHASE_SECONDS={phase: 3600 for phase in ('wolf_selection', 'pack_selection', 'waiting_to_start')},
+            GAME_SCORING_RULE=options['scoring_rule'] or getattr(settings, 'GAME_SCORING_RULE', 'positional'),
+        )
+        overrides.enable()
+        queries.start()
+        try:
+            from backend.asgi import application
+            SimulatedClient.application = application
+
+            rooms = [
+                SimulatedRoom([
+                    SimulatedClient(f'lt{run_id}r{room}p{player}', metrics)
+                    for player in range(options['players'])
+                ])
+                for room in range(options['rooms'])
+            ]
+            started = time.perf_counter()
+            async_to_sync(self.play)(rooms, options['players'], metrics)
+            elapsed = time.perf_counter() - started
+        finally:
+            queries.stop()
+            overrides.disable()
+            if not options['keep']:
+                self.clean_up(run_id)
+
+        self.report(metrics, queries, elapsed)
+        self.check_scores(rooms, options['scoring_rule'])
+
+    async def play(self, rooms, players, metrics):
+        clients = [client for room in rooms for client in room.clients]
+        try:
+            await metrics.step('sign_up', [client.sign_up() for client in clients])
+            await metrics.step('create_room', [room.create() for room in rooms])
+            await metrics.step('join_room', [room.join() for room in rooms])
+            await metrics.step('lobby_connect', [room.open_lobby() for room in rooms])
+            await metrics.step('start_game', [room.start() for room in rooms])
+            await metrics.step('game_connect', [room.open_game() for room in rooms])
+            for round_number in range(1, players + 1):
+                await metrics.step('start_round', [room.start_round(round_number) for room in rooms])
+                await metrics.step('wolf_order', [room.wolf_order(round_number) for room in rooms])
+                await metrics.step('pack_order', [room.pack_order(round_number) for room in rooms])
+                await asyncio.gather(*[room.drain() for room in rooms])
+            await metrics.step('game_end', [room.end() for room in rooms])
+        finally:
+            await asyncio.gather(*[room.close() for room in rooms])
+
+    def clean_up(self, run_id):
+        prefix = f'lt{run_id}'
+        Player.objects.filter(user__username__startswith=prefix).delete()
+        Room.objects.filter(host__username__startswith=prefix).delete()
+        User.objects.filter(username__startswith=prefix).delete()
+
+    def check_scores(self, rooms, rule):
+        """Score every round played again in one batch and compare with the server's pack scores"""
+        rankings = [pair for room in rooms for pair in room.rankings]
+        expected = [points for room in rooms for points in room.pack_scores]
+        started = time.perf_counter()
+        scores = score_many(rankings, rule)
+        elapsed = time.perf_counter() - started
+        mismatches = sum(1 for points, server_points in zip(scores, expected) if points != server_points)
+        self.stdout.write(
+            f"{len(rankings)} rounds rescored in {elapsed * 1000:.2f}ms, "
+            f"{mismatches} differ from the server's pack scores"
+        )
+
+    def report(self, metrics, queries, elapsed):
+        self.stdout.write(f"{'message':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for message_type, values in metrics.latencies.items():
+            values = sorted(values)
+            self.stdout.write(
+                f"{message_type:<16}{len(values):>8}"
+                f"{percentile(values, 0.50) * 1000:>10.2f}"
+                f"{percentile(values, 0.95) * 1000:>10.2f}"
+                f"{percentile(values, 0.99) * 1000:>10.2f}"
+                f"{values[-1] * 1000:>10.2f}"
+            )
+
+        self.stdout.write(f"\n{'step':<16}{'queries':>8}{'per msg':>10}")
+        for name, (step_queries, messages) in metrics.steps.items():
+            self.stdout.write(f"{name:<16}{step_queries:>8}{step_queries / max(messages, 1):>10.2f}")
+
+        self.stdout.write(
+            f"\n{metrics.messages} messages in {elapsed:.2f}s "
+            f"({metrics.messages / elapsed:.1f} msg/s), {queries.count} queries"
+        )
@@ -1,62 +1,120 @@
 from channels.middleware import BaseMiddleware
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from urllib.parse import parse_qs
+import hashlib
 import logging
-from jwt import decode as jwt_decode
 
 from django.conf import settings
 
+from .executors import ExecutorBusy
+from .instrumentation import database_sync_to_async
+
 logger = logging.getLogger(__name__)
 
+
+def get_user_cache():
+    return caches[getattr(settings, 'WEBSOCKET_AUTH_CACHE', 'default')]
+
+
+def token_fingerprint(token):
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def _generation_key(user_id):
+    return f'ws-auth:gen:{user_id}'
+
+
+def _user_key(user_id, generation, fingerprint):
+    return f'ws-auth:user:{user_id}:{generation}:{fingerprint}'
+
+
+def invalidate_cached_user(user_id):
+    """
+    Drop every cached websocket user for user_id. Bumping the generation
+    orphans all entries for that user, whatever token they were cached under.
+    """
+    cache = get_user_cache()
+    key = _generation_key(user_id)
+    # Generations never expire, otherwise a bump could be forgotten before the entries it orphaned
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
 class JwtAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates websocket connections with the same access tokens as the
+    REST API, passed either as a Bearer authorization header or as a
+    ?token= query parameter.
+
+    Resolved users are cached per user id and token, so reconnects don't hit
+    the database. With WEBSOCKET_AUTH_TRUST_CLAIMS the database is never
+    consulted and the user is built from the token claims alone.
+    """
+
     def __init__(self, inner):
         super().__init__(inner)  # Ensure correct BaseMiddleware initialization
 
     async def __call__(self, scope, receive, send):
-        logger.info("Middleware is running")
-        # breakpoint()
-        headers = dict(scope.get("headers", []))
-        query_string = scope.get('query_string', b'').decode()
-        query_params = parse_qs(query_string)
-
-        token = None
-        logger.info(f"Headers: {headers}")
-        # breakpoint()
-
-        print("HI")
+        token = self.get_raw_token(scope)
+        scope['user'] = await self.authenticate(token) if token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
 
+    def get_raw_token(self, scope):
+        headers = dict(scope.get("headers", []))
         if b'authorization' in headers:
-            print("If condition")
             auth_header = headers[b'authorization'].decode()
             if auth_header.startswith("Bearer "):
-                token = auth_header.split("Bearer ")[1]
-                logger.info(f"Token: {token}")
-                print("Token: ", token)
-
-        if not token:
-            token = query_params.get('token', [None])[0]
-            if token:
-                print(f"Token recieved from Query Params : {token}")
-
-        if token:
-            data = jwt_decode(token, settings.SIMPLE_JWT["SIGNING_KEY"], algorithms=["HS256"])
-            print("Data: ", data)
-            user = await self.get_user(data['user_id'])
-            scope['user'] = user if user else AnonymousUser()
-        else:
-            scope['user'] = AnonymousUser()
-
-        # breakpoint()
-        return await super().__call__(scope, receive, send)
+                return auth_header.split("Bearer ")[1]
+
+        query_params = parse_qs(scope.get('query_string', b'').decode())
+        return query_params.get('token', [None])[0]
 
-    @database_sync_to_async
-    def get_user(self, user_id):
+    async def authenticate(self, raw_token):
+        try:
+            token = AccessToken(raw_token)
+            user_id = token[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            logger.info("Rejected websocket token")
+            return AnonymousUser()
+
+        if getattr(settings, 'WEBSOCKET_AUTH_TRUST_CLAIMS', False):
+            return TokenUser(token)
+
+        cache = get_user_cache()
+        generation = await cache.aget(_generation_key(user_id), 0)
+        key = _user_key(user_id, generation, token_fingerprint(raw_token))
+        user = await cache.aget(key)
+        if user is None:
+            user = await self.get_user(user_id)
+            if user.is_anonymous:
+                return user
+            await cache.aset(key, user)
+        return user
+
+    async def get_user(self, user_id):
+        try:
+            return await self.load_user(user_id)
+        except ExecutorBusy:
+            logger.warning("Auth executor is full, refusing websocket user %s", user_id)
+            return AnonymousUser()
+
+    # Handshakes get their own threads, so they don't queue behind gameplay flushes
+    @database_sync_to_async(executor='auth')
+    def load_user(self, user_id):
         User = get_user_model()
         try:
             return User.objects.get(id=user_id)
-        except (User.DoesNotExist, Exception):
-            breakpoint()
+        except User.DoesNotExist:
+            return AnonymousUser()
+        except Exception:
+            logger.exception("Could not load websocket user %s", user_id)
             return AnonymousUser()
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_game_delete_wolflist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='phase_deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_game_phase_deadline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='code',
+            field=models.CharField(max_length=6, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_room_code_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:24
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_players(apps, schema_editor):
+    Room = apps.get_model('game', 'Room')
+    rooms = list(Room.objects.annotate(num_players=Count('players')))
+    for room in rooms:
+        room.player_count = room.num_players
+    Room.objects.bulk_update(rooms, ['player_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_room_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='player_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_players, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:39
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def delete_duplicate_rounds(apps, schema_editor):
+    # Double submitted game starts could create the same round twice, keep the first
+    Round = apps.get_model('game', 'Round')
+    keep = (
+        Round.objects
+        .values('room_id', 'round_number')
+        .annotate(keep_id=Min('id'))
+        .values_list('keep_id', flat=True)
+    )
+    Round.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_room_player_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_rounds, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='round',
+            constraint=models.UniqueConstraint(fields=('room', 'round_number'), name='unique_round_number_per_room'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_room_last_activity_gamesummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=5)),
+                ('period_start', models.DateField()),
+                ('games_played', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('total_score', models.IntegerField(default=0)),
+                ('rounds_as_wolf', models.IntegerField(default=0)),
+                ('pack_rounds', models.IntegerField(default=0)),
+                ('pack_score_total', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='game_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'period_start', '-total_score', 'user'], name='player_stats_leaderboard')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'period', 'period_start'), name='unique_player_stats_period')],
+            },
+        ),
+    ]
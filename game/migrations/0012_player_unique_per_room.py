@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:07
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_players(apps, schema_editor):
+    # Double submitted joins could add a user to a room twice, keep the first
+    # player and give the rooms back the extra seats
+    Player = apps.get_model('game', 'Player')
+    Room = apps.get_model('game', 'Room')
+    keep = (
+        Player.objects
+        .exclude(unique_id='')
+        .values('user_id', 'unique_id')
+        .annotate(keep_id=Min('id'))
+        .values_list('keep_id', flat=True)
+    )
+    duplicates = Player.objects.exclude(unique_id='').exclude(id__in=list(keep))
+    room_ids = set(Room.players.through.objects.filter(player__in=duplicates).values_list('room_id', flat=True))
+    duplicates.delete()
+    for room in Room.objects.filter(id__in=room_ids).annotate(members=Count('players')):
+        Room.objects.filter(id=room.id).update(player_count=room.members)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_playerstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_players, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='player',
+            constraint=models.UniqueConstraint(condition=models.Q(('unique_id', ''), _negated=True), fields=('user', 'unique_id'), name='unique_player_per_room'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 # Create your models here.
@@ -9,14 +10,24 @@ class Player(models.Model):
     unique_id = models.CharField(max_length=100, default="")
     score = models.IntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            # unique_id is "<room code>-<user id>", so this is one player per user and room
+            models.UniqueConstraint(fields=['user', 'unique_id'], condition=~models.Q(unique_id=''),
+                                    name='unique_player_per_room'),
+        ]
+
 class Room(models.Model):
     name = models.CharField(max_length=100)
-    code = models.CharField(max_length=6)
+    code = models.CharField(max_length=6, unique=True)
     host = models.ForeignKey(User, on_delete=models.CASCADE)
     players = models.ManyToManyField(Player, related_name="players")
     created_at = models.DateTimeField(auto_now_add=True)
     max_players = models.IntegerField(default=10)
+    player_count = models.IntegerField(default=0)  # kept in step with players, see JoinGameRoom
     game_started = models.BooleanField(default=False)
+    version = models.IntegerField(default=0)  # bumped on every change pollers should see
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True)  # set with every version bump, see lifecycle.py
 
 class Round(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
@@ -27,6 +38,12 @@ class Round(models.Model):
     pack_score = models.IntegerField(default=0)
     round_number = models.IntegerField()
 
+    class Meta:
+        constraints = [
+            # Rounds may be created lazily by the write-behind flush, which upserts on this
+            models.UniqueConstraint(fields=['room', 'round_number'], name='unique_round_number_per_room'),
+        ]
+
 class Game(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
     current_round = models.IntegerField(default=1)
@@ -34,3 +51,47 @@ class Game(models.Model):
     winner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     wolfed_users = models.JSONField(default=list)
     round_status = models.CharField(max_length=50, default="waiting_to_start")  # waiting, in_progress, completed
+    phase_deadline = models.DateTimeField(null=True, blank=True)  # when the current phase auto-advances
+
+class RoomCodeSequence(models.Model):
+    # Next sequence number to hand out to the room code allocator (see codes.py)
+    next_value = models.BigIntegerField(default=0)
+
+class GameSummary(models.Model):
+    # What is kept of a finished game once its room is collected (see lifecycle.py)
+    room_code = models.CharField(max_length=6)
+    room_name = models.CharField(max_length=100)
+    host = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="+")
+    winner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="+")
+    rounds_played = models.IntegerField(default=0)
+    leaderboard = models.JSONField(default=list)  # [{"username": ..., "score": ...}], best first
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+class PlayerStats(models.Model):
+    # Running totals per user over all time and per calendar period, see leaderboard.py
+    PERIODS = ["all", "week", "month"]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="game_stats")
+    period = models.CharField(max_length=5)
+    period_start = models.DateField()  # first day of the week or month; 1970-01-01 for "all"
+    games_played = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    total_score = models.IntegerField(default=0)
+    rounds_as_wolf = models.IntegerField(default=0)
+    pack_rounds = models.IntegerField(default=0)
+    pack_score_total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period', 'period_start'], name='unique_player_stats_period'),
+        ]
+        indexes = [
+            # Leaderboards read the top rows of one period in score order straight off this index
+            models.Index(fields=['period', 'period_start', '-total_score', 'user'], name='player_stats_leaderboard'),
+        ]
+
+    @property
+    def average_pack_score(self):
+        return self.pack_score_total / self.pack_rounds if self.pack_rounds else 0.0
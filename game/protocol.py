@@ -0,0 +1,161 @@
+# protocol.py
+"""
+Wire formats for the websocket consumers.
+
+Clients choose a format through the websocket subprotocol. Clients that ask
+for none, or for JSON_SUBPROTOCOL, get the JSON messages as before.
+
+MSGPACK_SUBPROTOCOL frames are binary msgpack arrays [type_code, payload].
+type_code is the index of the message type in MESSAGE_TYPES. The payload is
+the JSON message without its "type". On the gameplay socket the server first
+sends a "roster" frame listing [player_id, username] pairs. After that,
+players are referred to by their index in the roster instead of by username,
+both in the frames the server sends and in the rankings the client submits.
+Rankings are lists of roster indices, best position first.
+"""
+import json
+
+import msgpack
+
+JSON_SUBPROTOCOL = 'game.json.v1'
+MSGPACK_SUBPROTOCOL = 'game.msgpack.v1'
+
+# Codes are positions in this tuple, so only ever append to it
+MESSAGE_TYPES = (
+    'ping', 'pong', 'error', 'roster',
+    'player_joined', 'player_left', 'player_count', 'game_start',
+    'start_round', 'change_status', 'wolf_order', 'pack_order',
+    'round_start', 'wolf_timer', 'pack_timer', 'round_result', 'status_change', 'game_end',
+    'resume', 'snapshot',
+)
+MESSAGE_CODES = {message_type: code for code, message_type in enumerate(MESSAGE_TYPES)}
+
+# Outbound fields holding a username, or a {player_id: username} ranking
+# whose items are in rank order
+PLAYER_FIELDS = {
+    'round_start': ('wolf_id',),
+    'wolf_order': ('submitter',),
+    'snapshot': ('wolf_id',),
+}
+RANKING_FIELDS = {
+    'round_result': ('wolf_order', 'pack_order'),
+}
+
+# Inbound messages carrying an order, which msgpack clients send as a list of roster indices
+ORDER_MESSAGES = ('wolf_order', 'pack_order')
+
+
+# Channel layer event types and the client message each one is sent as
+EVENT_MESSAGES = {
+    'player_joined': 'player_joined',
+    'player_left': 'player_left',
+    'player_count': 'player_count',
+    'game_start_message': 'game_start',
+    'round_start_message': 'round_start',
+    'wolf_timer_message': 'wolf_timer',
+    'pack_timer_message': 'pack_timer',
+    'wolf_order_message': 'wolf_order',
+    'round_result_message': 'round_result',
+    'status_change_message': 'status_change',
+    'game_end_message': 'game_end',
+}
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Roster:
+    """The players of a room in a fixed order, shared with msgpack clients"""
+
+    def __init__(self, players):
+        self.players = [(player.id, player.username) for player in players]
+        self.ids = [player_id for player_id, _ in self.players]
+        self.index_by_username = {username: index for index, (_, username) in enumerate(self.players)}
+
+    def index(self, username):
+        return self.index_by_username.get(username, username)
+
+    def order_from_indices(self, indices):
+        """Turn a ranking given as roster indices into the {player_id: position} dict the engine uses"""
+        try:
+            return {str(self.players[index][0]): position for position, index in enumerate(indices)}
+        except (IndexError, TypeError):
+            raise ProtocolError("Invalid roster index in order")
+
+
+class JsonCodec:
+    subprotocol = None
+    binary = False
+
+    def encode(self, content, roster=None):
+        return json.dumps(content)
+
+    def decode(self, data, roster=None):
+        try:
+            content = json.loads(data)
+        except ValueError:
+            raise ProtocolError("Malformed JSON frame")
+        if not isinstance(content, dict):
+            raise ProtocolError("Frames must be JSON objects")
+        return content
+
+
+class MsgpackCodec:
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def encode(self, content, roster=None):
+        payload = dict(content)
+        message_type = payload.pop('type')
+        if roster is not None:
+            for field in PLAYER_FIELDS.get(message_type, ()):
+                if field in payload:
+                    payload[field] = roster.index(payload[field])
+            for field in RANKING_FIELDS.get(message_type, ()):
+                if field in payload:
+                    payload[field] = [roster.index(username) for username in payload[field].values()]
+        return msgpack.packb([MESSAGE_CODES[message_type], payload])
+
+    def decode(self, data, roster=None):
+        try:
+            code, payload = msgpack.unpackb(data, strict_map_key=False)
+            content = dict(payload, type=MESSAGE_TYPES[code] if code >= 0 else None)
+        except (ValueError, TypeError, IndexError):
+            raise ProtocolError("Malformed msgpack frame")
+        if roster is not None and content['type'] in ORDER_MESSAGES and isinstance(content.get('order'), list):
+            content['order'] = roster.order_from_indices(content['order'])
+        return content
+
+
+def choose_codec(subprotocols):
+    """Pick the codec for the subprotocols a client offered, preferring msgpack"""
+    if MSGPACK_SUBPROTOCOL in subprotocols:
+        return MsgpackCodec()
+    codec = JsonCodec()
+    if JSON_SUBPROTOCOL in subprotocols:
+        codec.subprotocol = JSON_SUBPROTOCOL
+    return codec
+
+
+def event_message(event):
+    """The client message for a channel layer event"""
+    message = {'type': EVENT_MESSAGES[event['type']]}
+    message.update((key, value) for key, value in event.items() if key not in ('type', 'frames'))
+    return message
+
+
+def encode_event(event, roster=None):
+    """
+    Attach the message encoded in every wire format to a channel layer event,
+    so that group members forward the frame for their format instead of
+    encoding the message once per socket. roster is the one msgpack gameplay
+    clients were given; members with a different roster encode for themselves.
+    """
+    message = event_message(event)
+    event['frames'] = {
+        'text': JsonCodec().encode(message),
+        'bytes': MsgpackCodec().encode(message, roster),
+        'roster': roster.ids if roster is not None else None,
+    }
+    return event
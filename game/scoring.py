@@ -0,0 +1,175 @@
+# scoring.py
+"""
+Scoring of the pack's ranking against the wolf's, and score persistence
+shared by the websocket consumers and the REST views.
+
+A ranking is the {player_id: position} dict clients submit. Both rankings of
+a round are turned into integer arrays once: the wolf's positions, and the
+pack's positions for the same players in the same order (MISSING where the
+pack left a player out). Every rule then works on those two arrays:
+
+    positional  one point per player the pack put exactly where the wolf did
+    kendall     one point per pair of players the pack ordered like the wolf
+    footrule    the most displacement possible minus the pack's total displacement
+    partial     PARTIAL_CREDIT points for an exact match, one less per place off
+
+positional is the original game's rule and the default. The rule is picked
+with GAME_SCORING_RULE, either one of the names above or the dotted path of
+a function taking the two arrays and returning the points. score_many scores
+a batch of rounds in one call; the loadtest command uses it to check the
+scores of every round it played.
+
+Scores are only ever changed by increments applied in the database, so two
+writers awarding points to the same room can't overwrite each other.
+"""
+from array import array
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import Player
+
+MISSING = -1
+PARTIAL_CREDIT = 2
+
+
+class InvalidRanking(ValueError):
+    pass
+
+
+def validate_ranking(ranking, player_ids):
+    """
+    Check a submitted ranking ranks known players, each once, at distinct
+    positions from 0 to len(player_ids) - 1. Returns it with the player ids
+    in canonical form, so that "01" and "1" are the same player.
+    """
+    if not isinstance(ranking, dict):
+        raise InvalidRanking('The order must map player ids to positions')
+    validated = {}
+    positions = set()
+    for player_id, position in ranking.items():
+        try:
+            key = str(int(player_id))
+        except (TypeError, ValueError):
+            key = None
+        if key is None or int(key) not in player_ids:
+            raise InvalidRanking(f'Unknown player {player_id} in order')
+        if key in validated:
+            raise InvalidRanking(f'Player {player_id} is ranked twice')
+        if type(position) is not int or not 0 <= position < len(player_ids):
+            raise InvalidRanking(f'Positions must be integers from 0 to {len(player_ids) - 1}')
+        if position in positions:
+            raise InvalidRanking('Two players share a position')
+        positions.add(position)
+        validated[key] = position
+    return validated
+
+
+def to_arrays(wolf_ranking, pack_ranking):
+    """The wolf's positions and the pack's positions for the same players"""
+    wolf = array('l', wolf_ranking.values())
+    pack = array('l', [pack_ranking.get(player_id, MISSING) for player_id in wolf_ranking])
+    return wolf, pack
+
+
+def positional(wolf, pack):
+    return sum(1 for wolf_position, pack_position in zip(wolf, pack) if wolf_position == pack_position)
+
+
+def _count_inversions(values):
+    """Pairs out of order in values, by merge sort in O(n log n)"""
+    if len(values) < 2:
+        return 0, values
+    middle = len(values) // 2
+    left_inversions, left = _count_inversions(values[:middle])
+    right_inversions, right = _count_inversions(values[middle:])
+    merged = array('l')
+    inversions = left_inversions + right_inversions
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] <= right[j]:
+            merged.append(left[i])
+            i += 1
+        else:
+            merged.append(right[j])
+            # right[j] comes before everything still left in left
+            inversions += len(left) - i
+            j += 1
+    merged.extend(left[i:])
+    merged.extend(right[j:])
+    return inversions, merged
+
+
+def kendall(wolf, pack):
+    """Concordant pairs among the players both rankings placed"""
+    ranked = sorted((wolf_position, pack_position)
+                    for wolf_position, pack_position in zip(wolf, pack) if pack_position != MISSING)
+    pack_in_wolf_order = array('l', [pack_position for _, pack_position in ranked])
+    inversions, _ = _count_inversions(pack_in_wolf_order)
+    pairs = len(ranked) * (len(ranked) - 1) // 2
+    return pairs - inversions
+
+
+def footrule(wolf, pack):
+    """Spearman's footrule turned into points; a player left out counts as displaced by n"""
+    n = len(wolf)
+    distance = sum(abs(wolf_position - pack_position) if pack_position != MISSING else n
+                   for wolf_position, pack_position in zip(wolf, pack))
+    return max(0, n * n // 2 - distance)
+
+
+def partial(wolf, pack):
+    return sum(max(0, PARTIAL_CREDIT - abs(wolf_position - pack_position))
+               for wolf_position, pack_position in zip(wolf, pack) if pack_position != MISSING)
+
+
+RULES = {
+    'positional': positional,
+    'kendall': kendall,
+    'footrule': footrule,
+    'partial': partial,
+}
+
+
+def get_rule(name=None):
+    name = name or getattr(settings, 'GAME_SCORING_RULE', 'positional')
+    rule = RULES.get(name)
+    if rule is None:
+        rule = RULES[name] = import_string(name)
+    return rule
+
+
+def score(wolf_ranking, pack_ranking, rule=None):
+    """Points the pack earns for its ranking"""
+    return get_rule(rule)(*to_arrays(wolf_ranking or {}, pack_ranking or {}))
+
+
+def score_many(rankings, rule=None):
+    """Score (wolf_ranking, pack_ranking) pairs in one call, returning an array of points"""
+    rule = get_rule(rule)
+    return array('l', [rule(*to_arrays(wolf_ranking or {}, pack_ranking or {}))
+                       for wolf_ranking, pack_ranking in rankings])
+
+
+def award_pack_score(room_id, wolf_user_id, points):
+    """
+    Add points to every player in the room except the wolf, in a single
+    UPDATE. Returns the number of players updated.
+    """
+    if points <= 0:
+        return 0
+    return (
+        Player.objects
+        .filter(players__id=room_id)
+        .exclude(user_id=wolf_user_id)
+        .update(score=F('score') + points)
+    )
+
+
+def award_pack_scores(awards):
+    """Apply a batch of (room_id, wolf_user_id, points) awards"""
+    updated = 0
+    for room_id, wolf_user_id, points in awards:
+        updated += award_pack_score(room_id, wolf_user_id, points)
+    return updated
@@ -0,0 +1,36 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from . import directory
+from .middleware import invalidate_cached_user
+from .models import Player, Room
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def drop_cached_websocket_user(sender, instance, created, **kwargs):
+    """Blacklisting any of a user's tokens drops their cached websocket user"""
+    if created and instance.token.user_id is not None:
+        invalidate_cached_user(instance.token.user_id)
+
+
+@receiver(m2m_changed, sender=Room.players.through)
+def update_player_directory(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep this worker's player directory in step with room membership"""
+    if reverse or not isinstance(instance, Room) or instance.code not in directory.players.rooms:
+        return
+    if action == 'post_add':
+        for player_id, user_id, username in (
+            Player.objects.filter(id__in=pk_set).values_list('id', 'user_id', 'user__username')
+        ):
+            directory.players.add(instance.code, player_id, user_id, username)
+    elif action == 'post_remove':
+        for player_id in pk_set:
+            directory.players.remove(instance.code, player_id)
+    elif action == 'post_clear':
+        directory.players.forget(instance.code)
+
+
+@receiver(post_delete, sender=Room)
+def forget_room_players(sender, instance, **kwargs):
+    directory.players.forget(instance.code)
@@ -0,0 +1,69 @@
+# snapshots.py
+"""
+Room snapshots for the lobby, which clients poll.
+
+Every change visible in a snapshot bumps Room.version, and the snapshot's
+ETag is derived from it. A poll that sends back the ETag it already has can
+then be answered with 304 after looking at that one column.
+"""
+from django.db.models import F
+from django.db.models.functions import Now
+
+from .models import Room
+
+
+def bump_room_version(*room_ids):
+    """Mark rooms as changed so pollers refetch their snapshot, and as active"""
+    Room.objects.filter(id__in=room_ids).update(version=F('version') + 1, last_activity=Now())
+
+
+def room_etag(room_code, version):
+    return f'"{room_code}-{version}"'
+
+
+def get_room_version(room_code):
+    return Room.objects.filter(code=room_code).values_list('version', flat=True).first()
+
+
+def build_room_snapshot(room_code):
+    """
+    Build the full lobby payload for a room in one query, joining the host,
+    players and game. Returns None if the room doesn't exist.
+    """
+    rows = list(
+        Room.objects
+        .filter(code=room_code)
+        .values(
+            'code', 'name', 'max_players', 'created_at', 'game_started', 'version',
+            'host__username', 'players__id', 'players__user__username',
+            'game__current_round', 'game__round_status',
+        )
+        .order_by('players__id')
+    )
+    if not rows:
+        return None
+
+    room = rows[0]
+    players = [
+        {"id": row['players__id'], "user__username": row['players__user__username']}
+        for row in rows if row['players__id'] is not None
+    ]
+    game = None
+    if room['game__current_round'] is not None:
+        game = {
+            "current_round": room['game__current_round'],
+            "round_status": room['game__round_status'],
+        }
+
+    return {
+        "room_code": room['code'],
+        "room_name": room['name'],
+        "host": room['host__username'],
+        "current_players": players,
+        "player_count": len(players),
+        "max_players": room['max_players'],
+        "created_at": room['created_at'],
+        "game_started": room['game_started'],
+        "game": game,
+        "version": room['version'],
+    }
@@ -0,0 +1,437 @@
+# state.py
+"""
+Room state for the gameplay websocket.
+
+The first GameplayConsumer to connect to a room loads the room, its players,
+rounds and game into a RoomState held by the configured GameStateStore (see
+store.py). Gameplay handlers then mutate that state instead of going back to
+the database for every frame, and the rows they touched are written back in
+batches by the write-behind flusher.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import transaction
+
+from .instrumentation import database_sync_to_async
+from .models import Room, Round, Game
+from .scoring import award_pack_scores
+from .snapshots import bump_room_version
+from .statistics import statistics_for_state
+
+logger = logging.getLogger(__name__)
+
+# Idempotency keys remembered per room; a client retrying a message sends it
+# again within a few actions, so a short window catches every duplicate
+ACTION_KEYS_KEPT = 64
+
+# Longest wait, in seconds, before retrying a room that failed to flush
+MAX_FLUSH_BACKOFF = 60
+
+
+class PlayerState:
+    __slots__ = ('id', 'user_id', 'username', 'score')
+
+    def __init__(self, id, user_id, username, score=0):
+        self.id = id
+        self.user_id = user_id
+        self.username = username
+        self.score = score
+
+
+class RoundState:
+    __slots__ = ('id', 'round_number', 'wolf_id', 'question',
+                 'wolf_ranking', 'pack_ranking', 'pack_score')
+
+    def __init__(self, id, round_number, wolf_id=None, question='',
+                 wolf_ranking=None, pack_ranking=None, pack_score=0):
+        self.id = id
+        self.round_number = round_number
+        self.wolf_id = wolf_id
+        self.question = question
+        self.wolf_ranking = wolf_ranking if wolf_ranking is not None else {}
+        self.pack_ranking = pack_ranking if pack_ranking is not None else {}
+        self.pack_score = pack_score
+
+
+class RoomState:
+    """Authoritative copy of a room while at least one gameplay socket is open"""
+    __slots__ = ('room_id', 'code', 'host_id', 'players', 'rounds',
+                 'game_id', 'current_round', 'round_status', 'wolfed_users',
+                 'game_over', 'phase_deadline', 'statistics', 'dirty_rounds', 'dirty_game', 'score_awards',
+                 'event_seq', 'action_keys')
+
+    def __init__(self, room_id, code, host_id):
+        self.room_id = room_id
+        self.code = code
+        self.host_id = host_id
+        self.players = {}  # player id -> PlayerState, in join order
+        self.rounds = {}  # round number -> RoundState
+        self.game_id = None
+        self.current_round = 1
+        self.round_status = "waiting_to_start"
+        self.wolfed_users = []
+        self.game_over = False
+        self.phase_deadline = None  # epoch seconds when the current phase auto-advances
+        self.statistics = None  # running end-of-game payload, see statistics.py
+        self.dirty_rounds = set()
+        self.dirty_game = False
+        self.score_awards = []  # [wolf user id, points] not yet applied to the database
+        self.event_seq = 0  # sequence number of the last event broadcast for this room, see eventlog.py
+        self.action_keys = []  # idempotency keys of the last ACTION_KEYS_KEPT actions, oldest first
+
+    def player_for_user(self, user_id):
+        for player in self.players.values():
+            if player.user_id == user_id:
+                return player
+        return None
+
+    def username_for_user(self, user_id):
+        player = self.player_for_user(user_id)
+        return player.username if player else None
+
+    def username_for_player(self, player_id):
+        try:
+            player = self.players.get(int(player_id))
+        except (TypeError, ValueError):
+            return None
+        return player.username if player else None
+
+    def pack_players(self, wolf_id):
+        """Players other than the wolf, lowest score first"""
+        pack = [player for player in self.players.values() if player.user_id != wolf_id]
+        pack.sort(key=lambda player: player.score)
+        return pack
+
+    def all_rounds_complete(self):
+        """Every player has had a round, i.e. each round was scored and current_round moved past it"""
+        return self.current_round > len(self.players)
+
+    def add_round(self, round_number):
+        """Create a round that has no row yet, the write-behind flush inserts it"""
+        round_state = self.rounds[round_number] = RoundState(
+            None, round_number, question=f"Question for round {round_number}")
+        self.mark_round(round_number)
+        return round_state
+
+    def mark_round(self, round_number):
+        self.dirty_rounds.add(round_number)
+
+    def mark_game(self):
+        self.dirty_game = True
+
+    def award_pack_score(self, wolf_id, points):
+        """Give every pack member points, queueing the same increment for the database"""
+        if points <= 0:
+            return
+        for player in self.players.values():
+            if player.user_id != wolf_id:
+                player.score += points
+        self.score_awards.append([wolf_id, points])
+
+    def sequence(self, events):
+        """Number events for broadcast, continuing the room's sequence"""
+        for event in events:
+            self.event_seq += 1
+            event['seq'] = self.event_seq
+        return events
+
+    def remember_action(self, key):
+        """Record the idempotency key of an applied action"""
+        self.action_keys.append(key)
+        del self.action_keys[:-ACTION_KEYS_KEPT]
+
+    @property
+    def is_dirty(self):
+        return bool(self.dirty_rounds) or self.dirty_game or bool(self.score_awards)
+
+    def take_changes(self):
+        """
+        Snapshot the dirty rows as unsaved model instances and clear the
+        dirty flags, so that mutations made while the snapshot is being
+        written are picked up by the next flush.
+        """
+        rounds = []
+        for number in self.dirty_rounds:
+            round_state = self.rounds.get(number)
+            if round_state is None:
+                continue
+            rounds.append(Round(
+                id=round_state.id,
+                room_id=self.room_id,
+                round_number=round_state.round_number,
+                wolf_id=round_state.wolf_id,
+                question=round_state.question,
+                wolf_ranking=dict(round_state.wolf_ranking),
+                pack_ranking=dict(round_state.pack_ranking),
+                pack_score=round_state.pack_score,
+            ))
+        games = []
+        if self.dirty_game and self.game_id is not None:
+            games.append(Game(
+                id=self.game_id,
+                room_id=self.room_id,
+                current_round=self.current_round,
+                round_status=self.round_status,
+                wolfed_users=list(self.wolfed_users),
+                game_over=self.game_over,
+                phase_deadline=(
+                    datetime.fromtimestamp(self.phase_deadline, tz=timezone.utc)
+                    if self.phase_deadline is not None else None
+                ),
+            ))
+        awards = [(self.room_id, wolf_id, points) for wolf_id, points in self.score_awards]
+
+        changes = (set(self.dirty_rounds), self.dirty_game, list(self.score_awards))
+        self.dirty_rounds.clear()
+        self.dirty_game = False
+        self.score_awards = []
+        return changes, rounds, games, awards
+
+    def restore_changes(self, changes):
+        """Put dirty flags back after a failed flush"""
+        dirty_rounds, dirty_game, score_awards = changes
+        self.dirty_rounds |= dirty_rounds
+        self.dirty_game = self.dirty_game or dirty_game
+        self.score_awards = score_awards + self.score_awards
+
+    def to_fields(self):
+        """
+        Encode the state as a flat mapping of field name -> JSON string.
+        Each round gets its own field so a store only rewrites what changed.
+        """
+        fields = {
+            'room': json.dumps([self.room_id, self.code, self.host_id]),
+            'game': json.dumps([self.game_id, self.current_round, self.round_status,
+                                self.wolfed_users, self.game_over, self.phase_deadline]),
+            'players': json.dumps([[player.id, player.user_id, player.username, player.score]
+                                   for player in self.players.values()]),
+            'stats': json.dumps(self.statistics),
+            'dirty': json.dumps([sorted(self.dirty_rounds), self.dirty_game, self.score_awards]),
+            'seq': str(self.event_seq),
+            'keys': json.dumps(self.action_keys),
+        }
+        for number, round_state in self.rounds.items():
+            fields[f'round:{number}'] = json.dumps([
+                round_state.id, round_state.round_number, round_state.wolf_id,
+                round_state.question, round_state.wolf_ranking,
+                round_state.pack_ranking, round_state.pack_score,
+            ])
+        return fields
+
+    @classmethod
+    def from_fields(cls, fields):
+        """Inverse of to_fields"""
+        room_id, code, host_id = json.loads(fields['room'])
+        state = cls(room_id, code, host_id)
+        (state.game_id, state.current_round, state.round_status,
+         state.wolfed_users, state.game_over, state.phase_deadline) = json.loads(fields['game'])
+        for player_id, user_id, username, score in json.loads(fields['players']):
+            state.players[player_id] = PlayerState(player_id, user_id, username, score)
+
+        state.statistics = json.loads(fields['stats'])
+        state.event_seq = int(fields.get('seq', 0))
+        state.action_keys = json.loads(fields.get('keys', '[]'))
+
+        rounds = []
+        for name, value in fields.items():
+            if name.startswith('round:'):
+                rounds.append(RoundState(*json.loads(value)))
+        for round_state in sorted(rounds, key=lambda round_state: round_state.round_number):
+            state.rounds[round_state.round_number] = round_state
+
+        dirty_rounds, state.dirty_game, state.score_awards = json.loads(fields['dirty'])
+        state.dirty_rounds = set(dirty_rounds)
+        return state
+
+
+def load_room_state(room_code):
+    """Build a RoomState from the database. Raises Room.DoesNotExist."""
+    room = Room.objects.get(code=room_code)
+    state = RoomState(room.id, room.code, room.host_id)
+
+    for player in room.players.select_related('user').order_by('id'):
+        username = player.user.username if player.user else None
+        state.players[player.id] = PlayerState(player.id, player.user_id, username, player.score)
+
+    for round_obj in Round.objects.filter(room=room).order_by('round_number'):
+        state.rounds[round_obj.round_number] = RoundState(
+            round_obj.id,
+            round_obj.round_number,
+            wolf_id=round_obj.wolf_id,
+            question=round_obj.question,
+            wolf_ranking=round_obj.wolf_ranking,
+            pack_ranking=round_obj.pack_ranking,
+            pack_score=round_obj.pack_score,
+        )
+
+    game = Game.objects.filter(room=room).first()
+    if game is not None:
+        state.game_id = game.id
+        state.current_round = game.current_round
+        state.round_status = game.round_status
+        state.wolfed_users = list(game.wolfed_users)
+        # Games that ended before game_over was kept have only their status to go by
+        state.game_over = game.game_over or game.round_status == "game_ended"
+        if game.phase_deadline is not None:
+            state.phase_deadline = game.phase_deadline.timestamp()
+    state.statistics = statistics_for_state(state)
+    return state
+
+
+def persist_changes(rounds, games, awards):
+    """Write a batch of snapshotted rows and score awards in one transaction"""
+    round_fields = ['wolf', 'question', 'wolf_ranking', 'pack_ranking', 'pack_score']
+    existing = [round_obj for round_obj in rounds if round_obj.id is not None]
+    created = [round_obj for round_obj in rounds if round_obj.id is None]
+    with transaction.atomic():
+        if existing:
+            Round.objects.bulk_update(existing, round_fields)
+        if created:
+            # Lazily created rounds have no id in the state, so every flush upserts them
+            Round.objects.bulk_create(
+                created, update_conflicts=True,
+                unique_fields=['room', 'round_number'], update_fields=round_fields)
+        if games:
+            Game.objects.bulk_update(
+                games, ['current_round', 'round_status', 'wolfed_users', 'game_over', 'phase_deadline'])
+        if awards:
+            award_pack_scores(awards)
+
+        # Let lobby pollers see the new game status and scores
+        room_ids = {obj.room_id for obj in rounds + games}
+        room_ids.update(room_id for room_id, _, _ in awards)
+        bump_room_version(*room_ids)
+
+
+def persist_room_changes(store, room_codes):
+    """
+    Flush rooms as one unit of work: lock their Game rows, take the pending
+    changes out of the store and write them in a single transaction. Changes
+    are only taken while the rows are locked, so when two workers flush the
+    same room, the one that took the newer changes also commits last. This
+    runs on the gameplay executor, so rooms are never loaded from here: a
+    load would wait for a thread this flush may be holding. Rooms the store
+    no longer holds have nothing to flush and are skipped.
+    """
+    update = async_to_sync(store.update)
+    batch = []
+    try:
+        with transaction.atomic():
+            list(
+                Game.objects
+                .select_for_update(of=('self',))
+                .filter(room__code__in=room_codes)
+                .order_by('id')
+                .values_list('id', flat=True)
+            )
+
+            rounds, games, awards = [], [], []
+            for code in room_codes:
+                taken = update(code, RoomState.take_changes, load=False)
+                if taken is None:
+                    continue
+                changes, room_rounds, room_games, room_awards = taken
+                batch.append((code, changes))
+                rounds.extend(room_rounds)
+                games.extend(room_games)
+                awards.extend(room_awards)
+
+            if rounds or games or awards:
+                persist_changes(rounds, games, awards)
+    except Exception:
+        # Nothing was written, hand the changes back to the state
+        for code, changes in batch:
+            update(code, lambda state, changes=changes: state.restore_changes(changes), load=False)
+        raise
+
+
+class WriteBehind:
+    """
+    Collects rooms with dirty state and persists them together after a short
+    delay, so a burst of gameplay messages costs one transaction. Dirty flags
+    live on the state itself, so whichever worker flushes picks up every
+    change made since the last flush.
+
+    A room that fails to flush is retried on its own with exponential backoff.
+    After GAME_STATE_FLUSH_ATTEMPTS failures in a row its changes are dropped.
+    """
+
+    def __init__(self, store, interval, max_attempts=None):
+        self.store = store
+        self.interval = interval
+        if max_attempts is None:
+            max_attempts = getattr(settings, 'GAME_STATE_FLUSH_ATTEMPTS', 8)
+        self.max_attempts = max_attempts
+        self.pending = set()
+        self.failures = {}  # room code -> flushes failed in a row
+        self._retries = {}  # room code -> TimerHandle of its next retry
+        self._task = None
+
+    def schedule(self, room_code):
+        self.pending.add(room_code)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self, room_code=None):
+        """Persist pending rooms now, either all of them or a single room"""
+        if room_code is None:
+            room_codes = list(self.pending)
+            self.pending.clear()
+        else:
+            self.pending.discard(room_code)
+            room_codes = [room_code]
+
+        if not room_codes:
+            return
+
+        if len(room_codes) > 1:
+            try:
+                await self._persist(room_codes)
+                return
+            except Exception:
+                # Flush the rooms one by one, so one bad room doesn't hold back the others
+                logger.warning("Failed to persist %d rooms together, retrying them one by one", len(room_codes))
+
+        for code in room_codes:
+            try:
+                await self._persist([code])
+            except Exception:
+                await self._failed(code)
+
+    async def _persist(self, room_codes):
+        await database_sync_to_async(persist_room_changes, executor='gameplay')(self.store, room_codes)
+        for code in room_codes:
+            self.failures.pop(code, None)
+            retry = self._retries.pop(code, None)
+            if retry is not None:
+                retry.cancel()
+
+    async def _failed(self, room_code):
+        failures = self.failures.get(room_code, 0) + 1
+        if failures >= self.max_attempts:
+            logger.exception("Failed to persist room %s %d times, dropping its changes", room_code, failures)
+            self.failures.pop(room_code, None)
+            await self.store.update(room_code, RoomState.take_changes, load=False)
+            await self.store.evict(room_code)
+            return
+
+        self.failures[room_code] = failures
+        delay = min(self.interval * 2 ** failures, MAX_FLUSH_BACKOFF)
+        logger.exception("Failed to persist room %s, retrying in %.1fs", room_code, delay)
+        retry = self._retries.pop(room_code, None)
+        if retry is not None:
+            retry.cancel()
+        self._retries[room_code] = asyncio.get_running_loop().call_later(delay, self._retry, room_code)
+
+    def _retry(self, room_code):
+        self._retries.pop(room_code, None)
+        self.schedule(room_code)
@@ -0,0 +1,101 @@
+# statistics.py
+"""
+End-of-game statistics.
+
+The payload sent with game_end is built incrementally: every completed round
+is folded into the room's running statistics, so ending the game only reads
+what is already there. build_game_statistics produces the same payload from
+the database for rooms that are not loaded in memory.
+"""
+from django.db.models import OuterRef, Subquery
+
+from .models import Player, Round, Game
+
+
+def new_statistics(players):
+    """Empty statistics for a list of PlayerState"""
+    statistics = {
+        'players': {},
+        'round_data': [],
+        'winners': [],
+        'leaderboard': [],
+    }
+    for player in players:
+        statistics['players'][player.username] = {
+            'username': player.username,
+            'total_score': player.score,
+            'round_scores': [],
+            'rounds_as_wolf': 0,
+        }
+    update_leaderboard(statistics)
+    return statistics
+
+
+def record_round(statistics, players, round_state, wolf_username):
+    """Fold a completed round into the running statistics"""
+    for player in players:
+        player_stats = statistics['players'].get(player.username)
+        if player_stats is None:
+            continue
+        # Track if player was wolf
+        if round_state.wolf_id is not None and round_state.wolf_id == player.user_id:
+            player_stats['rounds_as_wolf'] += 1
+        else:
+            player_stats['round_scores'].append(round_state.pack_score)
+        player_stats['total_score'] = player.score
+
+    statistics['round_data'].append({
+        'round_number': round_state.round_number,
+        'question': round_state.question,
+        'wolf': wolf_username,
+        'scores': round_state.pack_score
+    })
+    update_leaderboard(statistics)
+
+
+def update_leaderboard(statistics):
+    leaderboard = sorted(
+        ({'username': username, 'score': player_stats['total_score']}
+         for username, player_stats in statistics['players'].items()),
+        key=lambda entry: entry['score'],
+        reverse=True,
+    )
+    statistics['leaderboard'] = leaderboard
+    if leaderboard:
+        max_score = leaderboard[0]['score']
+        statistics['winners'] = [entry['username'] for entry in leaderboard if entry['score'] == max_score]
+    else:
+        statistics['winners'] = []
+
+
+def statistics_for_state(state):
+    """Rebuild the running statistics of a RoomState from its completed rounds"""
+    players = list(state.players.values())
+    statistics = new_statistics(players)
+    for round_state in state.rounds.values():
+        if round_state.round_number < state.current_round:
+            record_round(statistics, players, round_state, state.username_for_user(round_state.wolf_id))
+    return statistics
+
+
+def build_game_statistics(room_id):
+    """Build the end-of-game payload for a room from the database in two queries"""
+    from .state import PlayerState
+
+    players = [
+        PlayerState(player.id, player.user_id, player.user.username if player.user else None, player.score)
+        for player in Player.objects.filter(players__id=room_id).select_related('user').order_by('id')
+    ]
+    statistics = new_statistics(players)
+
+    # Only rounds before the game's current round have been played
+    current_round = Game.objects.filter(room_id=OuterRef('room_id')).values('current_round')[:1]
+    rounds = (
+        Round.objects
+        .filter(room_id=room_id, round_number__lt=Subquery(current_round))
+        .select_related('wolf')
+        .order_by('round_number')
+    )
+    for round_obj in rounds:
+        record_round(statistics, players, round_obj, round_obj.wolf.username if round_obj.wolf else None)
+    return statistics
@@ -0,0 +1,300 @@
+# store.py
+"""
+Pluggable storage for live room state.
+
+GAME_STATE_STORE in settings picks the backend, the same way CHANNEL_LAYERS
+picks a channel layer:
+
+    GAME_STATE_STORE = {
+        "BACKEND": "game.store.RedisGameStateStore",
+        "OPTIONS": {"url": "redis://localhost:6379/1", "ttl": 86400},
+    }
+
+The in-memory backend keeps state inside one process and is what tests and
+single-worker deployments use. The Redis backend keeps each room in a hash so
+that any number of ASGI workers can serve the same room.
+
+Every change goes through update(room_code, mutate): mutate is a plain
+function that receives the RoomState, changes it and returns a result. The
+store guarantees that no other update to the same room interleaves with it.
+"""
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .eventlog import RedisStreamEventLog, RingBufferEventLog
+from .instrumentation import database_sync_to_async
+from .state import RoomState, WriteBehind, load_room_state
+
+logger = logging.getLogger(__name__)
+
+
+class GameStateStore:
+    """
+    Base class for state stores. Subclasses implement _read, _create and
+    update, and keep the recent events of their rooms in self.events.
+    """
+
+    def __init__(self, flush_interval=None, event_log_size=None):
+        if event_log_size is None:
+            event_log_size = getattr(settings, 'GAME_EVENT_LOG_SIZE', 128)
+        self.event_log_size = event_log_size
+        if flush_interval is None:
+            flush_interval = getattr(settings, 'GAME_STATE_FLUSH_INTERVAL', 0.5)
+        self.writer = WriteBehind(self, flush_interval)
+        self.connections = {}
+        self._loading = {}
+
+    async def acquire(self, room_code):
+        """Register a gameplay connection in this worker and make sure the room is loaded"""
+        self.connections[room_code] = self.connections.get(room_code, 0) + 1
+        return await self.load(room_code)
+
+    async def release(self, room_code):
+        """Drop a gameplay connection, flushing the room after this worker's last one"""
+        remaining = self.connections.get(room_code, 0) - 1
+        if remaining > 0:
+            self.connections[room_code] = remaining
+            return
+        self.connections.pop(room_code, None)
+        await self.writer.flush(room_code)
+        await self.evict(room_code)
+
+    async def load(self, room_code):
+        """
+        Return the state for a room, loading it from the database on first use.
+        Rooms loaded before the game was started are reloaded until a game exists.
+        Raises Room.DoesNotExist.
+        """
+        state = await self._read(room_code)
+        if state is not None and state.game_id is not None:
+            return state
+
+        # Concurrent loads of the same room in this worker share one query
+        loading = self._loading.get(room_code)
+        if loading is None:
+            loading = asyncio.ensure_future(database_sync_to_async(load_room_state, executor='gameplay')(room_code))
+            self._loading[room_code] = loading
+            try:
+                fresh = await loading
+            finally:
+                self._loading.pop(room_code, None)
+        else:
+            fresh = await loading
+        return await self._create(room_code, fresh)
+
+    def save(self, room_code):
+        """Queue a room for write-behind persistence"""
+        self.writer.schedule(room_code)
+
+    async def save_now(self, room_code):
+        self.writer.schedule(room_code)
+        await self.writer.flush(room_code)
+
+    async def _read(self, room_code):
+        raise NotImplementedError
+
+    async def _create(self, room_code, state):
+        """Store a freshly loaded state unless another loader already stored one with a game"""
+        raise NotImplementedError
+
+    async def update(self, room_code, mutate, load=True):
+        """
+        Apply mutate to the room state and return its result. With load=False
+        a room this store does not hold is left alone and None is returned,
+        for callers that must not wait on the gameplay executor.
+        """
+        raise NotImplementedError
+
+    async def evict(self, room_code):
+        """Forget a room this worker no longer serves"""
+        pass
+
+    @asynccontextmanager
+    async def lease(self, room_code):
+        """Hold the room against actions from other workers, see locks.py"""
+        yield
+
+
+class InMemoryGameStateStore(GameStateStore):
+    """
+    Keeps RoomState objects in a dict. Mutations are plain synchronous calls
+    on the event loop, so they are atomic without any locking.
+    """
+
+    def __init__(self, flush_interval=None, event_log_size=None):
+        super().__init__(flush_interval, event_log_size)
+        self.rooms = {}
+        self.events = RingBufferEventLog(self.event_log_size)
+
+    async def _read(self, room_code):
+        return self.rooms.get(room_code)
+
+    async def _create(self, room_code, state):
+        current = self.rooms.get(room_code)
+        if current is not None and current.game_id is not None:
+            return current
+        # A fresh state restarts the event sequence
+        self.rooms[room_code] = state
+        await self.events.clear(room_code)
+        return state
+
+    async def update(self, room_code, mutate, load=True):
+        state = self.rooms.get(room_code)
+        if state is None and not load:
+            return None
+        if load and (state is None or state.game_id is None):
+            state = await self.load(room_code)
+        return mutate(state)
+
+    async def evict(self, room_code):
+        state = self.rooms.get(room_code)
+        if state is not None and not state.is_dirty and room_code not in self.connections:
+            del self.rooms[room_code]
+            await self.events.clear(room_code)
+
+
+class RedisGameStateStore(GameStateStore):
+    """
+    Keeps each room in a Redis hash (see RoomState.to_fields). Updates use
+    WATCH/MULTI: the hash is read, mutated locally and only the changed fields
+    are written back, retrying if another worker touched the room meanwhile.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='game:room:', ttl=86400,
+                 flush_interval=None, event_log_size=None, client=None, lease_ttl=None):
+        super().__init__(flush_interval, event_log_size)
+        if lease_ttl is None:
+            lease_ttl = getattr(settings, 'GAME_ROOM_LEASE_TTL', 5)
+        self.lease_ttl = lease_ttl
+        if client is None:
+            from redis.asyncio import Redis
+            client = Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.events = RedisStreamEventLog(client, prefix, self.event_log_size, ttl)
+
+    def key(self, room_code):
+        return f'{self.prefix}{room_code}'
+
+    @asynccontextmanager
+    async def lease(self, room_code):
+        """
+        Hold the room's lease key (SET NX with a TTL) while an action runs, so
+        workers take turns instead of retrying each other's WATCH. The lease
+        only orders actions: updates stay correct without it. A worker that
+        can't get it within lease_ttl, e.g. because its holder died, goes ahead
+        anyway. A lease_ttl of 0 turns leases off.
+        """
+        if not self.lease_ttl:
+            yield
+            return
+
+        key = f'{self.key(room_code)}:lease'
+        token = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        give_up = loop.time() + self.lease_ttl
+        delay = 0.002
+        while not await self.redis.set(key, token, nx=True, px=int(self.lease_ttl * 1000)):
+            if loop.time() >= give_up:
+                logger.warning("Room %s lease not released in %ss, going ahead without it", room_code, self.lease_ttl)
+                token = None
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            if token is not None:
+                await self._release_lease(key, token)
+
+    async def _release_lease(self, key, token):
+        """Delete the lease key if it is still ours"""
+        from redis.exceptions import WatchError
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) == token:
+                    pipe.multi()
+                    pipe.delete(key)
+                    await pipe.execute()
+            except WatchError:
+                # Expired and taken by another worker meanwhile
+                pass
+
+    async def _read(self, room_code):
+        fields = await self.redis.hgetall(self.key(room_code))
+        return RoomState.from_fields(fields) if fields else None
+
+    async def _create(self, room_code, state):
+        from redis.exceptions import WatchError
+
+        key = self.key(room_code)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    fields = await pipe.hgetall(key)
+                    if fields:
+                        current = RoomState.from_fields(fields)
+                        if current.game_id is not None:
+                            return current
+                    pipe.multi()
+                    # A fresh state restarts the event sequence
+                    pipe.delete(key, self.events.key(room_code))
+                    pipe.hset(key, mapping=state.to_fields())
+                    pipe.expire(key, self.ttl)
+                    await pipe.execute()
+                    return state
+                except WatchError:
+                    continue
+
+    async def update(self, room_code, mutate, load=True):
+        from redis.exceptions import WatchError
+
+        key = self.key(room_code)
+        reloaded = False
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    fields = await pipe.hgetall(key)
+                    state = RoomState.from_fields(fields) if fields else None
+                    if state is None and not load:
+                        await pipe.unwatch()
+                        return None
+                    if load and (state is None or (not reloaded and state.game_id is None)):
+                        # Expired, never loaded or loaded before the game started
+                        await pipe.unwatch()
+                        await self.load(room_code)
+                        reloaded = True
+                        continue
+                    result = mutate(state)
+                    changed = {
+                        name: value for name, value in state.to_fields().items()
+                        if fields.get(name) != value
+                    }
+                    pipe.multi()
+                    if changed:
+                        pipe.hset(key, mapping=changed)
+                    pipe.expire(key, self.ttl)
+                    await pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+
+def get_state_store():
+    """Build the store configured in settings.GAME_STATE_STORE"""
+    config = getattr(settings, 'GAME_STATE_STORE', {})
+    backend = import_string(config.get('BACKEND', 'game.store.InMemoryGameStateStore'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+room_states = get_state_store()
@@ -0,0 +1,73 @@
+# test_codes.py
+import random
+
+from django.test import TestCase, override_settings
+
+from ..codes import ALPHABET, CODE_LENGTH, FEISTEL_ROUNDS, HALF, SPACE, RoomCodeAllocator, _round_function, encode, permute
+from ..models import RoomCodeSequence
+
+KEY = b'test-key'
+
+
+def unpermute(value, key):
+    """Run the Feistel rounds of permute backwards"""
+    left, right = divmod(value, HALF)
+    for round_index in reversed(range(FEISTEL_ROUNDS)):
+        left, right = (right - _round_function(left, round_index, key)) % HALF, left
+    return left * HALF + right
+
+
+class PermuteTests(TestCase):
+
+    def test_permute_is_a_bijection(self):
+        # permute maps range(SPACE) into itself and has an inverse, so it is
+        # one-to-one and onto
+        samples = [0, 1, HALF - 1, HALF, SPACE - 2, SPACE - 1] + random.Random(7).sample(range(SPACE), 2000)
+        for index in samples:
+            value = permute(index, KEY)
+            self.assertTrue(0 <= value < SPACE)
+            self.assertEqual(unpermute(value, KEY), index)
+
+    def test_consecutive_indices_never_collide(self):
+        values = {permute(index, KEY) for index in range(20000)}
+        self.assertEqual(len(values), 20000)
+
+    def test_key_changes_the_permutation(self):
+        self.assertNotEqual([permute(index, KEY) for index in range(10)],
+                            [permute(index, b'other-key') for index in range(10)])
+
+    def test_encode(self):
+        self.assertEqual(encode(0), 'AAAAAA')
+        self.assertEqual(encode(SPACE - 1), '999999')
+        code = encode(permute(12345, KEY))
+        self.assertEqual(len(code), CODE_LENGTH)
+        self.assertTrue(set(code) <= set(ALPHABET))
+
+
+class RoomCodeAllocatorTests(TestCase):
+
+    def test_allocates_unique_codes_in_blocks(self):
+        allocator = RoomCodeAllocator(block_size=3, key=KEY)
+        codes = [allocator.allocate() for _ in range(7)]
+        self.assertEqual(len(set(codes)), 7)
+        self.assertEqual(RoomCodeSequence.objects.get(pk=1).next_value, 9)
+
+    def test_allocators_share_the_sequence(self):
+        first = RoomCodeAllocator(block_size=5, key=KEY)
+        second = RoomCodeAllocator(block_size=5, key=KEY)
+        codes = [allocator.allocate() for _ in range(5) for allocator in (first, second)]
+        self.assertEqual(len(set(codes)), 10)
+
+    @override_settings(ROOM_CODE_REUSE_DELAY=0)
+    def test_released_codes_are_reused(self):
+        allocator = RoomCodeAllocator(block_size=3, key=KEY)
+        code = allocator.allocate()
+        allocator.release(code)
+        self.assertEqual(allocator.allocate(), code)
+
+    @override_settings(ROOM_CODE_REUSE_DELAY=3600)
+    def test_released_codes_wait_for_the_delay(self):
+        allocator = RoomCodeAllocator(block_size=3, key=KEY)
+        code = allocator.allocate()
+        allocator.release(code)
+        self.assertNotEqual(allocator.allocate(), code)
@@ -0,0 +1,56 @@
+# test_directory.py
+import asyncio
+from unittest import mock
+
+from django.test import TransactionTestCase
+
+from .. import directory
+from ..directory import PlayerDirectory
+from ..models import Player
+from .utils import create_room
+
+
+class PlayerDirectoryTests(TransactionTestCase):
+
+    def setUp(self):
+        self.room = create_room('LOBBY1', started=False)
+        self.player_ids = list(Player.objects.filter(players=self.room).values_list('id', flat=True))
+        self.players = PlayerDirectory(reload_interval=60)
+
+    def count_loads(self):
+        return mock.patch.object(directory, 'load_room_players', wraps=directory.load_room_players)
+
+    async def test_lookups_are_cached(self):
+        with self.count_loads() as load:
+            for player_id in self.player_ids:
+                entry = await self.players.get(self.room.code, player_id)
+                self.assertIsNotNone(entry)
+        self.assertEqual(load.call_count, 1)
+
+    async def test_misses_reload_once_per_interval(self):
+        with self.count_loads() as load:
+            for _ in range(5):
+                self.assertIsNone(await self.players.get(self.room.code, 999999))
+        # The first load, then one reload for the unknown id
+        self.assertEqual(load.call_count, 2)
+
+    async def test_a_new_player_is_found_after_the_interval(self):
+        self.players.reload_interval = 0
+        await self.players.get(self.room.code, 999999)
+        new_room = await asyncio.to_thread(create_room, 'LOBBY2', 1, False)
+        player = await Player.objects.filter(players=new_room).afirst()
+        await self.room.players.aadd(player)
+
+        entry = await self.players.get(self.room.code, player.id)
+        self.assertEqual(entry.username, 'lobby2-0')
+
+    async def test_last_lobby_socket_forgets_the_room(self):
+        self.players.acquire(self.room.code)
+        self.players.acquire(self.room.code)
+        await self.players.get(self.room.code, self.player_ids[0])
+
+        self.players.release(self.room.code)
+        self.assertIn(self.room.code, self.players.rooms)
+        self.players.release(self.room.code)
+        self.assertNotIn(self.room.code, self.players.rooms)
+        self.assertNotIn(self.room.code, self.players.connections)
@@ -0,0 +1,164 @@
+# test_dispatch.py
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from .. import dispatch, engine
+from ..models import Game, PlayerStats
+from ..state import ACTION_KEYS_KEPT, PlayerState, RoomState
+from ..statistics import new_statistics
+from ..store import InMemoryGameStateStore
+from .utils import create_room
+
+
+def started_state():
+    state = RoomState(1, 'DISP01', 10)
+    for player_id, user_id in ((1, 10), (2, 20), (3, 30)):
+        state.players[player_id] = PlayerState(player_id, user_id, f'user{user_id}')
+    state.game_id = 1
+    state.statistics = new_statistics(list(state.players.values()))
+    return state
+
+
+def play_round(state, round_number):
+    events = engine.start_round(state, state.host_id, round_number)
+    wolf_id = state.rounds[round_number].wolf_id
+    order = {str(player_id): position for position, player_id in enumerate(state.players)}
+    engine.submit_wolf_order(state, wolf_id, order, round_number)
+    engine.submit_pack_order(state, order, round_number)
+    return events
+
+
+class GameEndTests(SimpleTestCase):
+
+    def test_rounds_are_not_complete_before_they_are_played(self):
+        state = started_state()
+        for round_number in range(1, 4):
+            state.add_round(round_number)
+        self.assertFalse(state.all_rounds_complete())
+
+    def test_game_ends_once(self):
+        state = started_state()
+        for round_number in range(1, 4):
+            play_round(state, round_number)
+        self.assertFalse(state.game_over)
+
+        events = engine.start_round(state, state.host_id, 4)
+        self.assertEqual([event['type'] for event in events], ['game_end_message'])
+        self.assertTrue(state.game_over)
+        self.assertEqual(state.round_status, 'game_ended')
+
+        with self.assertRaises(engine.ActionRejected):
+            engine.start_round(state, state.host_id, 4)
+        with self.assertRaises(engine.ActionRejected):
+            engine.change_status(state, 'pack_selection', 4)
+        self.assertEqual(engine.expire_phase(state, state.phase_deadline), [])
+
+    def test_host_cannot_end_the_game_early(self):
+        state = started_state()
+        for round_number in range(1, 4):
+            state.add_round(round_number)
+        play_round(state, 1)
+        with self.assertRaises(engine.ActionRejected):
+            engine.start_round(state, state.host_id, 4)
+        self.assertFalse(state.game_over)
+
+
+class RunOnceTests(SimpleTestCase):
+
+    def test_duplicate_key_runs_once(self):
+        state = started_state()
+        events, _, roster = dispatch.run_once(state, engine.change_status, ('pack_selection', 1), 'key-1')
+        self.assertEqual([event['seq'] for event in events], [1])
+        self.assertIsNotNone(roster)
+
+        state.round_status = 'wolf_selection'
+        events, _, roster = dispatch.run_once(state, engine.change_status, ('pack_selection', 1), 'key-1')
+        self.assertEqual(events, [])
+        self.assertIsNone(roster)
+        self.assertEqual(state.round_status, 'wolf_selection')
+        self.assertEqual(state.event_seq, 1)
+
+    def test_actions_without_key_always_run(self):
+        state = started_state()
+        for _ in range(3):
+            dispatch.run_once(state, engine.change_status, ('pack_selection', 1), None)
+        self.assertEqual(state.event_seq, 3)
+        self.assertEqual(state.action_keys, [])
+
+    def test_only_recent_keys_are_kept(self):
+        state = started_state()
+        for n in range(ACTION_KEYS_KEPT + 1):
+            dispatch.run_once(state, engine.change_status, ('pack_selection', 1), f'key-{n}')
+        self.assertEqual(len(state.action_keys), ACTION_KEYS_KEPT)
+        self.assertNotIn('key-0', state.action_keys)
+
+    def test_keys_survive_serialization(self):
+        state = started_state()
+        dispatch.run_once(state, engine.change_status, ('pack_selection', 1), 'key-1')
+        state = RoomState.from_fields(state.to_fields())
+        _, _, roster = dispatch.run_once(state, engine.change_status, ('pack_selection', 1), 'key-1')
+        self.assertIsNone(roster)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ApplyActionTests(TransactionTestCase):
+
+    def setUp(self):
+        self.room = create_room('DISP02')
+        self.store = InMemoryGameStateStore(flush_interval=60)
+        patcher = mock.patch.object(dispatch, 'room_states', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_retried_message_is_applied_once(self):
+        code = self.room.code
+        await self.store.acquire(code)
+        events = await dispatch.apply_action(code, engine.change_status, 'pack_selection', 1, key='retry')
+        self.assertEqual([event['seq'] for event in events], [1])
+        self.assertIsNone(await dispatch.apply_action(code, engine.change_status, 'pack_selection', 1, key='retry'))
+
+        state = await self.store.load(code)
+        self.assertEqual(state.event_seq, 1)
+        self.assertEqual(len(await self.store.events.since(code, 0, 1)), 1)
+        await self.store.writer.flush()
+
+    async def test_game_end_is_recorded_once(self):
+        code = self.room.code
+        state = await self.store.acquire(code)
+        for round_number in range(1, 4):
+            await self.store.update(code, lambda state, n=round_number: play_round(state, n))
+
+        events = await dispatch.apply_action(code, engine.start_round, state.host_id, 4)
+        self.assertEqual([event['type'] for event in events], ['game_end_message'])
+        with self.assertRaises(engine.ActionRejected):
+            await dispatch.apply_action(code, engine.start_round, state.host_id, 4)
+
+        game = await Game.objects.aget(room=self.room)
+        self.assertTrue(game.game_over)
+        games_played = [stats.games_played async for stats in PlayerStats.objects.filter(period='all')]
+        self.assertEqual(games_played, [1, 1, 1])
+
+    async def test_last_release_cancels_the_phase_timer(self):
+        code = self.room.code
+        await self.store.acquire(code)
+        await self.store.acquire(code)
+        dispatch.arm_phase_timer(code, time.time() + 60)
+
+        await dispatch.release_room(code)
+        self.assertIn(code, dispatch.phase_timers)
+        await dispatch.release_room(code)
+        self.assertNotIn(code, dispatch.phase_timers)
+        self.assertNotIn(code, self.store.rooms)
+
+    async def test_deadline_without_sockets_leaves_the_room_evicted(self):
+        code = self.room.code
+        state = await self.store.load(code)
+        deadline = state.phase_deadline = time.time() - 1
+
+        await dispatch.expire_phase(code, deadline)
+        self.assertNotIn(code, self.store.rooms)
+        self.assertNotIn(code, dispatch.phase_timers)
+        game = await Game.objects.aget(room=self.room)
+        self.assertEqual(game.round_status, 'wolf_selection')
@@ -0,0 +1,103 @@
+# test_engine.py
+from django.test import SimpleTestCase
+
+from .. import engine
+from ..state import PlayerState, RoomState
+from ..statistics import new_statistics
+
+
+def started_state(players=3):
+    state = RoomState(1, 'ENGINE', 10)
+    for player_id in range(1, players + 1):
+        state.players[player_id] = PlayerState(player_id, player_id * 10, f'user{player_id}')
+    state.game_id = 1
+    state.statistics = new_statistics(list(state.players.values()))
+    return state
+
+
+def wolf_of(state, round_number):
+    return state.rounds[round_number].wolf_id
+
+
+def failing_rule(wolf, pack):
+    raise RuntimeError('scoring failed')
+
+
+class RankingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.state = started_state()
+        self.state.add_round(1)
+        engine.start_round(self.state, self.state.host_id, 1)
+
+    def test_out_of_range_positions_are_rejected(self):
+        with self.assertRaises(engine.ActionRejected):
+            engine.submit_wolf_order(self.state, wolf_of(self.state, 1), {'1': 10 ** 20}, 1)
+        self.assertEqual(self.state.rounds[1].wolf_ranking, {})
+        self.assertEqual(self.state.round_status, 'wolf_selection')
+
+    def test_rankings_are_stored_canonical(self):
+        engine.submit_wolf_order(self.state, wolf_of(self.state, 1), {'01': 0, '2': 1, '3': 2}, 1)
+        self.assertEqual(self.state.rounds[1].wolf_ranking, {'1': 0, '2': 1, '3': 2})
+        events = engine.submit_pack_order(self.state, {'3': 2, '002': 1, '1': 0}, 1)
+        self.assertEqual(events[0]['pack_score'], 3)
+
+    def test_failed_scoring_leaves_the_round_unchanged(self):
+        engine.submit_wolf_order(self.state, wolf_of(self.state, 1), {'1': 0, '2': 1, '3': 2}, 1)
+        with self.settings(GAME_SCORING_RULE='game.tests.test_engine.failing_rule'):
+            with self.assertRaises(RuntimeError):
+                engine.submit_pack_order(self.state, {'1': 0}, 1)
+        current_round = self.state.rounds[1]
+        self.assertEqual((current_round.pack_ranking, current_round.pack_score), ({}, 0))
+        self.assertEqual(self.state.current_round, 1)
+        self.assertEqual(self.state.score_awards, [])
+
+
+class PhaseTests(SimpleTestCase):
+
+    def setUp(self):
+        self.state = started_state()
+        for round_number in range(1, 4):
+            self.state.add_round(round_number)
+        self.order = {'1': 0, '2': 1, '3': 2}
+
+    def assertRejected(self, action, *args):
+        with self.assertRaises(engine.ActionRejected):
+            action(self.state, *args)
+
+    def test_round_starts_once(self):
+        engine.start_round(self.state, self.state.host_id, 1)
+        wolf = wolf_of(self.state, 1)
+        self.assertRejected(engine.start_round, self.state.host_id, 1)
+        self.assertEqual(wolf_of(self.state, 1), wolf)
+        self.assertEqual(self.state.wolfed_users, [wolf])
+
+    def test_rounds_start_in_order(self):
+        self.assertRejected(engine.start_round, self.state.host_id, 2)
+        self.assertIsNone(wolf_of(self.state, 2))
+
+    def test_pack_order_needs_the_wolf_order(self):
+        engine.start_round(self.state, self.state.host_id, 1)
+        self.assertRejected(engine.submit_pack_order, self.order, 1)
+        self.assertEqual(self.state.rounds[1].pack_ranking, {})
+
+    def test_wolf_order_is_taken_once(self):
+        engine.start_round(self.state, self.state.host_id, 1)
+        engine.submit_wolf_order(self.state, wolf_of(self.state, 1), self.order, 1)
+        self.assertRejected(engine.submit_wolf_order, wolf_of(self.state, 1), {'1': 2, '2': 1, '3': 0}, 1)
+        self.assertEqual(self.state.rounds[1].wolf_ranking, self.order)
+
+    def test_resent_pack_order_scores_once(self):
+        engine.start_round(self.state, self.state.host_id, 1)
+        engine.submit_wolf_order(self.state, wolf_of(self.state, 1), self.order, 1)
+        engine.submit_pack_order(self.state, self.order, 1)
+        scores = [player.score for player in self.state.players.values()]
+
+        self.assertRejected(engine.submit_pack_order, self.order, 1)
+        self.assertEqual([player.score for player in self.state.players.values()], scores)
+        self.assertEqual(self.state.current_round, 2)
+        self.assertEqual(len(self.state.score_awards), 1)
+
+    def test_orders_for_another_round_are_rejected(self):
+        engine.start_round(self.state, self.state.host_id, 1)
+        self.assertRejected(engine.submit_wolf_order, wolf_of(self.state, 1), self.order, 2)
@@ -0,0 +1,29 @@
+# test_instrumentation.py
+import asyncio
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from ..executors import executors
+from ..instrumentation import database_sync_to_async, registry
+
+
+@override_settings(GAME_EXECUTORS={'instrumentation-test': {'threads': 4, 'max_queue': 1000, 'overflow': 'defer'}})
+class SyncCounterTests(SimpleTestCase):
+
+    async def test_counters_settle_after_concurrent_calls(self):
+        @database_sync_to_async(executor='instrumentation-test')
+        def work():
+            time.sleep(0.0005)
+
+        calls = registry.get('sync', work.__qualname__).calls
+        queued, running = registry.sync_queued, registry.sync_running
+        await asyncio.gather(*[work() for _ in range(400)])
+
+        pool = executors.get('instrumentation-test')
+        self.assertEqual((pool.queued, pool.running, pool.completed), (0, 0, 400))
+        self.assertEqual((registry.sync_queued, registry.sync_running), (queued, running))
+        stats = registry.get('sync', work.__qualname__)
+        self.assertEqual(stats.calls - calls, 400)
+        self.assertEqual(stats.duration.count, stats.calls)
+        self.assertEqual(stats.queue_wait.count, stats.calls)
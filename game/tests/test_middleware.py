@@ -0,0 +1,36 @@
+# test_middleware.py
+import asyncio
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..middleware import JwtAuthMiddleware, get_user_cache, invalidate_cached_user
+
+
+class JwtAuthMiddlewareTests(TransactionTestCase):
+
+    def setUp(self):
+        get_user_cache().clear()
+        self.user = User.objects.create_user(username='socket', password='pass')
+        self.token = str(AccessToken.for_user(self.user))
+        self.middleware = JwtAuthMiddleware(None)
+
+    async def test_resolved_users_are_cached(self):
+        with mock.patch.object(JwtAuthMiddleware, 'load_user', wraps=self.middleware.load_user) as load_user:
+            first = await self.middleware.authenticate(self.token)
+            second = await self.middleware.authenticate(self.token)
+        self.assertEqual((first.id, second.id), (self.user.id, self.user.id))
+        self.assertEqual(load_user.call_count, 1)
+
+    async def test_invalidation_drops_the_cached_user(self):
+        await self.middleware.authenticate(self.token)
+        await asyncio.to_thread(invalidate_cached_user, self.user.id)
+        with mock.patch.object(JwtAuthMiddleware, 'load_user', wraps=self.middleware.load_user) as load_user:
+            await self.middleware.authenticate(self.token)
+        self.assertEqual(load_user.call_count, 1)
+
+    async def test_bad_tokens_are_anonymous(self):
+        user = await self.middleware.authenticate('not-a-token')
+        self.assertTrue(user.is_anonymous)
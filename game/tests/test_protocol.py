@@ -0,0 +1,36 @@
+# test_protocol.py
+from django.test import SimpleTestCase
+
+from .. import engine
+from ..protocol import MsgpackCodec, Roster, encode_event
+from .test_engine import started_state, wolf_of
+
+
+class MsgpackRoundResultTests(SimpleTestCase):
+
+    def setUp(self):
+        self.state = started_state()
+        self.state.add_round(1)
+        engine.start_round(self.state, self.state.host_id, 1)
+        self.roster = Roster(self.state.players.values())
+
+    def round_result(self, wolf_order, pack_order):
+        engine.submit_wolf_order(self.state, wolf_of(self.state, 1), wolf_order, 1)
+        events = engine.submit_pack_order(self.state, pack_order, 1)
+        return encode_event(events[0], self.roster)
+
+    def test_rankings_keep_their_order(self):
+        event = self.round_result({'3': 0, '1': 2, '2': 1}, {'2': 0, '3': 1, '1': 2})
+        message = MsgpackCodec().decode(event['frames']['bytes'], self.roster)
+
+        self.assertEqual(message['type'], 'round_result')
+        self.assertEqual(message['wolf_order'], [2, 1, 0])
+        self.assertEqual(message['pack_order'], [1, 2, 0])
+        current_round = self.state.rounds[1]
+        self.assertEqual(self.roster.order_from_indices(message['wolf_order']), current_round.wolf_ranking)
+        self.assertEqual(self.roster.order_from_indices(message['pack_order']), current_round.pack_ranking)
+
+    def test_json_rankings_are_in_rank_order(self):
+        event = self.round_result({'3': 0, '1': 2, '2': 1}, {'1': 1, '3': 0})
+        self.assertEqual(list(event['wolf_order'].values()), ['user3', 'user2', 'user1'])
+        self.assertEqual(list(event['pack_order'].values()), ['user3', 'user1'])
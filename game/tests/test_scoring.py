@@ -0,0 +1,81 @@
+# test_scoring.py
+from array import array
+
+from django.test import SimpleTestCase
+
+from ..scoring import MISSING, InvalidRanking, get_rule, score, score_many, to_arrays, validate_ranking
+
+WOLF = {'1': 0, '2': 1, '3': 2, '4': 3}
+
+# Pack rankings against WOLF and the points each rule gives them
+EXPECTED = [
+    ('identical', {'1': 0, '2': 1, '3': 2, '4': 3},
+     {'positional': 4, 'kendall': 6, 'footrule': 8, 'partial': 8}),
+    ('reversed', {'1': 3, '2': 2, '3': 1, '4': 0},
+     {'positional': 0, 'kendall': 0, 'footrule': 0, 'partial': 2}),
+    ('one swap', {'1': 1, '2': 0, '3': 2, '4': 3},
+     {'positional': 2, 'kendall': 5, 'footrule': 6, 'partial': 6}),
+    ('two left out', {'1': 0, '2': 1},
+     {'positional': 2, 'kendall': 1, 'footrule': 0, 'partial': 4}),
+    ('empty', {},
+     {'positional': 0, 'kendall': 0, 'footrule': 0, 'partial': 0}),
+]
+
+
+class ScoringRuleTests(SimpleTestCase):
+
+    def test_rules_on_known_rankings(self):
+        for name, pack, points in EXPECTED:
+            for rule, expected in points.items():
+                with self.subTest(ranking=name, rule=rule):
+                    self.assertEqual(score(WOLF, pack, rule), expected)
+
+    def test_default_rule_is_positional(self):
+        self.assertEqual(score(WOLF, {'1': 1, '2': 0, '3': 2, '4': 3}), 2)
+        with self.settings(GAME_SCORING_RULE='kendall'):
+            self.assertEqual(score(WOLF, {'1': 1, '2': 0, '3': 2, '4': 3}), 5)
+
+    def test_rule_by_dotted_path(self):
+        self.assertEqual(score(WOLF, WOLF, 'game.scoring.kendall'), 6)
+
+    def test_kendall_counts_inversions_of_long_rankings(self):
+        wolf = {str(n): n for n in range(50)}
+        pack = {str(n): 49 - n for n in range(50)}
+        self.assertEqual(score(wolf, pack, 'kendall'), 0)
+        pack['0'], pack['49'] = 0, 49
+        # Only the pairs between the two corrected players and the rest, and
+        # the pair of them, are now concordant
+        self.assertEqual(score(wolf, pack, 'kendall'), 2 * 48 + 1)
+
+    def test_to_arrays_marks_missing_players(self):
+        wolf, pack = to_arrays(WOLF, {'2': 0})
+        self.assertEqual(wolf, array('l', [0, 1, 2, 3]))
+        self.assertEqual(pack, array('l', [MISSING, 0, MISSING, MISSING]))
+
+    def test_score_many_matches_score(self):
+        rankings = [(WOLF, pack) for _, pack, _ in EXPECTED] + [(None, None)]
+        for rule in ('positional', 'kendall', 'footrule', 'partial'):
+            with self.subTest(rule=rule):
+                self.assertEqual(list(score_many(rankings, rule)),
+                                 [score(wolf, pack, rule) for wolf, pack in rankings])
+
+    def test_unknown_rule(self):
+        with self.assertRaises(ImportError):
+            get_rule('game.scoring.no_such_rule')
+
+
+class ValidateRankingTests(SimpleTestCase):
+
+    def test_valid_ranking(self):
+        self.assertEqual(validate_ranking({'1': 0, '2': 1}, {1: None, 2: None}), {'1': 0, '2': 1})
+
+    def test_player_ids_are_made_canonical(self):
+        self.assertEqual(validate_ranking({'01': 1, ' 2': 0}, {1: None, 2: None}), {'1': 1, '2': 0})
+
+    def test_invalid_rankings(self):
+        players = {1: None, 2: None}
+        for ranking in (['1', '2'], {'3': 0}, {'x': 0}, {'1': -1}, {'1': '0'}, {'1': 0, '2': 0}, {'1': True},
+                        {'1': 2}, {'1': 10 ** 20}, {'1': 0, '01': 1}):
+            with self.subTest(ranking=ranking):
+                with self.assertRaises(InvalidRanking):
+                    validate_ranking(ranking, players)
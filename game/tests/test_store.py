@@ -0,0 +1,270 @@
+# test_store.py
+"""
+The same behaviour checked against every GameStateStore backend. The Redis
+store runs on fakeredis, each test with a server of its own.
+"""
+import asyncio
+from unittest import mock, skipIf
+
+from django.test import TransactionTestCase
+
+from .. import state as state_module
+from ..models import Game, Player, Room
+from ..state import RoomState
+from ..store import InMemoryGameStateStore, RedisGameStateStore
+from .utils import create_room
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def award(points):
+    """A mutation giving the pack of the first player points"""
+    def mutate(state):
+        wolf = next(iter(state.players.values()))
+        state.award_pack_score(wolf.user_id, points)
+        return sum(player.score for player in state.players.values())
+    return mutate
+
+
+class StoreTests:
+    """Mixed into one TransactionTestCase per backend, which defines make_store"""
+
+    def make_store(self, event_log_size=16):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.room = create_room()
+        self.store = self.make_store()
+
+    async def test_load_reads_the_room(self):
+        state = await self.store.load(self.room.code)
+        self.assertEqual(state.room_id, self.room.id)
+        self.assertEqual(len(state.players), 3)
+        self.assertIsNotNone(state.game_id)
+        self.assertEqual(state.round_status, 'waiting_to_start')
+
+    async def test_load_missing_room(self):
+        with self.assertRaises(Room.DoesNotExist):
+            await self.store.load('NOROOM')
+
+    async def test_load_retries_until_the_game_exists(self):
+        room = await asyncio.to_thread(create_room, 'LOBBY1', 2, False)
+        state = await self.store.load(room.code)
+        self.assertIsNone(state.game_id)
+
+        await asyncio.to_thread(Game.objects.create, room=room, current_round=1, game_over=False,
+                                wolfed_users=[], round_status='waiting_to_start')
+        state = await self.store.load(room.code)
+        self.assertIsNotNone(state.game_id)
+
+    async def test_acquire_and_release_count_connections(self):
+        await self.store.acquire(self.room.code)
+        await self.store.acquire(self.room.code)
+        self.assertEqual(self.store.connections[self.room.code], 2)
+
+        await self.store.release(self.room.code)
+        self.assertEqual(self.store.connections[self.room.code], 1)
+        await self.store.release(self.room.code)
+        self.assertNotIn(self.room.code, self.store.connections)
+
+    async def test_last_release_flushes_changes(self):
+        await self.store.acquire(self.room.code)
+        await self.store.update(self.room.code, award(3))
+        self.store.save(self.room.code)
+        await self.store.release(self.room.code)
+
+        scores = await asyncio.to_thread(
+            lambda: sorted(Player.objects.filter(players=self.room).values_list('score', flat=True)))
+        self.assertEqual(scores, [0, 3, 3])
+        state = await self.store._read(self.room.code)
+        self.assertTrue(state is None or not state.is_dirty)
+
+    async def test_releasing_rooms_before_the_game_does_not_deadlock(self):
+        # Both flushes hold a gameplay thread, neither may wait for another
+        rooms = [await asyncio.to_thread(create_room, code, 2, False) for code in ('LOBBY1', 'LOBBY2')]
+        for room in rooms:
+            await self.store.acquire(room.code)
+
+        await asyncio.wait_for(asyncio.gather(*[self.store.release(room.code) for room in rooms]), 10)
+        for room in rooms:
+            self.assertNotIn(room.code, self.store.connections)
+
+    async def test_flush_skips_rooms_it_does_not_hold(self):
+        self.assertIsNone(await self.store.update(self.room.code, RoomState.take_changes, load=False))
+        self.assertIsNone(await self.store._read(self.room.code))
+
+    async def test_evict_keeps_dirty_state(self):
+        await self.store.load(self.room.code)
+        await self.store.update(self.room.code, award(1))
+        await self.store.evict(self.room.code)
+
+        state = await self.store._read(self.room.code)
+        self.assertIsNotNone(state)
+        self.assertTrue(state.is_dirty)
+
+    async def test_concurrent_updates_are_atomic(self):
+        await self.store.load(self.room.code)
+        calls = []
+
+        def increment(state):
+            calls.append(1)
+            for player in state.players.values():
+                player.score += 1
+
+        await asyncio.gather(*[self.store.update(self.room.code, increment) for _ in range(25)])
+
+        state = await self.store.load(self.room.code)
+        self.assertEqual([player.score for player in state.players.values()], [25, 25, 25])
+        # A Redis update that lost its WATCH runs the mutation again
+        self.assertGreaterEqual(len(calls), 25)
+
+    async def test_take_and_restore_changes(self):
+        await self.store.load(self.room.code)
+        await self.store.update(self.room.code, award(2))
+        await self.store.update(self.room.code, lambda state: state.add_round(1))
+
+        changes, rounds, games, awards = await self.store.update(self.room.code, RoomState.take_changes)
+        self.assertEqual([round_obj.round_number for round_obj in rounds], [1])
+        self.assertEqual(games, [])
+        self.assertEqual(len(awards), 1)
+        state = await self.store.load(self.room.code)
+        self.assertFalse(state.is_dirty)
+
+        await self.store.update(self.room.code, award(1))
+        await self.store.update(self.room.code, lambda state: state.restore_changes(changes))
+        state = await self.store.load(self.room.code)
+        self.assertEqual(state.dirty_rounds, {1})
+        # Restored awards go before the ones made since
+        self.assertEqual([points for _, points in state.score_awards], [2, 1])
+
+    async def test_event_log_replays_events_after_a_sequence(self):
+        await self.store.load(self.room.code)
+        events = await self.store.update(
+            self.room.code, lambda state: state.sequence([{'type': 'event', 'n': n} for n in range(5)]))
+        await self.store.events.append(self.room.code, events)
+
+        replayed = await self.store.events.since(self.room.code, 2, 5)
+        self.assertEqual([event['seq'] for event in replayed], [3, 4, 5])
+        self.assertEqual(await self.store.events.since(self.room.code, 5, 5), [])
+
+    async def test_event_log_reports_a_gap(self):
+        self.store = self.make_store(event_log_size=4)
+        await self.store.load(self.room.code)
+        for n in range(10):
+            events = await self.store.update(
+                self.room.code, lambda state: state.sequence([{'type': 'event', 'n': n}]))
+            await self.store.events.append(self.room.code, events)
+
+        self.assertIsNone(await self.store.events.since(self.room.code, 0, 10))
+        replayed = await self.store.events.since(self.room.code, 7, 10)
+        self.assertEqual([event['seq'] for event in replayed], [8, 9, 10])
+
+
+class InMemoryGameStateStoreTests(StoreTests, TransactionTestCase):
+
+    def make_store(self, event_log_size=16):
+        return InMemoryGameStateStore(flush_interval=60, event_log_size=event_log_size)
+
+    async def test_last_release_evicts_the_room(self):
+        await self.store.acquire(self.room.code)
+        await self.store.release(self.room.code)
+        self.assertNotIn(self.room.code, self.store.rooms)
+        self.assertNotIn(self.room.code, self.store.events.rooms)
+
+
+@skipIf(fakeredis is None, "fakeredis is not installed, see requirements-dev.txt")
+class RedisGameStateStoreTests(StoreTests, TransactionTestCase):
+
+    def make_store(self, event_log_size=16):
+        client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+        return RedisGameStateStore(client=client, flush_interval=60, event_log_size=event_log_size, lease_ttl=1)
+
+    async def test_fields_round_trip(self):
+        await self.store.load(self.room.code)
+        await self.store.update(self.room.code, award(2))
+        await self.store.update(self.room.code, lambda state: state.add_round(1))
+        await self.store.update(self.room.code, lambda state: state.remember_action('retry-1'))
+
+        state = await self.store.load(self.room.code)
+        self.assertEqual(RoomState.from_fields(state.to_fields()).to_fields(), state.to_fields())
+        self.assertEqual(state.action_keys, ['retry-1'])
+        self.assertEqual(state.rounds[1].question, 'Question for round 1')
+
+    async def test_lease_orders_holders(self):
+        order = []
+
+        async def hold(name):
+            async with self.store.lease(self.room.code):
+                order.append(f'{name} in')
+                await asyncio.sleep(0.01)
+                order.append(f'{name} out')
+
+        await asyncio.gather(hold('a'), hold('b'))
+        self.assertIn(order, [['a in', 'a out', 'b in', 'b out'], ['b in', 'b out', 'a in', 'a out']])
+
+
+class WriteBehindTests(TransactionTestCase):
+
+    def setUp(self):
+        self.room = create_room()
+        self.store = InMemoryGameStateStore(flush_interval=1)
+        self.writer = self.store.writer
+
+    def failing_for(self, *failing_codes):
+        """Patch persist_room_changes to fail for batches holding any of failing_codes"""
+        persist = state_module.persist_room_changes
+
+        def fail_or_persist(store, room_codes):
+            if set(failing_codes) & set(room_codes):
+                raise RuntimeError('database unavailable')
+            return persist(store, room_codes)
+        return mock.patch.object(state_module, 'persist_room_changes', fail_or_persist)
+
+    async def scores(self, room):
+        return await asyncio.to_thread(
+            lambda: sorted(Player.objects.filter(players=room).values_list('score', flat=True)))
+
+    async def test_failed_flush_backs_off(self):
+        await self.store.load(self.room.code)
+        await self.store.update(self.room.code, award(2))
+        with self.failing_for(self.room.code), self.assertLogs('game.state', 'ERROR'):
+            await self.store.save_now(self.room.code)
+            await self.store.save_now(self.room.code)
+
+        self.assertEqual(self.writer.failures[self.room.code], 2)
+        retry = self.writer._retries[self.room.code]
+        self.assertAlmostEqual(retry.when() - asyncio.get_running_loop().time(), 4, delta=0.5)
+        self.assertTrue((await self.store._read(self.room.code)).is_dirty)
+
+        await self.store.save_now(self.room.code)
+        self.assertEqual(await self.scores(self.room), [0, 2, 2])
+        self.assertNotIn(self.room.code, self.writer.failures)
+        self.assertNotIn(self.room.code, self.writer._retries)
+
+    async def test_changes_are_dropped_after_the_last_attempt(self):
+        self.writer.max_attempts = 2
+        await self.store.load(self.room.code)
+        await self.store.update(self.room.code, award(2))
+        with self.failing_for(self.room.code), self.assertLogs('game.state', 'ERROR') as logs:
+            await self.store.save_now(self.room.code)
+            await self.store.save_now(self.room.code)
+
+        self.assertIn('dropping its changes', logs.output[-1])
+        self.assertNotIn(self.room.code, self.writer.failures)
+        self.assertIsNone(await self.store._read(self.room.code))
+        self.assertEqual(await self.scores(self.room), [0, 0, 0])
+
+    async def test_one_failing_room_does_not_hold_back_the_others(self):
+        other = await asyncio.to_thread(create_room, 'STORE2')
+        for room in (self.room, other):
+            await self.store.load(room.code)
+            await self.store.update(room.code, award(1))
+            self.store.save(room.code)
+
+        with self.failing_for(self.room.code), self.assertLogs('game.state', 'WARNING'):
+            await self.writer.flush()
+        self.assertEqual(await self.scores(other), [0, 1, 1])
+        self.assertEqual(self.writer.failures, {self.room.code: 1})
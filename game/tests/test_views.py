@@ -0,0 +1,236 @@
+# test_views.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ..models import Game, Player, Room, Round
+from .utils import create_room
+
+
+def client_for(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def race(count, request):
+    """
+    Call request(n) from count threads at once and return the responses.
+    SQLite locks whole tables against concurrent writers, so tests using it
+    only run on databases with row locks.
+    """
+    barrier = threading.Barrier(count)
+
+    def run(n):
+        try:
+            barrier.wait()
+            return request(n)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(count) as pool:
+        return list(pool.map(run, range(count)))
+
+
+class JoinGameRoomTests(TransactionTestCase):
+
+    def setUp(self):
+        self.room = create_room('JOIN01', players=1, started=False, max_players=3)
+        self.users = [User.objects.create_user(f'joiner{n}', password='pw') for n in range(8)]
+
+    def join(self, user):
+        return client_for(user).post(reverse('join_room'), {'room_code': self.room.code}, format='json')
+
+    def test_join_and_rejoin(self):
+        self.assertEqual(self.join(self.users[0]).status_code, 200)
+        response = self.join(self.users[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'You are already in this room.')
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.player_count, 2)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_joins_never_overfill(self):
+        responses = race(len(self.users), lambda n: self.join(self.users[n]))
+
+        self.assertEqual(sorted(response.status_code for response in responses), [200] * 2 + [403] * 6)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.player_count, 3)
+        self.assertEqual(self.room.players.count(), 3)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_joins_of_one_user_take_one_seat(self):
+        responses = race(4, lambda n: self.join(self.users[0]))
+
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.player_count, 2)
+        self.assertEqual(Player.objects.filter(user=self.users[0]).count(), 1)
+
+    def test_full_room_still_answers_members(self):
+        self.join(self.users[0])
+        self.join(self.users[1])
+        self.assertEqual(self.join(self.users[2]).status_code, 403)
+        response = self.join(self.users[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'You are already in this room.')
+
+
+class StartGameTests(TransactionTestCase):
+
+    def setUp(self):
+        self.room = create_room('START1', players=3, started=False)
+        self.host = self.room.host
+
+    def start(self):
+        return client_for(self.host).post(reverse('start_game'), {'room_code': self.room.code}, format='json')
+
+    def test_second_start_is_rejected(self):
+        self.assertEqual(self.start().status_code, 200)
+        self.assertEqual(self.start().status_code, 400)
+        self.assertEqual(Game.objects.filter(room=self.room).count(), 1)
+        self.assertEqual(Round.objects.filter(room=self.room).count(), 3)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_starts_create_one_game(self):
+        responses = race(4, lambda n: self.start())
+
+        self.assertEqual(sorted(response.status_code for response in responses), [200, 400, 400, 400])
+        self.assertEqual(Game.objects.filter(room=self.room).count(), 1)
+        self.assertEqual(Round.objects.filter(room=self.room).count(), 3)
+
+    @override_settings(GAME_LAZY_ROUNDS=True)
+    def test_lazy_rounds(self):
+        self.assertEqual(self.start().status_code, 200)
+        self.assertEqual(Game.objects.filter(room=self.room).count(), 1)
+        self.assertFalse(Round.objects.filter(room=self.room).exists())
+
+    def test_only_the_host_starts(self):
+        guest = self.room.players.exclude(user=self.host).first().user
+        response = client_for(guest).post(reverse('start_game'), {'room_code': self.room.code}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Room.objects.get(pk=self.room.pk).game_started)
+
+
+class GetRoomDetailsTests(TransactionTestCase):
+
+    def setUp(self):
+        self.room = create_room('ETAG01', players=2, started=False)
+        self.client = client_for(self.room.host)
+
+    def details(self, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse('get_players'), {'room_code': self.room.code}, headers=headers)
+
+    def test_unchanged_room_is_not_modified(self):
+        response = self.details()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.details(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.details(f'"other", {etag}').status_code, 304)
+
+    def test_changed_room_gets_a_new_etag(self):
+        etag = self.details()['ETag']
+
+        joiner = User.objects.create_user('late', password='pw')
+        client_for(joiner).post(reverse('join_room'), {'room_code': self.room.code}, format='json')
+
+        response = self.details(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['player_count'], 3)
+
+    def test_missing_room(self):
+        response = self.client.get(reverse('get_players'), {'room_code': 'NOROOM'}, headers={'If-None-Match': '"x"'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_host_leaving_changes_host_and_version_together(self):
+        etag = self.details()['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('leave_room'), {'room_code': self.room.code}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        room_updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "game_room"')]
+        self.assertEqual(len(room_updates), 1)
+        self.assertIn('"host_id"', room_updates[0])
+        self.assertIn('"version"', room_updates[0])
+
+        new_host = self.room.players.get().user
+        response = client_for(new_host).get(reverse('get_players'), {'room_code': self.room.code},
+                                            headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['host'], new_host.username)
+        self.assertEqual(response.data['player_count'], 1)
+
+    def test_last_player_leaving_closes_the_room(self):
+        guest = self.room.players.exclude(user=self.room.host).get().user
+        client_for(guest).post(reverse('leave_room'), {'room_code': self.room.code}, format='json')
+        response = self.client.post(reverse('leave_room'), {'room_code': self.room.code}, format='json')
+        self.assertEqual(response.data['message'], 'Room closed as no players are left.')
+        self.assertFalse(Room.objects.filter(pk=self.room.pk).exists())
+
+    def test_new_room_starts_with_its_host(self):
+        host = User.objects.create_user('creator', password='pw')
+        response = client_for(host).post(reverse('create_room'), {'name': 'New room'}, format='json')
+        code = response.data['room_code']
+
+        response = client_for(host).get(reverse('get_players'), {'room_code': code})
+        self.assertEqual(response.data['version'], 0)
+        self.assertEqual([player['user__username'] for player in response.data['current_players']], ['creator'])
+
+
+class ProfilerTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client = client_for(admin)
+
+    def post(self, data):
+        return self.client.post(reverse('profiler'), data, format='json')
+
+    def test_rejects_bad_intervals(self):
+        for interval in ('fast', None, [1], 0, -1, 0.00001, 'nan', 'inf'):
+            with self.subTest(interval=interval):
+                self.assertEqual(self.post({'enabled': True, 'interval': interval}).status_code, 400)
+        self.assertFalse(self.post({'enabled': False}).data['enabled'])
+
+    def test_start_and_stop(self):
+        response = self.post({'enabled': True, 'interval': '0.01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['enabled'])
+        self.assertFalse(self.post({'enabled': False}).data['enabled'])
+
+
+class MetricsTests(TestCase):
+
+    def get(self, client=None, token=None):
+        client = client or APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client.get(reverse('metrics'))
+
+    def test_requires_staff(self):
+        self.assertEqual(self.get().status_code, 401)
+        player = User.objects.create_user('player', password='pw')
+        self.assertEqual(self.get(client_for(player)).status_code, 403)
+        admin = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.assertEqual(self.get(client_for(admin)).status_code, 200)
+
+    @override_settings(GAME_METRICS_TOKEN='scrape-secret')
+    def test_scrape_token(self):
+        response = self.get(token='scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        self.assertEqual(self.get(token='wrong-secret').status_code, 401)
+
+    def test_no_token_is_configured_by_default(self):
+        self.assertEqual(self.get(token='None').status_code, 401)
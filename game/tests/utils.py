@@ -0,0 +1,17 @@
+# utils.py
+from django.contrib.auth.models import User
+
+from ..models import Game, Player, Room
+
+
+def create_room(code='STORE1', players=3, started=True, max_players=10):
+    """A room with players users, the first one hosting, and its game unless started is False"""
+    users = [User.objects.create_user(f'{code.lower()}-{i}', password='pw') for i in range(players)]
+    room = Room.objects.create(name=f'Room {code}', code=code, host=users[0], max_players=max_players,
+                               player_count=players, game_started=started)
+    for user in users:
+        room.players.add(Player.objects.create(user=user, unique_id=f'{code}-{user.id}'))
+    if started:
+        Game.objects.create(room=room, current_round=1, game_over=False, wolfed_users=[],
+                            round_status='waiting_to_start')
+    return room
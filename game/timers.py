@@ -0,0 +1,81 @@
+# timers.py
+"""
+Deadline scheduling for many rooms on a single asyncio task.
+
+Deadlines are kept in a heap keyed by wall-clock time, so scheduling and
+cancelling are O(log n) and a worker with thousands of rooms still runs one
+sleeping task instead of one per room. Rescheduling a key just pushes a new
+entry; stale heap entries are skipped when they reach the top.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+
+    def __init__(self):
+        self._heap = []  # (deadline, seq, key)
+        self._entries = {}  # key -> (deadline, seq, callback)
+        self._seq = itertools.count()
+        self._task = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def deadline(self, key):
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def schedule(self, key, deadline, callback):
+        """
+        Call callback() (a coroutine function) once time.time() reaches
+        deadline, replacing any deadline already scheduled for key.
+        """
+        seq = next(self._seq)
+        self._entries[key] = (deadline, seq, callback)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        elif self._heap[0][1] == seq:
+            # New earliest deadline, wake the runner so it sleeps less
+            self._wakeup.set()
+
+    def cancel(self, key):
+        self._entries.pop(key, None)
+
+    async def _run(self):
+        while self._heap:
+            deadline, seq, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != seq:
+                heapq.heappop(self._heap)
+                continue
+
+            delay = deadline - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            del self._entries[key]
+            asyncio.ensure_future(self._fire(key, entry[2]))
+
+    async def _fire(self, key, callback):
+        try:
+            await callback()
+        except Exception:
+            logger.exception("Timer callback for %s failed", key)
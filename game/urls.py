@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import CreateGameRoom, JoinGameRoom, LeaveGameRoom, StartGame, GetRoomDetails
+from .views import CreateGameRoom, JoinGameRoom, LeaveGameRoom, StartGame, GetRoomDetails, GetGameStatistics, Leaderboard, PlayerHistory, Metrics, Profiler
 
 urlpatterns = [
     path("create-room/", CreateGameRoom.as_view(), name="create_room"),
@@ -7,4 +7,9 @@ urlpatterns = [
     path("leave-room/", LeaveGameRoom.as_view(), name="leave_room"),
     path("start-game/", StartGame.as_view(), name="start_game"),
     path("get-room-details/", GetRoomDetails.as_view(), name="get_players"),
+    path("game-statistics/", GetGameStatistics.as_view(), name="game_statistics"),
+    path("leaderboard/", Leaderboard.as_view(), name="leaderboard"),
+    path("player-history/", PlayerHistory.as_view(), name="player_history"),
+    path("metrics/", Metrics.as_view(), name="metrics"),
+    path("profiler/", Profiler.as_view(), name="profiler"),
 ]
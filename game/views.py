@@ -1,22 +1,42 @@
 from django.shortcuts import render
 
 # Create your views here.
-import random
-import string
+import hmac
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.utils.http import parse_etags
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import BasePermission, IsAdminUser, IsAuthenticated
 from rest_framework import status
-from django.contrib.auth.models import User
-from .models import Room, Player, Round, Game
-
-
-def generate_unique_code(length=6):
-    """Generate a unique room code."""
+from rest_framework.settings import api_settings
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import Http404, HttpResponse
+from .codes import room_codes
+from .instrumentation import MIN_PROFILER_INTERVAL, profiler, registry
+from .leaderboard import get_leaderboard, get_player_history
+from .models import Room, Player, PlayerStats, Round, Game
+from .snapshots import build_room_snapshot, get_room_version, room_etag
+from .statistics import build_game_statistics
+
+
+def create_room_with_code(**fields):
+    """
+    Create a room with a freshly allocated code. Allocated codes never
+    collide with each other; the retry only covers codes handed out by the
+    old random generator.
+    """
     while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-        if not Room.objects.filter(code=code).exists():
-            return code
+        code = room_codes.allocate()
+        try:
+            with transaction.atomic():
+                return Room.objects.create(code=code, **fields)
+        except IntegrityError:
+            continue
 
 
 class CreateGameRoom(APIView):
@@ -37,18 +57,19 @@ class CreateGameRoom(APIView):
         if max_players < 2:
             return Response({"error": "Max players must be at least 2."}, status=status.HTTP_400_BAD_REQUEST)
 
-        code = generate_unique_code()
-        room = Room.objects.create(
-            name=name,
-            code=code,
-            host=user,
-            max_players=max_players
-        )
+        # Pollers only see the room once its host is in it, at the room's first version
+        with transaction.atomic():
+            room = create_room_with_code(
+                name=name,
+                host=user,
+                max_players=max_players,
+                player_count=1,
+            )
 
-        # Add the host as the first player
-        uid = code + "-" + str(user.id)
-        player = Player.objects.create(user=user, unique_id=uid)
-        room.players.add(player)
+            # Add the host as the first player
+            uid = room.code + "-" + str(user.id)
+            player = Player.objects.create(user=user, unique_id=uid)
+            room.players.add(player)
 
         return Response({
             "message": "Room created successfully.",
@@ -76,20 +97,33 @@ class JoinGameRoom(APIView):
         except Room.DoesNotExist:
             return Response({"error": "Room not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        if room.players.count() >= room.max_players:
-            return Response({"error": "Room is full."}, status=status.HTTP_403_FORBIDDEN)
-        
         uid = room_code + "-" + str(user.id)
+        already_joined = Response({"message": "You are already in this room."}, status=status.HTTP_200_OK)
 
-        # Check if the user is already in the room
-        if Player.objects.filter(user=user, unique_id=uid).exists():
-            return Response({"message": "You are already in this room."}, status=status.HTTP_200_OK)
-
-        # Add the user as a player
-        player = Player.objects.create(user=user, unique_id=uid)
-        print("Before : ", room.players.count(), room.players.all())
-        room.players.add(player)
-        print("After : ", room.players.count(), room.players.all())
+        try:
+            with transaction.atomic():
+                # Lock the room, so joins to it (a double submitted join too) go one at a time
+                list(Room.objects.select_for_update().filter(pk=room.pk).values_list("id", flat=True))
+
+                # Check if the user is already in the room
+                if Player.objects.filter(user=user, unique_id=uid).exists():
+                    return already_joined
+
+                # Claim a seat. The capacity check and the increment are one
+                # conditional UPDATE, so concurrent joins can't overfill the room.
+                claimed = Room.objects.filter(
+                    pk=room.pk, player_count__lt=F("max_players")
+                ).update(player_count=F("player_count") + 1, version=F("version") + 1, last_activity=Now())
+                if not claimed:
+                    return Response({"error": "Room is full."}, status=status.HTTP_403_FORBIDDEN)
+
+                # Add the user as a player
+                player = Player.objects.create(user=user, unique_id=uid)
+                room.players.add(player)
+        except IntegrityError:
+            # A concurrent join of the same user won on the player's unique
+            # constraint. The seat claimed above was rolled back with it.
+            return already_joined
 
         return Response({
             "message": "Joined room successfully.",
@@ -125,29 +159,41 @@ class LeaveGameRoom(APIView):
         except Player.DoesNotExist:
             return Response({"error": "You are not part of this room."}, status=status.HTTP_403_FORBIDDEN)
 
-        # Remove the player from the room
-        player.delete()
-        room.players.remove(player)
-
-        # If the leaving player is the host
-        if room.host == user:
-            remaining_players = room.players.all()
-            if remaining_players.exists():
+        with transaction.atomic():
+            # Remove the player from the room
+            room.players.remove(player)
+            player.delete()
+
+            # The new count, a new host if the host left, and the version
+            # bump go in one UPDATE, so no poller sees the new version with
+            # the old room
+            changes = {"player_count": F("player_count") - 1, "version": F("version") + 1, "last_activity": Now()}
+            is_host = room.host_id == user.id
+            if is_host:
                 # Assign new host to the first remaining player
-                new_host = remaining_players.first().user
-                room.host = new_host
-                room.save()
-            else:
-                # If no players are left, delete the room
+                new_host_id = (
+                    room.players.filter(user__isnull=False).order_by("pk").values_list("user_id", flat=True).first()
+                )
+                if new_host_id is not None:
+                    changes["host_id"] = new_host_id
+            Room.objects.filter(pk=room.pk, player_count__gt=0).update(**changes)
+            room.refresh_from_db(fields=["player_count"])
+
+            # If no players are left, delete the room
+            closed = is_host and new_host_id is None
+            if closed:
                 room.delete()
-                return Response({
-                    "message": "Room closed as no players are left.",
-                }, status=status.HTTP_200_OK)
+
+        if closed:
+            room_codes.release(room_code)
+            return Response({
+                "message": "Room closed as no players are left.",
+            }, status=status.HTTP_200_OK)
 
         return Response({
             "message": "You have left the room.",
             "room_code": room_code,
-            "remaining_players": room.players.count()
+            "remaining_players": room.player_count
         }, status=status.HTTP_200_OK)
     
 class GetRoomDetails(APIView):
@@ -156,35 +202,162 @@ class GetRoomDetails(APIView):
     def get(self, request):
         """
         Get details of a specific room using the room code.
-        Returns room name, host, current players, and max players.
+        Returns room name, host, current players, max players and game status.
+        Supports If-None-Match with the returned ETag.
         """
-        user = request.user
         room_code = request.query_params.get("room_code")
 
         if not room_code:
             return Response({"error": "Room code is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            room = Room.objects.get(code=room_code)
-        except Room.DoesNotExist:
+        # Unchanged rooms are answered from the version column alone
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            version = get_room_version(room_code)
+            if version is not None:
+                etag = room_etag(room_code, version)
+                if etag in parse_etags(if_none_match):
+                    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        snapshot = build_room_snapshot(room_code)
+        if snapshot is None:
+            return Response({"error": "Room not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(snapshot, headers={"ETag": room_etag(room_code, snapshot["version"])})
+
+class GetGameStatistics(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Get the statistics of the rounds played so far in a room.
+        Returns the same payload that is sent with the game_end message.
+        """
+        room_code = request.query_params.get("room_code")
+
+        if not room_code:
+            return Response({"error": "Room code is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        room_id = Room.objects.filter(code=room_code).values_list("id", flat=True).first()
+        if room_id is None:
             return Response({"error": "Room not found."}, status=status.HTTP_404_NOT_FOUND)
-        
+
         return Response({
-            "room_code": room.code,
-            "room_name": room.name,
-            "host": room.host.username,
-            "current_players": list(room.players.values("id", "user__username")),
-            "max_players": room.max_players,
-            "created_at": room.created_at,
+            "room_code": room_code,
+            "statistics": build_game_statistics(room_id),
         })
 
+class Leaderboard(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Get the top players by total score, over all time or for the current
+        week or month (?period=all|week|month, ?limit=10, at most 100).
+        """
+        period = request.query_params.get("period", "all")
+        if period not in PlayerStats.PERIODS:
+            return Response({"error": "Period must be one of all, week or month."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            return Response({"error": "Limit must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(get_leaderboard(period, limit))
+
+class PlayerHistory(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Get a player's all-time stats and their recent weeks and months.
+        Defaults to the requesting user.
+        """
+        username = request.query_params.get("username", request.user.username)
+        history = get_player_history(username)
+        if history["all"] is None:
+            return Response({"error": "No games recorded for this player."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"username": username, **history})
+
+# request.auth of a scraper that presented GAME_METRICS_TOKEN
+METRICS_SCRAPE = 'metrics-scrape'
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    Lets a scraper in with the GAME_METRICS_TOKEN bearer token. Any other
+    token is left to the JWT authentication that follows.
+    """
+
+    def authenticate(self, request):
+        expected = getattr(settings, 'GAME_METRICS_TOKEN', None)
+        parts = get_authorization_header(request).split()
+        if not expected or len(parts) != 2 or parts[0].lower() != b'bearer':
+            return None
+        if not hmac.compare_digest(parts[1], expected.encode()):
+            return None
+        return AnonymousUser(), METRICS_SCRAPE
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
+
+
+class CanReadMetrics(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == METRICS_SCRAPE or bool(request.user and request.user.is_staff)
+
+
+class Metrics(APIView):
+    authentication_classes = [MetricsTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    permission_classes = [CanReadMetrics]
+
+    def get(self, request):
+        """
+        Handler and sync thread metrics of this worker in the Prometheus text format.
+        """
+        if not getattr(settings, 'GAME_INSTRUMENTATION', True):
+            raise Http404
+        return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
+
+class Profiler(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        Get the stacks sampled by this worker's profiler in collapsed format.
+        """
+        return HttpResponse(profiler.render(), content_type="text/plain")
+
+    def post(self, request):
+        """
+        Turn the sampling profiler on or off.
+        Turning it on discards the samples of the previous run.
+        """
+        if request.data.get("enabled"):
+            interval = request.data.get("interval", getattr(settings, 'GAME_PROFILER_INTERVAL', 0.005))
+            try:
+                interval = float(interval)
+            except (TypeError, ValueError):
+                interval = None
+            # Also rejects nan and inf
+            if interval is None or not MIN_PROFILER_INTERVAL <= interval < float("inf"):
+                return Response({"error": f"Interval must be a number of seconds, at least {MIN_PROFILER_INTERVAL}."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            profiler.reset()
+            profiler.start(interval)
+        else:
+            profiler.stop()
+
+        return Response({"enabled": profiler.running, "samples": sum(profiler.samples.values())})
+
 class StartGame(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
         """
         Start the game for a specific room.
-        Initializes the rounds and creates the WolfList for tracking wolfed users.
+        Creates the game and its rounds, or only the game when GAME_LAZY_ROUNDS
+        is set, in which case each round is created when it is started.
         """
         user = request.user  # Assuming the user is authenticated
         room_code = request.data.get("room_code")
@@ -198,46 +371,40 @@ class StartGame(APIView):
             return Response({"error": "Room not found."}, status=status.HTTP_404_NOT_FOUND)
 
         # Ensure the user is the host
-        if room.host != user:
+        if room.host_id != user.id:
             return Response({"error": "Only the host can start the game."}, status=status.HTTP_403_FORBIDDEN)
 
-        # Check if the game has already started
-        if Round.objects.filter(room=room).exists():
-            return Response({"error": "Game has already started for this room."}, status=status.HTTP_400_BAD_REQUEST)
+        if room.game_started:
+            return Response({"error": "Game has already started."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Fetch all players in the room
-        players = room.players.all()
-        if players.count() < 2:
+        num_players = room.player_count
+        if num_players < 2:
             return Response({"error": "At least 2 players are required to start the game."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Initialize Game
-        game = Game.objects.create(room=room, current_round=1, game_over=False, wolfed_users=[], round_status="waiting_to_start")
-        game.save()
-
-        # Create Round models
-        for i in range(1, players.count() + 1):
-            Round.objects.create(
-                room=room,
-                wolf=None,  # To be assigned during gameplay
-                question=f"Question for round {i}",  # Placeholder, can be customized
-                wolf_ranking={},
-                pack_ranking={},
-                pack_score=0,
-                round_number=i,
+        with transaction.atomic():
+            # Claim the start, so a second request racing this one creates nothing
+            claimed = Room.objects.filter(pk=room.pk, game_started=False).update(
+                game_started=True, version=F("version") + 1, last_activity=Now()
             )
-        
-        if room.game_started:
-            return Response({"error": "Game has already started."}, status=status.HTTP_400_BAD_REQUEST)
-        else :
-            room.game_started = True
-            room.save()
+            if not claimed:
+                return Response({"error": "Game has already started."}, status=status.HTTP_400_BAD_REQUEST)
+
+            Game.objects.create(room=room, current_round=1, game_over=False, wolfed_users=[], round_status="waiting_to_start")
+
+            if not getattr(settings, 'GAME_LAZY_ROUNDS', False):
+                Round.objects.bulk_create([
+                    Round(
+                        room=room,
+                        wolf=None,  # To be assigned during gameplay
+                        question=f"Question for round {i}",  # Placeholder, can be customized
+                        round_number=i,
+                    )
+                    for i in range(1, num_players + 1)
+                ])
 
         return Response({
             "message": "Game has started!",
             "room_code": room.code,
-            "num_players": players.count(),
-            "num_rounds": players.count()
+            "num_players": num_players,
+            "num_rounds": num_players
         }, status=status.HTTP_200_OK)
-
-        
-        